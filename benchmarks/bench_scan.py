@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+"""
+End to end scan benchmark against a simulated remote server
+
+Drives Server.acquire_checksum_output, Pipeline.parse, Integrity.load_database, Integrity.identify and the
+database commit for a synthetic file tree, once to set up the baseline and once after churn.
+With --local the tree is written to a temporary directory and scanned by the local scanner instead, which
+includes walking the tree and hashing the files in the acquire phase.
+Results can be stored as JSON and compared against the results of another branch:
+
+    $ python benchmarks/bench_scan.py --files 10000 100000 --json before.json
+    $ python benchmarks/bench_scan.py --files 10000 100000 --compare before.json
+"""
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from contextlib import contextmanager, redirect_stdout
+
+from tabulate import tabulate
+
+from dear.remote_integrity.config import Config
+from dear.remote_integrity.integrity import Integrity
+from dear.remote_integrity.local_scanner import LocalScanner
+from dear.remote_integrity.models import session as database, use_database
+from dear.remote_integrity.pipeline import Pipeline
+from dear.remote_integrity.server import Server
+
+from simulation import SimulatedClient, SimulatedFileSystem
+
+
+START_DIRECTORY = "/var/www"
+
+
+def main():
+    """
+    Main entry point of the benchmark
+    :return: None
+    """
+    args = load_arguments()
+    pipeline = Pipeline(workers=args.workers)
+    results = []
+
+    for files in args.files:
+        with tempfile.TemporaryDirectory() as directory:
+            root = os.path.join(directory, "www") if args.local else START_DIRECTORY
+            file_system = SimulatedFileSystem(files=files, root=root, seed=args.seed)
+            written = {}
+
+            use_database(os.path.join(directory, "integrity.db"))
+
+            if args.local:
+                write_file_system(file_system, written)
+
+            results += run_scan(file_system, pipeline, "baseline", args.memory, args.local)
+
+            file_system.churn(added=args.churn, removed=args.churn, modified=args.churn)
+
+            if args.local:
+                write_file_system(file_system, written)
+
+            results += run_scan(file_system, pipeline, "rescan", args.memory, args.local)
+
+            database.close()
+
+    pipeline.close()
+
+    print_results(results, load_results(args.compare))
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+def run_scan(file_system, pipeline, run, measure_memory, local=False):
+    """
+    Run a single scan against the simulated server and measure every phase
+    :param file_system: Simulated file system of the server
+    :param pipeline: Pipeline used to parse and diff the checksum list
+    :param run: Name of the run (baseline or rescan)
+    :param measure_memory: Whether or not the peak memory usage should be measured
+    :param local: Scan the tree written by write_file_system with the local scanner
+    :type file_system: SimulatedFileSystem
+    :type pipeline: Pipeline
+    :type run: str
+    :type measure_memory: bool
+    :type local: bool
+    :return: List of results, one per phase
+    :rtype: list[dict]
+    """
+    config = build_config()
+    config.start_directory = file_system.root
+
+    if local:
+        config.server_backend = "local"
+        server = LocalScanner(config)
+    else:
+        server = Server(config=config, client=SimulatedClient(file_system))
+
+    integrity = Integrity(config=config, pipeline=pipeline)
+    files = len(file_system.versions)
+
+    def phase(name):
+        return measure(files, run, name, measure_memory)
+
+    with phase("acquire") as result:
+        output = pipeline.parse(server.acquire_checksum_output(), config)
+
+    results = [result]
+
+    with phase("load_database") as result:
+        integrity.load_database()
+
+    results.append(result)
+
+    with phase("identify") as result:
+        integrity.identify(output)
+        integrity.finish_scan_run(files_seen=len(output), bytes_transferred=server.bytes_received)
+
+    results.append(result)
+
+    with phase("commit") as result:
+        database.commit()
+
+    results.append(result)
+    return results
+
+
+@contextmanager
+def measure(files, run, phase, measure_memory):
+    """
+    Measure the wall time and peak memory usage of a phase
+    Output printed by the phase is suppressed
+    :return: Context manager yielding the result dict, which is filled when the phase ends
+    :rtype: dict
+    """
+    result = {"files": files, "run": run, "phase": phase}
+
+    if measure_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+
+    with redirect_stdout(io.StringIO()):
+        yield result
+
+    result["seconds"] = round(time.perf_counter() - start, 4)
+
+    if measure_memory:
+        result["peak_mib"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+        tracemalloc.stop()
+
+
+def build_config():
+    """
+    Build the configuration of the simulated server
+    :return: Configuration object
+    :rtype: Config
+    """
+    config = Config()
+    config.server_name = "benchmark"
+    config.server_baseline = None
+    config.server_backend = "ssh"
+    config.database_storage = "plain"
+    config.start_directory = START_DIRECTORY
+    config.extra_directories = []
+    config.hash_algorithm = "sha512"
+    config.scan_interval = None
+    config.scan_roots = []
+    config.due_roots = None
+    config.partial_hash_threshold = None
+    config.partial_hash_chunks = 8
+    config.partial_hash_full_interval = None
+    config.full_hash_roots = []
+    config.ignore_files = []
+    config.ignore_directories = []
+    config.scan_php_modules = False
+    config.quick_check_runs = 24
+    config.quick_check_risky_extensions = []
+    config.quick_check_max_staleness = None
+    return config
+
+
+def write_file_system(file_system, written):
+    """
+    Write the files of the simulated file system to disk, only files that changed since the last call are written
+    :param file_system: Simulated file system, its root is the directory to write to
+    :param written: Versions of the files that were written, updated in place
+    :type file_system: SimulatedFileSystem
+    :type written: dict
+    :return: None
+    """
+    for index in set(written) - set(file_system.versions):
+        os.remove(file_system.path(index))
+        del written[index]
+
+    for index, version in file_system.versions.items():
+        if written.get(index) == version:
+            continue
+
+        path = file_system.path(index)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, "wb") as file:
+            file.write("{}:{}\n".format(index, version).encode("utf-8").ljust(file_system.size(index), b"."))
+
+        written[index] = version
+
+
+def load_results(path):
+    """
+    Load results of a previous benchmark
+    :param path: Path to the JSON file, may be None
+    :type path: str
+    :return: Dict of results keyed by (files, run, phase)
+    :rtype: dict
+    """
+    if not path:
+        return {}
+
+    with open(path) as file:
+        return {(r["files"], r["run"], r["phase"]): r for r in json.load(file)}
+
+
+def print_results(results, previous):
+    """
+    Print the results as a table, including the relative change to previous results
+    :param results: Results of the current benchmark
+    :param previous: Results of a previous benchmark
+    :type results: list[dict]
+    :type previous: dict
+    :return: None
+    """
+    headers = ["files", "run", "phase", "seconds", "peak MiB"] + (["vs. previous"] if previous else [])
+    rows = []
+
+    for result in results:
+        row = [result["files"], result["run"], result["phase"], result["seconds"], result.get("peak_mib", "-")]
+        other = previous.get((result["files"], result["run"], result["phase"]))
+
+        if previous:
+            row.append("{:+.1%}".format(result["seconds"] / other["seconds"] - 1) if other and other["seconds"] else "-")
+
+        rows.append(row)
+
+    print(tabulate(rows, headers, "grid"))
+
+
+def load_arguments():
+    """
+    Loads all arguments through argparse
+    :return: Parsed ArgumentParser object
+    """
+    parser = ArgumentParser(description="Benchmark a full scan against a simulated remote server")
+    parser.add_argument("-f", "--files", type=int, nargs="+", default=[10000], help="Amount of files on the server")
+    parser.add_argument("--churn", type=float, default=0.01, help="Fraction of files added, removed and modified between runs")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random churn")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Amount of worker processes of the pipeline")
+    parser.add_argument("--local", action="store_true", help="Scan a tree on the local disk with the local scanner")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="Don't measure peak memory (faster)")
+    parser.add_argument("--json", help="Write the results to a JSON file")
+    parser.add_argument("--compare", help="Compare against results written by --json")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
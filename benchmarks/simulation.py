@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import asyncio
+import fnmatch
+import hashlib
+import io
+import random
+import re
+import shlex
+from types import SimpleNamespace
+
+
+class SimulatedFileSystem:
+    """
+    Deterministic synthetic file tree of a remote server
+    Every file is identified by an index and a version, the checksum is derived from both
+    The metadata of a file is derived from a separate version, so files can be tampered with without changing their metadata
+    """
+
+    PATH_PATTERN = re.compile(r"/file(\d+)\.\w+$")
+
+    def __init__(self, files, root="/var/www", seed=0):
+        """
+        Simulated file system constructor
+        :param files: Amount of files to generate
+        :param root: Directory all files are placed in
+        :param seed: Seed of the random generator used for churn
+        :type files: int
+        :type root: str
+        :type seed: int
+        """
+        self.root = root.rstrip("/")
+        self.random = random.Random(seed)
+        self.versions = dict.fromkeys(range(files), 0)
+        self.stat_versions = dict.fromkeys(range(files), 0)
+        self.next_index = files
+
+    def path(self, index):
+        """
+        Get the path of a file by index
+        :param index: Index of the file
+        :type index: int
+        :return: Absolute path to the file
+        :rtype: str
+        """
+        return "{root}/pkg{pkg}/module{module}/file{index}.{ext}".format(
+            root=self.root, pkg=index % 97, module=index % 13, index=index, ext=("php", "js", "css", "txt")[index % 4])
+
+    def checksum(self, index, algorithm="sha512"):
+        """
+        Get the checksum of a file by index
+        :param index: Index of the file
+        :param algorithm: Name of the hashlib algorithm
+        :type index: int
+        :type algorithm: str
+        :return: Hex encoded checksum
+        :rtype: str
+        """
+        return hashlib.new(algorithm, "{}:{}".format(index, self.versions[index]).encode("utf-8")).hexdigest()
+
+    def partial_checksum(self, index, algorithm="sha512"):
+        """
+        Get the partial checksum of a file by index, as calculated by server.Server.PARTIAL_HASH_SCRIPT
+        :param index: Index of the file
+        :param algorithm: Name of the hashlib algorithm
+        :type index: int
+        :type algorithm: str
+        :return: Hex encoded checksum
+        :rtype: str
+        """
+        return hashlib.new(algorithm, "{}:{}:partial".format(index, self.versions[index]).encode("utf-8")).hexdigest()
+
+    def size(self, index):
+        """
+        Get the size of a file by index
+        :param index: Index of the file
+        :type index: int
+        :return: Size in bytes
+        :rtype: int
+        """
+        return 1024 + index
+
+    def files(self, directory):
+        """
+        Get the indices of all files in a directory
+        :param directory: Directory to list
+        :type directory: str
+        :return: Generator of indices
+        :rtype: collections.Generator
+        """
+        prefix = directory.rstrip("/") + "/"
+        return (index for index in self.versions if self.path(index).startswith(prefix))
+
+    def stat(self, index):
+        """
+        Get the metadata of a file by index, as printed by `find -printf '%s %T@ %C@ %m'`
+        :param index: Index of the file
+        :type index: int
+        :return: Size, modification time, change time and permissions
+        :rtype: str
+        """
+        changed_at = 1500000000 + self.stat_versions[index]
+        return "{} {}.0000000000 {}.0000000000 {}".format(self.size(index), changed_at, changed_at, "755" if index % 50 == 0 else "644")
+
+    def find_index(self, path):
+        """
+        Get the index of a file by path
+        :param path: Absolute path to the file
+        :type path: str
+        :return: Index of the file, None if it doesn't exist
+        :rtype: int
+        """
+        match = self.PATH_PATTERN.search(path)
+        index = int(match.group(1)) if match else None
+        return index if index in self.versions and self.path(index) == path else None
+
+    def churn(self, added=0.0, removed=0.0, modified=0.0, tampered=0.0):
+        """
+        Randomly add, remove and modify files
+        :param added: Fraction of files to add
+        :param removed: Fraction of files to remove
+        :param modified: Fraction of files to modify
+        :param tampered: Fraction of files to modify without changing their metadata
+        :type added: float
+        :type removed: float
+        :type modified: float
+        :type tampered: float
+        :return: None
+        """
+        total = len(self.versions)
+        indices = list(self.versions)
+
+        for index in self.random.sample(indices, int(total * modified)):
+            self.versions[index] += 1
+            self.stat_versions[index] += 1
+
+        for index in self.random.sample(indices, int(total * tampered)):
+            self.versions[index] += 1
+
+        for index in self.random.sample(indices, int(total * removed)):
+            del self.versions[index]
+            del self.stat_versions[index]
+
+        for index in range(self.next_index, self.next_index + int(total * added)):
+            self.versions[index] = 0
+            self.stat_versions[index] = 0
+
+        self.next_index += int(total * added)
+
+    def render_checksum_list(self, directory, algorithm="sha512"):
+        """
+        Render `sha512sum` style output for all files in a directory
+        :param directory: Directory to list
+        :param algorithm: Name of the hashlib algorithm
+        :type directory: str
+        :type algorithm: str
+        :return: Rendered output
+        :rtype: bytes
+        """
+        lines = ("{}  {}\n".format(self.checksum(index, algorithm), self.path(index)) for index in self.files(directory))
+        return "".join(lines).encode("utf-8")
+
+
+class SimulatedClient:
+    """
+    Stand-in for paramiko.SSHClient that replays commands against a simulated file system
+    Only the commands issued by server.Server are supported
+    """
+
+    def __init__(self, file_system, home="/home/integrity", php_configs=None):
+        """
+        Simulated client constructor
+        :param file_system: File system to replay commands against
+        :param home: Home directory of the simulated user
+        :param php_configs: Extension directories keyed by the path of their php-config script, None if php is not installed
+        :type file_system: SimulatedFileSystem
+        :type home: str
+        :type php_configs: dict
+        """
+        self.file_system = file_system
+        self.home = home
+        self.php_configs = php_configs or {}
+        self.php_configs_modified_at = 0
+        self.commands = []
+
+    def load_system_host_keys(self):
+        pass
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def connect(self, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+    def exec_command(self, command):
+        """
+        Execute a command on the simulated server
+        :param command: Command to execute
+        :type command: str
+        :return: Tuple of stdin, stdout and stderr file objects
+        :rtype: tuple
+        """
+        self.commands.append(command)
+        stdout, stderr = b"", b""
+
+        for part in command.split("; "):
+            argv = shlex.split(part)
+            output, error = self._run([arg for arg in argv if arg != "2>/dev/null"])
+            stdout += output
+            stderr += b"" if "2>/dev/null" in argv else error
+
+        return io.BytesIO(), io.BytesIO(stdout), io.BytesIO(stderr)
+
+    def _run(self, argv):
+        """
+        Run a parsed command
+        :param argv: Command arguments
+        :type argv: list
+        :return: Tuple of stdout and stderr output
+        :rtype: tuple
+        """
+        if argv == ["pwd"]:
+            return self.home.encode("utf-8") + b"\n", b""
+
+        if argv == ["echo", "$HOME"]:
+            return self.home.encode("utf-8") + b"\n", b""
+
+        if argv[0] == "echo":
+            return " ".join(argv[1:]).encode("utf-8") + b"\n", b""
+
+        if argv[0] == "stat":
+            return self._run_stat(argv[3], argv[4:])
+
+        if argv[0] in self.php_configs or argv[0] == "php-config":
+            return self._run_php_config(argv[0])
+
+        if argv[0] == "find":
+            return self._run_find(argv), b""
+
+        if argv[:2] == ["sh", "-c"]:
+            return self._run_partial_hash(argv[4:8], [self.file_system.find_index(path) for path in argv[8:]]), b""
+
+        if argv[0].endswith("sum"):
+            return self._run_hash(argv[0], [arg for arg in argv[1:] if arg != "--"])
+
+        return b"", "sh: 1: {}: not found\n".format(argv[0]).encode("utf-8")
+
+    def _run_find(self, argv):
+        """
+        Simulate `find DIRECTORIES.. -type f [-size -Nc|+Nc] ACTION` where the action is one of
+        `-exec HASH_COMMAND "{}" +`, `-exec sh -c PARTIAL_HASH_SCRIPT sh ARGUMENTS.. "{}" +` or `-printf FORMAT`
+        :param argv: Command arguments
+        :type argv: list
+        :return: Stdout output
+        :rtype: bytes
+        """
+        indices = [index for directory in argv[1:argv.index("-type")] for index in self.file_system.files(directory)]
+
+        if "-size" in argv:
+            size = argv[argv.index("-size") + 1]
+            limit = int(size[1:-1])
+
+            if size.startswith("-"):
+                indices = [index for index in indices if self.file_system.size(index) < limit]
+            else:
+                indices = [index for index in indices if self.file_system.size(index) > limit]
+
+        if "-printf" in argv:
+            return "".join("{} {}\n".format(self.file_system.stat(index), self.file_system.path(index)) for index in indices).encode("utf-8")
+
+        command = argv[argv.index("-exec") + 1:]
+
+        if command[:2] == ["sh", "-c"]:
+            return self._run_partial_hash(command[4:8], indices)
+
+        algorithm = self._get_algorithm(command[0])
+        return "".join("{}  {}\n".format(self.file_system.checksum(index, algorithm), self.file_system.path(index)) for index in indices).encode("utf-8")
+
+    def _run_partial_hash(self, arguments, indices):
+        """
+        Simulate server.Server.PARTIAL_HASH_SCRIPT
+        :param arguments: Chunk size, amount of chunks, hash command and whether or not to hash in full
+        :param indices: Indices of the files to hash
+        :type arguments: list
+        :type indices: list
+        :return: Stdout output
+        :rtype: bytes
+        """
+        chunk_size, chunks, hash_command, full = arguments
+        algorithm = self._get_algorithm(hash_command)
+        lines = []
+
+        for index in indices:
+            checksum = self.file_system.partial_checksum(index, algorithm)
+
+            if full == "1":
+                checksum += ":" + self.file_system.checksum(index, algorithm)
+
+            lines.append("partial:{}  {}\n".format(checksum, self.file_system.path(index)))
+
+        return "".join(lines).encode("utf-8")
+
+    @staticmethod
+    def _get_algorithm(hash_command):
+        """
+        Get the hashlib algorithm of a hash command
+        :param hash_command: Hash command, eg. sha512sum
+        :type hash_command: str
+        :rtype: str
+        """
+        return {"b2sum": "blake2b"}.get(hash_command, hash_command[:-len("sum")])
+
+    def _run_hash(self, hash_command, paths):
+        """
+        Simulate `HASH_COMMAND -- PATHS..`
+        :return: Tuple of stdout and stderr output
+        :rtype: tuple
+        """
+        algorithm = self._get_algorithm(hash_command)
+        stdout, stderr = [], []
+
+        for path in paths:
+            index = self.file_system.find_index(path)
+
+            if index is None:
+                stderr.append("{}: {}: No such file or directory\n".format(hash_command, path))
+            else:
+                stdout.append("{}  {}\n".format(self.file_system.checksum(index, algorithm), path))
+
+        return "".join(stdout).encode("utf-8"), "".join(stderr).encode("utf-8")
+
+    def _run_stat(self, format, patterns):
+        """
+        Simulate `stat -L -c FORMAT PATTERNS..` for the php-config scripts
+        Only the %n (name), %Y (modification time) and %s (size) format sequences are supported
+        :return: Tuple of stdout and stderr output
+        :rtype: tuple
+        """
+        lines = []
+
+        for path in sorted(self.php_configs):
+            if any(fnmatch.fnmatch(path, pattern) for pattern in patterns):
+                line = format.replace("%n", path).replace("%Y", str(self.php_configs_modified_at))
+                lines.append(line.replace("%s", str(len(self.php_configs[path]))) + "\n")
+
+        return "".join(lines).encode("utf-8"), b"" if any(lines) else b"stat: cannot stat: No such file or directory\n"
+
+    def _run_php_config(self, path):
+        """
+        Simulate `php-config --extension-dir`
+        :param path: Path of the php-config script, `php-config` for the default version
+        :type path: str
+        :return: Tuple of stdout and stderr output
+        :rtype: tuple
+        """
+        extension_dir = self.php_configs.get(path) or next(iter(self.php_configs.values()), None)
+
+        if not extension_dir:
+            return b"", "sh: 1: {}: not found\n".format(path).encode("utf-8")
+
+        return extension_dir.encode("utf-8") + b"\n", b""
+
+
+class SimulatedConnection:
+    """
+    Stand-in for an asyncssh connection that replays commands against a simulated file system
+    """
+
+    def __init__(self, client, latency=0.0):
+        """
+        Simulated connection constructor
+        :param client: Simulated client that runs the commands
+        :param latency: Delay in seconds before every command completes
+        :type client: SimulatedClient
+        :type latency: float
+        """
+        self.client = client
+        self.latency = latency
+
+    @classmethod
+    def connector(cls, file_system, latency=0.0):
+        """
+        Get a connector for async_server.AsyncServer that connects to a simulated server
+        :param file_system: File system of the simulated server
+        :param latency: Delay in seconds before every command completes
+        :type file_system: SimulatedFileSystem
+        :type latency: float
+        :return: Coroutine function returning a new connection
+        """
+        async def connect(**kwargs):
+            await asyncio.sleep(latency)
+            return cls(SimulatedClient(file_system), latency)
+
+        return connect
+
+    async def run(self, command, encoding=None):
+        """
+        Run a command on the simulated server
+        :param command: Command to execute
+        :param encoding: Ignored, output is always returned as bytes
+        :type command: str
+        :return: Completed process with stdout and stderr attributes
+        """
+        await asyncio.sleep(self.latency)
+        stdin, stdout, stderr = self.client.exec_command(command)
+        return SimpleNamespace(stdout=stdout.read(), stderr=stderr.read())
+
+    def close(self):
+        pass
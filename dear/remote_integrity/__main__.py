@@ -1,14 +1,30 @@
 #!/usr/bin/env python
 # Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import time
 from argparse import ArgumentParser
 
-from dear.remote_integrity.exceptions import DearBytesException
-from dear.remote_integrity.config import Config
+from tabulate import tabulate
+
+from dear.remote_integrity.async_server import AsyncServer, FanOut
+from dear.remote_integrity.exceptions import DearBytesException, ServerException, ConfigurationException, SnapshotException
+from dear.remote_integrity.config import ConfigCache
+from dear.remote_integrity.discovery import DiscoveryCache
+from dear.remote_integrity.dry_run import DryRun
+from dear.remote_integrity.feed import ChangeFeed, NdjsonExporter
 from dear.remote_integrity.inspector import Inspector
 from dear.remote_integrity.logger import Logger
-from dear.remote_integrity.server import Server
+from dear.remote_integrity.golden import GoldenBaseline
+from dear.remote_integrity.metrics import Metrics
+from dear.remote_integrity.notifier import Notifier
+from dear.remote_integrity.pipeline import Pipeline
+from dear.remote_integrity.quick_check import QuickCheck
+from dear.remote_integrity.retention import Retention
+from dear.remote_integrity.schedule import Schedule
+from dear.remote_integrity.server import Server, create_scanner
+from dear.remote_integrity.snapshot import Snapshot, diff_snapshots, diff_database
+from dear.remote_integrity.commands import parse_checksum_output, parse_metadata_output
 from dear.remote_integrity.integrity import Integrity
-from dear.remote_integrity.models import session as database
+from dear.remote_integrity.models import session as database, database_exists, get_database_path, prepare_database, upgrade_database, use_database, Event
 
 
 def main():
@@ -25,6 +41,12 @@ def main():
         if args.list:
             return dispatch_database_inspector(args)
 
+        if args.export_events:
+            return dispatch_event_export(args)
+
+        if args.diff_snapshot:
+            return dispatch_snapshot_diff(args)
+
     except DearBytesException as e:
         print("[!] Error: {}".format(e))
 
@@ -32,27 +54,488 @@ def main():
 def dispatch_remote_integrity_checker(args):
     """
     Dispatch the main remote integrity tool
+    All configured servers are scanned in a single pass, using the database and metrics settings of the first configuration file
+    If an interval is given, the tool keeps running as a daemon and scans the servers every interval,
+    configuration files that were changed in the meantime are reloaded before every pass
     :param args: Arguments passed to the script
     :return: None
     """
-    config = load_config(path=args.config)
+    cache = ConfigCache()
+    configs = load_configs(cache, args)
+
+    if args.dry_run:
+        return dry_run(configs, args)
+
+    metrics = load_metrics(configs[0])
+
+    if configs[0].database_path:
+        use_database(configs[0].database_path)
+
+    if args.prune:
+        return Retention(configs[0]).run()
+
+    if args.register_baseline:
+        return register_baseline(configs[0], args.register_baseline)
+
+    if args.export_snapshot:
+        return export_snapshot(configs[0], args.export_snapshot)
+
+    if database_exists():
+        # The schedule reads the roots of every server, which requires an up to date schema
+        prepare_database()
+
+    pipeline = Pipeline(workers=args.workers)
+    notifier = Notifier()
+
+    try:
+        if args.import_snapshot:
+            return import_snapshot(configs[0], args.import_snapshot, metrics, pipeline, notifier)
+
+        while True:
+            try:
+                scan_servers(configs, metrics, pipeline, notifier, args)
+            except Exception as e:
+                if not args.interval:
+                    raise
+
+                # Keep the daemon running, the next pass may succeed
+                print("[!] Error: {}, retrying in {} seconds".format(str(e) or repr(e), args.interval))
+
+            if not args.interval:
+                return
+
+            time.sleep(args.interval)
+
+            try:
+                configs = load_configs(cache, args)
+            except ConfigurationException as e:
+                print("[!] Error: {}, keeping the previous configuration".format(e))
+
+    finally:
+        pipeline.close()
+        notifier.close()
+
+
+def scan_servers(configs, metrics, pipeline, notifier, args):
+    """
+    Scan all servers, multiple servers are acquired concurrently and processed one by one as they complete
+    Quick checks depend on the stored metadata of every server, so those servers are checked one by one
+    The notifications of all servers are sent as digests once every server was processed
+    :param configs: Configurations of the servers to scan
+    :param metrics: Metrics collector
+    :param pipeline: Pipeline used to parse and diff the checksum lists
+    :param notifier: Notifier that sends the email and telegram notifications
+    :param args: Arguments passed to the script
+    :type configs: list[config.Config]
+    :type metrics: metrics.Metrics
+    :type pipeline: Pipeline
+    :type notifier: Notifier
+    :return: None
+    """
+    configs = schedule_roots(configs)
+
+    if not any(configs):
+        return
+
+    if len(configs) == 1 or args.quick:
+        acquired_lists = [None] * len(configs)
+    else:
+        server_factory = Server if args.transport == "paramiko" else AsyncServer if args.transport == "asyncssh" else None
+        acquired_lists = FanOut(configs, metrics, concurrency=args.concurrency, server_factory=server_factory)
+
+    try:
+        for index, acquired in enumerate(acquired_lists):
+            config = acquired.config if acquired else configs[index]
+
+            try:
+                run_remote_integrity_checker(config, metrics, pipeline, notifier, acquired, quick=args.quick)
+            except DearBytesException as e:
+                print("[!] Error ({}): {}".format(config.server_name, e))
+            except Exception as e:
+                # An unexpected error of a single server doesn't stop the other servers or the daemon
+                print("[!] Unexpected error ({}): {!r}".format(config.server_name, e))
+
+    finally:
+        notifier.flush()
+        DiscoveryCache.flush()
+
+
+def schedule_roots(configs):
+    """
+    Determine which roots of every server are due and which of those hash their large files in full
+    Servers without any due roots are skipped this run
+    :param configs: Configurations of the servers to scan
+    :type configs: list[config.Config]
+    :return: Configurations of the servers that should be scanned
+    :rtype: list[config.Config]
+    """
+    for config in configs:
+        schedule = Schedule(config)
+        config.due_roots = schedule.get_due_roots()
+        config.full_hash_roots = schedule.get_full_hash_roots()
+
+        if not any(config.due_roots):
+            print("[+] No roots of server '{}' are due, skipping".format(config.server_name))
+
+    return [config for config in configs if any(config.due_roots)]
+
+
+def dry_run(configs, args):
+    """
+    Scan all servers and print the events a regular scan would detect, with the time every phase took
+    The database is opened read-only and nothing is sent, so it can be run against a copy or replica of a production database
+    Every root is scanned regardless of its schedule and large files are only hashed partially
+    :param configs: Configurations of the servers to scan
+    :param args: Arguments passed to the script
+    :type configs: list[config.Config]
+    :return: None
+    """
+    if args.quick:
+        raise ConfigurationException("Quick checks can't be combined with a dry run")
+
+    use_database(configs[0].database_path or get_database_path(), read_only=True)
+
+    for config in configs:
+        config.due_roots = None
+        config.full_hash_roots = []
+
+    metrics = Metrics()
+    pipeline = Pipeline(workers=args.workers)
+    rows = []
+
+    if len(configs) == 1:
+        acquired_lists = [None]
+    else:
+        server_factory = Server if args.transport == "paramiko" else AsyncServer if args.transport == "asyncssh" else None
+        acquired_lists = FanOut(configs, metrics, concurrency=args.concurrency, server_factory=server_factory)
+
+    try:
+        for index, acquired in enumerate(acquired_lists):
+            config = acquired.config if acquired else configs[index]
+
+            try:
+                rows.append(predict_events(config, metrics, pipeline, acquired))
+            except DearBytesException as e:
+                print("[!] Error ({}): {}".format(config.server_name, e))
+
+    finally:
+        pipeline.close()
+
+    print("[+] Dry run finished, nothing was written to the database and no notifications were sent")
+    print(tabulate(rows, ["server", "files", "added", "modified", "removed", "acquire (s)", "parse (s)", "diff (s)"], "grid"))
+
+
+def predict_events(config, metrics, pipeline, acquired=None):
+    """
+    Predict and print the events of a single server
+    :param config: Configuration object
+    :param metrics: Metrics collector, only used to measure the phases
+    :param pipeline: Pipeline used to parse and diff the checksum list
+    :param acquired: Checksum list that was already acquired in the background, if None the server is scanned now
+    :type config: config.Config
+    :type metrics: metrics.Metrics
+    :type pipeline: Pipeline
+    :type acquired: async_server.AcquiredChecksumList
+    :return: Summary row of the server
+    :rtype: list
+    """
+    name = config.server_name
+
+    if acquired:
+        output = acquired.get()
+    else:
+        output = acquire_checksum_output(create_scanner(config), metrics)[1]
+
+    with metrics.time_phase(name, "parse"):
+        listing = pipeline.parse(output, config)
+
+    with metrics.time_phase(name, "diff"):
+        prediction = DryRun(config, pipeline)
+        events = prediction.predict(listing)
+
+    print("[+] Predicted {} event{} for server '{}'".format(len(events), "" if len(events) == 1 else "s", name))
+
+    for root, changes in prediction.changes.items():
+        print_changes(root, changes)
+
+    if config.server_baseline and any(events):
+        print(tabulate(sorted([Event.NAMES[event.event], event.path] for event in events), ["change", "path"], "grid"))
+
+    durations = metrics.get_phase_durations(name)
+    counts = [len([event for event in events if event.event == event_type]) for event_type in (Event.FILE_ADDED, Event.FILE_MODIFIED, Event.FILE_REMOVED)]
+
+    return [name, len(listing)] + counts + [round(durations.get(phase, 0.0), 3) for phase in ("acquire", "parse", "diff")]
+
+
+def register_baseline(config, name):
+    """
+    Scan a server and store its checksums as a golden baseline
+    :param config: Configuration of the reference server
+    :param name: Name of the baseline
+    :type config: config.Config
+    :type name: str
+    :return: None
+    """
+    server = create_scanner(config)
+    server.connect()
+    output = server.acquire_checksum_list()
+
+    prepare_database()
+    GoldenBaseline.register(name, output)
+    database.commit()
+
+    print("[+] Registered baseline '{}' from server '{}' ({} files)".format(name, config.server_name, len(output)))
+
 
-    server = Server(config=config)
+def export_snapshot(config, path):
+    """
+    Scan a server and write its checksums and metadata to a snapshot file, nothing is stored in the database
+    :param config: Configuration of the server
+    :param path: Path to the snapshot file
+    :type config: config.Config
+    :type path: str
+    :return: None
+    """
+    server = create_scanner(config)
     server.connect()
-    output  = server.acquire_checksum_list()
 
-    logger = Logger(config=config)
-    integrity = Integrity(config=config)
+    checksums = server.acquire_checksum_output()
+    metadata = server.acquire_metadata_output()
+    roots = {root.name: root for root in config.get_scan_roots()}
+    entries = {}
+
+    for name, raw in checksums.items():
+        stats = dict(parse_metadata_output(metadata.get(name, b""), [], []))
+        pairs = parse_checksum_output(raw, roots[name].ignore_directories, roots[name].ignore_files)
+        entries[name] = [(file_path, checksum, stats.get(file_path)) for file_path, checksum in pairs]
+
+    Snapshot.write(path, config.server_name, entries, {name: roots[name].hash_algorithm for name in entries})
+    print("[+] Wrote snapshot of server '{}' to {} ({} files)".format(config.server_name, path, sum(map(len, entries.values()))))
+
+
+def import_snapshot(config, path, metrics, pipeline, notifier):
+    """
+    Check a server against a snapshot that was taken of it (eg. on an air-gapped host) instead of scanning it
+    Only the roots in the snapshot are checked, their hash algorithm must match the configuration
+    :param config: Configuration of the server
+    :param path: Path to the snapshot file
+    :param metrics: Metrics collector
+    :param pipeline: Pipeline used to parse and diff the checksum list
+    :param notifier: Notifier that sends the email and telegram notifications
+    :type config: config.Config
+    :type path: str
+    :type metrics: metrics.Metrics
+    :type pipeline: Pipeline
+    :type notifier: Notifier
+    :return: None
+    """
+    roots = {root.name: root for root in config.get_scan_roots()}
+
+    with Snapshot(path) as snapshot:
+        if snapshot.server_name != config.server_name:
+            raise SnapshotException("Snapshot '{}' was taken of server '{}', not '{}'".format(path, snapshot.server_name, config.server_name))
+
+        for name in snapshot.roots:
+            if name in roots and snapshot.get_hash_algorithm(name) != roots[name].hash_algorithm:
+                raise SnapshotException("Hash algorithm of root '{}' in snapshot '{}' differs from the configuration".format(name, path))
+
+        config.due_roots = [name for name in snapshot.roots if name in roots]
+        config.full_hash_roots = []
+
+        try:
+            run_remote_integrity_checker(config, metrics, pipeline, notifier, snapshot=snapshot)
+        finally:
+            notifier.flush()
+
+
+def run_remote_integrity_checker(config, metrics, pipeline, notifier, acquired=None, quick=False, snapshot=None):
+    """
+    Run a single scan of the remote server and record it as a scan run
+    :param config: Configuration object
+    :param metrics: Metrics collector
+    :param pipeline: Pipeline used to parse and diff the checksum list
+    :param notifier: Notifier that the notifications are queued on
+    :param acquired: Checksum list that was already acquired in the background, if None the server is scanned now
+    :param quick: Only hash a sample of the files, ignored if the checksum list was already acquired
+    :param snapshot: Snapshot to check instead of scanning the server
+    :type config: config.Config
+    :type metrics: metrics.Metrics
+    :type pipeline: Pipeline
+    :type notifier: Notifier
+    :type acquired: async_server.AcquiredChecksumList
+    :type quick: bool
+    :type snapshot: Snapshot
+    :return: None
+    """
+    integrity = Integrity(config=config, pipeline=pipeline)
+
+    try:
+        with metrics.time_phase(config.server_name, "load_database"):
+            integrity.load_database()
+
+        if snapshot:
+            server, output = None, snapshot.to_output(config.due_roots)
+        elif acquired:
+            server, output = acquired.server, acquired.get()
+        else:
+            integrity.quick_check = QuickCheck(config, integrity.server) if quick else None
+            server, output = acquire_checksum_output(create_scanner(config), metrics, integrity.quick_check)
+
+        output = pipeline.parse(output, config)
+        identify(config, metrics, integrity, notifier, output)
+        integrity.finish_scan_run(files_seen=len(output), bytes_transferred=server.bytes_received if server else 0)
+
+        with metrics.time_phase(config.server_name, "commit"):
+            database.commit()
+
+    except Exception as e:
+        database.rollback()
+        integrity.record_failed_scan_run(error=str(e) or repr(e))
+        database.commit()
+        metrics.increment("runs_total", server=config.server_name, status="failed")
+        raise
+
+    else:
+        metrics.increment("runs_total", server=config.server_name, status="success")
+        record_event_metrics(config, metrics, integrity.events)
+
+        if config.retention_enabled():
+            apply_retention(config, metrics, integrity.server)
+
+    finally:
+        publish_metrics(config, metrics)
+
+
+def apply_retention(config, metrics, server):
+    """
+    Apply the retention policy to the events of a server after a successful scan
+    The scan run was already committed, so a failure is reported without changing the status of the run
+    :param config: Configuration object
+    :param metrics: Metrics collector
+    :param server: Database record of the server
+    :type config: config.Config
+    :type metrics: metrics.Metrics
+    :type server: models.Server
+    :return: None
+    """
+    try:
+        with metrics.time_phase(config.server_name, "retention"):
+            Retention(config).run(server=server)
+
+    except DearBytesException as e:
+        database.rollback()
+        print("[!] Unable to apply the retention policy of server '{}', reason: {}".format(config.server_name, e))
+
+
+def acquire_checksum_output(server, metrics, quick_check=None):
+    """
+    Connect to the remote server and acquire the raw checksum list output of all roots that are due
+    :param server: Server to connect to
+    :param metrics: Metrics collector
+    :param quick_check: Quick check that selects the files to hash, if None all files are hashed
+    :type server: server.Server
+    :type metrics: metrics.Metrics
+    :type quick_check: QuickCheck
+    :return: Tuple of the server and a dict of its raw outputs keyed by root name
+    :rtype: tuple
+    """
+    name = server.config.server_name
+
+    try:
+        with metrics.time_phase(name, "connect"):
+            server.connect()
+
+        with metrics.time_phase(name, "acquire"):
+            output = quick_check.acquire_checksum_output(server) if quick_check else server.acquire_checksum_output()
+
+    except ServerException:
+        metrics.increment("ssh_errors_total", server=name)
+        raise
+
+    finally:
+        metrics.increment("bytes_transferred_total", server.bytes_received, server=name)
+
+    files_hashed = quick_check.files_hashed if quick_check else sum(raw.count(b"\n") for raw in output.values())
+    metrics.increment("files_hashed_total", files_hashed, server=name)
+    return server, output
+
+
+def identify(config, metrics, integrity, notifier, output):
+    """
+    Identify changes in the checksum list and dispatch notifications for them
+    :param config: Configuration object
+    :param metrics: Metrics collector
+    :param integrity: Integrity checker with a loaded database
+    :param notifier: Notifier that the email and telegram notifications are queued on
+    :param output: List of (path, checksum) tuples or a checksum listing
+    :type config: config.Config
+    :type metrics: metrics.Metrics
+    :type integrity: Integrity
+    :type notifier: Notifier
+    :type output: list|pipeline.Listing
+    :return: None
+    """
+    logger = Logger(config=config, notifier=notifier)
 
     integrity.on_events_detected += logger.dispatch_syslog
     integrity.on_events_detected += logger.dispatch_events_mail
     integrity.on_events_detected += logger.dispatch_telegram_msg
 
-    integrity.load_database()
-    integrity.identify(output)
+    with metrics.time_phase(config.server_name, "identify"):
+        if config.server_baseline:
+            integrity.compare_with_baseline(GoldenBaseline.load(config.server_baseline), output)
+        else:
+            integrity.identify(output)
+
     integrity.print_statistics()
 
-    database.commit()
+
+def record_event_metrics(config, metrics, events):
+    """
+    Count the detected events by type
+    :param config: Configuration object
+    :param metrics: Metrics collector
+    :param events: Events detected during the scan
+    :type config: config.Config
+    :type metrics: metrics.Metrics
+    :type events: list[models.Event]
+    :return: None
+    """
+    for event in events:
+        metrics.increment("events_total", server=config.server_name, type=Event.NAMES[event.event])
+
+
+def load_metrics(config):
+    """
+    Create the metrics collector and start the HTTP endpoint if configured
+    :param config: Configuration object
+    :type config: config.Config
+    :return: Metrics collector
+    :rtype: Metrics
+    """
+    metrics = Metrics()
+
+    if config.metrics_textfile:
+        metrics.load_textfile(config.metrics_textfile)
+
+    if config.metrics_listen_port:
+        metrics.serve(config.metrics_listen_address, config.metrics_listen_port)
+        print("[+] Serving metrics on http://{}:{}/metrics".format(config.metrics_listen_address, config.metrics_listen_port))
+
+    return metrics
+
+
+def publish_metrics(config, metrics):
+    """
+    Write the metrics to the configured textfile
+    :param config: Configuration object
+    :param metrics: Metrics collector
+    :type config: config.Config
+    :type metrics: metrics.Metrics
+    :return: None
+    """
+    if config.metrics_textfile:
+        metrics.write_textfile(config.metrics_textfile)
 
 
 def dispatch_database_inspector(args):
@@ -65,6 +548,80 @@ def dispatch_database_inspector(args):
     inspector.run()
 
 
+def dispatch_event_export(args):
+    """
+    Dispatch the event export, all events after the stored cursor are written as JSON Lines
+    If an interval is given, the tool keeps running and exports new events every interval
+    :param args: Arguments passed to the script
+    :return: None
+    """
+    prepare_database()
+    exporter = NdjsonExporter(ChangeFeed(cursor_path=args.cursor, server_name=args.server), path=args.export_events)
+
+    if args.interval:
+        return exporter.follow(args.interval)
+
+    exported = exporter.export()
+
+    if args.export_events != "-":
+        print("[+] Exported {} event{} to {}".format(exported, "s" if exported != 1 else "", args.export_events))
+
+
+def dispatch_snapshot_diff(args):
+    """
+    Dispatch the snapshot diff, the changes between two snapshots are printed
+    With a single snapshot, the changes between the stored checksums of its server and the snapshot are printed
+    Nothing is written to the database
+    :param args: Arguments passed to the script
+    :return: None
+    """
+    if len(args.diff_snapshot) > 2:
+        raise SnapshotException("Only one or two snapshots can be compared")
+
+    snapshots = [Snapshot(path) for path in args.diff_snapshot]
+    pipeline = Pipeline(workers=args.workers)
+
+    try:
+        if len(snapshots) == 2:
+            old, new = snapshots
+            roots = new.roots + [root for root in old.roots if root not in new.roots]
+            changes = [(root, diff_snapshots(old, new, root)) for root in roots]
+        else:
+            if database_exists():
+                upgrade_database()
+
+            changes = [(root, diff_database(snapshots[0], root, pipeline)) for root in snapshots[0].roots]
+
+    finally:
+        pipeline.close()
+
+        for snapshot in snapshots:
+            snapshot.close()
+
+    for root, root_changes in changes:
+        print_changes(root, root_changes)
+
+
+def print_changes(root, changes):
+    """
+    Print a summary and a table of the changes of a root
+    :param root: Name of the root
+    :param changes: Changes of the root
+    :type root: str
+    :type changes: pipeline.Changes
+    :return: None
+    """
+    rows  = [[Event.NAMES[Event.FILE_ADDED], path] for path, checksum in changes.added]
+    rows += [[Event.NAMES[Event.FILE_MODIFIED], path] for checksum_id, path, checksum in changes.modified]
+    rows += [[Event.NAMES[Event.FILE_REMOVED], path] for checksum_id, path in changes.removed]
+
+    print("[+] Root '{}': {} added, {} modified, {} removed ({} files)".format(
+        root, len(changes.added), len(changes.modified), len(changes.removed), changes.files_seen))
+
+    if any(rows):
+        print(tabulate(sorted(rows, key=lambda row: row[1]), ["change", "path"], "grid"))
+
+
 def load_arguments():
     """"
     Loads all arguments through argparse
@@ -72,19 +629,46 @@ def load_arguments():
     """
     parser = ArgumentParser(description="DearBytes remote file integrity checker")
     group = parser.add_mutually_exclusive_group(required=True)
-    group.add_argument("-c", "--config", help="Path to the server configuration file")
+    group.add_argument("-c", "--config", nargs="+", help="Path to one or more server or fleet configuration files")
     group.add_argument("-l", "--list", help="List data from the local database")
+    group.add_argument("-e", "--export-events", metavar="FILE", help="Append the events to FILE as JSON Lines (- for stdout)")
+    group.add_argument("-d", "--diff-snapshot", nargs="+", metavar="SNAPSHOT", help="Compare two snapshots, or a snapshot to the database")
+    parser.add_argument("-s", "--server", help="Only list data of this server (used with --list runs|coverage and --export-events)")
+    parser.add_argument("-n", "--limit", type=int, help="Maximum amount of rows to list (used with --list runs)")
+    parser.add_argument("--path", help="Only list data of this path (used with --list drift)")
+    parser.add_argument("-p", "--prune", action="store_true", help="Only apply the retention policy to the events of all servers")
+    parser.add_argument("-b", "--baseline", help="Check all servers against this golden baseline")
+    parser.add_argument("--register-baseline", metavar="NAME", help="Store the checksums of the (first) server as a golden baseline")
+    parser.add_argument("--export-snapshot", metavar="FILE", help="Write the checksums of the (first) server to a snapshot file")
+    parser.add_argument("--import-snapshot", metavar="FILE", help="Check the (first) server against a snapshot file instead of scanning it")
+    parser.add_argument("--concurrency", type=int, default=50, help="Maximum amount of servers scanned at the same time")
+    parser.add_argument("--transport", choices=["asyncssh", "paramiko"], help="SSH transport used for multiple servers (default: asyncssh if installed)")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Amount of worker processes used to parse and diff checksum lists")
+    parser.add_argument("-q", "--quick", action="store_true", help="Only hash a rotating sample of the files and the files whose metadata changed")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the events a scan would detect, without writing to the database or sending notifications")
+    parser.add_argument("-i", "--interval", type=int, help="Keep running and scan the server (or export new events) every INTERVAL seconds")
+    parser.add_argument("--cursor", metavar="FILE", help="Only export the events after the cursor stored in FILE and update it (used with --export-events)")
     return parser.parse_args()
 
 
-def load_config(path):
+def load_configs(cache, args):
     """"
-    Loads a config file specified by the argument
-    :param path: Path to the configuration file
-    :type path: str
-    :return: Parsed Config object
+    Loads the config files specified by the arguments, files that didn't change since they were cached aren't parsed again
+    :param cache: Cache of loaded configuration files
+    :param args: Arguments passed to the script
+    :type cache: ConfigCache
+    :return: Parsed Config objects of all servers
+    :rtype: list[Config]
     """
-    return Config.load(path)
+    configs = cache.load(args.config)
+
+    for config in configs:
+        config.server_baseline = args.baseline or config.server_baseline
+
+    if args.quick and any(config.server_baseline for config in configs):
+        raise ConfigurationException("Quick checks can't be combined with a golden baseline")
+
+    return configs
 
 
 if __name__ == '__main__':
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Thread
+
+from dear.remote_integrity.exceptions import DearBytesException, ServerException
+from dear.remote_integrity.server import Server, create_scanner
+
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+
+class AsyncServer(Server):
+    """
+    Server that runs its remote commands on an asyncio event loop using asyncssh
+    Thousands of servers can be scanned concurrently on a single loop, connect() and acquire_checksum_list() are coroutines
+    """
+
+    def __init__(self, config, connector=None):
+        """
+        Async server constructor
+        :param config: Configuration to use
+        :param connector: Coroutine function returning a connection, defaults to asyncssh.connect
+        :type config: config.Config
+        """
+        if connector is None and asyncssh is None:
+            raise ServerException("The asyncio transport requires the 'asyncssh' package")
+
+        self.config = config
+        self.connector = connector or asyncssh.connect
+        self.connection = None
+        self.bytes_received = 0
+
+    async def connect(self):
+        """
+        Connect to the remote server
+        The host key is verified against the known_hosts files of the user and the system, like the paramiko transport
+        does, servers with an unknown or mismatching host key are refused
+        :return: None
+        """
+        try:
+            self.connection = await self.connector(
+                host=self.config.server_address,
+                port=self.config.server_port,
+                username=self.config.auth_username,
+                client_keys=[self.config.auth_private_key])
+
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ServerException(str(e))
+
+        except Exception as e:
+            if asyncssh is not None and isinstance(e, asyncssh.Error):
+                raise ServerException(str(e))
+            raise
+
+    async def acquire_checksum_list(self):
+        """
+        Attempts to acquire a list of checksums of all files recursively
+        :return: List of checksums
+        :rtype: list
+        """
+        return await self._run_steps_async(self._acquire_checksum_list_steps())
+
+    async def acquire_checksum_output(self):
+        """
+        Attempts to acquire the raw, unparsed checksum list output of all roots that are due
+        :return: Dict of raw outputs keyed by root name
+        :rtype: dict
+        """
+        return await self._run_steps_async(self._acquire_checksum_output_steps())
+
+    def close(self):
+        """
+        Close the connection to the remote server
+        :return: None
+        """
+        if self.connection is not None:
+            self.connection.close()
+
+    async def _run_steps_async(self, steps):
+        """
+        Drive a generator of remote commands, every command it yields is executed and its output is sent back
+        :param steps: Generator yielding commands
+        :type steps: collections.Generator
+        :return: Return value of the generator
+        """
+        try:
+            command = next(steps)
+
+            while True:
+                command = steps.send(await self._exec_async(command))
+
+        except StopIteration as e:
+            return e.value
+
+    async def _exec_async(self, command):
+        """
+        Execute a command on the remote server
+        :param command: Command to execute
+        :type command: str
+        :return: Tuple of raw stdout and stderr output
+        :rtype: tuple
+        """
+        result = await self.connection.run(command, encoding=None)
+
+        stdout = result.stdout or b""
+        stderr = result.stderr or b""
+        self.bytes_received += len(stdout) + len(stderr)
+
+        return stdout, stderr
+
+
+class AcquiredChecksumList(namedtuple("AcquiredChecksumList", ["config", "server", "output", "error"])):
+    """
+    Result of acquiring the checksum list of a server in the background
+    """
+
+    __slots__ = ()
+
+    def get(self):
+        """
+        Get the raw checksum list output, or raise the error that occurred while acquiring it
+        :return: Dict of raw outputs keyed by root name
+        :rtype: dict
+        """
+        if self.error is not None:
+            raise self.error
+
+        return self.output
+
+
+class FanOut:
+    """
+    Acquires the checksum lists of many servers concurrently on an event loop running in a background thread
+    Results are handed to the calling thread as they complete, so the database is only ever used by a single writer
+    At most as many results as the concurrency limit are queued, servers wait for the calling thread before releasing their slot
+    Without asyncssh, the paramiko transport is used with one worker thread per concurrent connection
+    Servers that use the local backend are scanned by a local scanner on a worker thread
+    """
+
+    def __init__(self, configs, metrics, concurrency=50, server_factory=None):
+        """
+        Fan out constructor
+        :param configs: Configurations of the servers to scan
+        :param metrics: Metrics collector
+        :param concurrency: Maximum amount of servers that are scanned at the same time
+        :param server_factory: Callable returning a (async) server for a config, defaults to the best available transport
+        :type configs: list[config.Config]
+        :type metrics: metrics.Metrics
+        :type concurrency: int
+        """
+        self.configs = configs
+        self.metrics = metrics
+        self.concurrency = concurrency
+        self.server_factory = server_factory or (AsyncServer if asyncssh is not None else Server)
+        self.results = Queue(maxsize=concurrency)
+
+    def __iter__(self):
+        """
+        Start scanning and yield the results as they complete
+        :return: Generator of AcquiredChecksumList
+        :rtype: collections.Generator
+        """
+        Thread(target=self._run_loop, daemon=True).start()
+
+        for _ in self.configs:
+            yield self.results.get()
+
+    def _run_loop(self):
+        """
+        Run a new event loop until all servers were scanned
+        Blocking servers run in a thread pool that is as large as the concurrency limit
+        :return: None
+        """
+        loop = asyncio.new_event_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.concurrency))
+
+        try:
+            loop.run_until_complete(self._acquire_all())
+        finally:
+            loop.close()
+
+    async def _acquire_all(self):
+        """
+        Acquire the checksum lists of all servers, bounded by the concurrency limit
+        :return: None
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*[self._acquire(semaphore, config) for config in self.configs])
+
+    async def _acquire(self, semaphore, config):
+        """
+        Acquire the checksum list of a single server and queue the result
+        :return: None
+        """
+        server = None
+
+        async with semaphore:
+            try:
+                server = create_scanner(config, self.server_factory)
+                output = await self._acquire_checksum_list(server)
+                result = AcquiredChecksumList(config, server, output, None)
+            except DearBytesException as e:
+                result = AcquiredChecksumList(config, server, None, e)
+            except Exception as e:
+                result = AcquiredChecksumList(config, server, None, ServerException(str(e) or repr(e)))
+
+            # The queue blocks while it's full, so the result is put from a worker thread to keep the loop running
+            await asyncio.get_event_loop().run_in_executor(None, self.results.put, result)
+
+    async def _acquire_checksum_list(self, server):
+        """
+        Connect to a server and acquire its raw checksum list output, using a worker thread for blocking servers
+        :return: Dict of raw outputs keyed by root name
+        :rtype: dict
+        """
+        name = server.config.server_name
+
+        try:
+            with self.metrics.time_phase(name, "connect"):
+                await self._call(server.connect)
+
+            with self.metrics.time_phase(name, "acquire"):
+                output = await self._call(server.acquire_checksum_output)
+
+        except ServerException:
+            self.metrics.increment("ssh_errors_total", server=name)
+            raise
+
+        finally:
+            self.metrics.increment("bytes_transferred_total", server.bytes_received, server=name)
+
+            if isinstance(server, AsyncServer):
+                server.close()
+
+        self.metrics.increment("files_hashed_total", sum(raw.count(b"\n") for raw in output.values()), server=name)
+        return output
+
+    @staticmethod
+    async def _call(method):
+        """
+        Call a coroutine method directly, or a blocking method in the default executor
+        :return: Return value of the method
+        """
+        if asyncio.iscoroutinefunction(method):
+            return await method()
+
+        return await asyncio.get_event_loop().run_in_executor(None, method)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+from dear.remote_integrity.config import IgnoreMatcher
+
+# Locations of the php-config scripts of all installed PHP versions
+PHP_CONFIG_PATTERNS = [
+    "/usr/bin/php-config*",
+    "/usr/local/bin/php-config*",
+    "/usr/local/php*/bin/php-config",
+    "/opt/remi/php*/root/usr/bin/php-config",
+]
+
+# Size of the chunks hashed of large files
+PARTIAL_HASH_CHUNK_SIZE = 64 * 1024
+
+
+def split_arguments(arguments, length):
+    """
+    Split a list of command arguments into batches that don't exceed the given length
+    :param arguments: Arguments to split
+    :param length: Maximum length of the joined arguments of a batch
+    :type arguments: list[str]
+    :type length: int
+    :return: Generator of batches
+    :rtype: collections.Generator
+    """
+    batch, size = [], 0
+
+    for argument in arguments:
+        if batch and size + len(argument) + 1 > length:
+            yield batch
+            batch, size = [], 0
+
+        batch.append(argument)
+        size += len(argument) + 1
+
+    if batch:
+        yield batch
+
+
+def merge_roots(roots):
+    """
+    Remove duplicate roots and roots that are inside another root
+    :param roots: Absolute paths of the roots
+    :type roots: list[str]
+    :return: Sorted list of roots that don't overlap
+    :rtype: list[str]
+    """
+    merged = []
+
+    for root in sorted(set(root.rstrip("/") or "/" for root in roots)):
+        if not any(root == other or root.startswith(other.rstrip("/") + "/") for other in merged):
+            merged.append(root)
+
+    return merged
+
+
+def split_output_lines(text):
+    """
+    Split command output into lines, only at newlines since file names can contain any other line break
+    :param text: Decoded output, every line is terminated by a newline
+    :type text: str
+    :rtype: list[str]
+    """
+    lines = text.split("\n")
+    return lines[:-1] if not lines[-1] else lines
+
+
+def parse_checksum_output(output, ignore_directories, ignore_files):
+    """
+    Parse the raw output of the checksum list command
+    This is a module level function so it can be used by worker processes
+    :param output: Raw checksum list output
+    :param ignore_directories: Directories to ignore
+    :param ignore_files: File names to ignore
+    :type output: bytes
+    :type ignore_directories: list
+    :type ignore_files: list
+    :return: Generator of (path, checksum) tuples of all files that aren't blacklisted
+    :rtype: collections.Generator
+    """
+    matcher = IgnoreMatcher.get(ignore_directories, ignore_files)
+
+    for line in split_output_lines(output.decode("utf-8")):
+        try:
+            checksum, path = line.split("  ", 1)
+        except ValueError:
+            print("[!] Warning: Unable to parse checksum output '{}'".format(line))
+            continue
+
+        if not matcher.matches(path):
+            yield path, checksum
+
+
+def parse_metadata_output(output, ignore_directories, ignore_files):
+    """
+    Parse the raw output of the metadata listing command
+    :param output: Raw metadata listing output
+    :param ignore_directories: Directories to ignore
+    :param ignore_files: File names to ignore
+    :type output: bytes
+    :type ignore_directories: list
+    :type ignore_files: list
+    :return: Generator of (path, stat) tuples of all files that aren't blacklisted, the stat contains the size,
+             modification time, change time and permissions separated by spaces
+    :rtype: collections.Generator
+    """
+    matcher = IgnoreMatcher.get(ignore_directories, ignore_files)
+
+    for line in split_output_lines(output.decode("utf-8")):
+        size, modified_at, changed_at, mode, path = line.split(" ", 4)
+
+        if not matcher.matches(path):
+            yield path, " ".join([size, modified_at, changed_at, mode])
+
+
+def path_is_blacklisted(path, ignore_directories, ignore_files):
+    """
+    Check if the given path is blacklisted (directory/file based)
+    :return: True if the path should be ignored
+    :rtype: bool
+    """
+    return IgnoreMatcher.get(ignore_directories, ignore_files).matches(path)
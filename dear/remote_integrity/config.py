@@ -1,22 +1,173 @@
 #!/usr/bin/env python
 # Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
 import os
-from configparser import ConfigParser, NoSectionError, NoOptionError
+import re
+from collections import namedtuple
+from configparser import ConfigParser, Error as ParserError, NoSectionError, NoOptionError
+from functools import lru_cache
 
 from dear.remote_integrity.exceptions import ConfigurationException
 
 
+class ScanRoot(namedtuple("ScanRoot", [
+        "name", "directories", "ignore_files", "ignore_directories", "hash_algorithm", "scan_interval",
+        "partial_hash_threshold", "partial_hash_chunks", "partial_hash_full_interval"])):
+    """
+    Directories of a server that are scanned with the same policy
+    The default root consists of the start directory, the extra directories and the php modules
+    Files of at least `partial_hash_threshold` bytes are hashed partially, every `partial_hash_full_interval` seconds in full
+    """
+
+    __slots__ = ()
+
+    DEFAULT = "default"
+
+    HASH_COMMANDS = {
+        "md5": "md5sum",
+        "sha1": "sha1sum",
+        "sha224": "sha224sum",
+        "sha256": "sha256sum",
+        "sha384": "sha384sum",
+        "sha512": "sha512sum",
+        "blake2b": "b2sum",
+    }
+
+    @property
+    def hash_command(self):
+        """
+        Get the remote command that calculates the checksums of this root
+        :rtype: str
+        """
+        return self.HASH_COMMANDS[self.hash_algorithm]
+
+    @property
+    def ignore_matcher(self):
+        """
+        Get the compiled ignore lists of this root
+        :rtype: IgnoreMatcher
+        """
+        return IgnoreMatcher.get(self.ignore_directories, self.ignore_files)
+
+    @classmethod
+    def load(cls, parser, name, config):
+        """
+        Read a [root:NAME] section, ignore lists, the hash algorithm and the partial hash policy default to those of the [filter] section
+        :param parser: Parser of the configuration file
+        :param name: Name of the root
+        :param config: Configuration containing the [filter] values
+        :type parser: ConfigParser
+        :type name: str
+        :type config: Config
+        :return: Scan root
+        :rtype: ScanRoot
+        """
+        section = "root:" + name
+        ignore_files = parser.get(section, "ignore_files", fallback=None)
+        ignore_directories = parser.get(section, "ignore_directories", fallback=None)
+
+        return cls(
+            name=name,
+            directories=split_list(parser.get(section, "directories")),
+            ignore_files=split_list(ignore_files) if ignore_files is not None else config.ignore_files,
+            ignore_directories=split_list(ignore_directories) if ignore_directories is not None else config.ignore_directories,
+            hash_algorithm=parser.get(section, "hash_algorithm", fallback=None) or config.hash_algorithm,
+            scan_interval=get_optional_int(parser, section, "scan_interval"),
+            partial_hash_threshold=get_inherited_int(parser, section, "partial_hash_threshold", config.partial_hash_threshold),
+            partial_hash_chunks=get_optional_int(parser, section, "partial_hash_chunks") or config.partial_hash_chunks,
+            partial_hash_full_interval=get_inherited_int(parser, section, "partial_hash_full_interval", config.partial_hash_full_interval))
+
+
+class IgnoreMatcher:
+    """
+    Ignore lists compiled into a single regular expression (directories) and a set (file names)
+    A path is ignored if an ignored directory followed by a slash occurs anywhere in it, or if its file name is ignored
+    """
+
+    def __init__(self, ignore_directories, ignore_files):
+        """
+        Ignore matcher constructor, empty items are skipped
+        :param ignore_directories: Directories to ignore
+        :param ignore_files: File names to ignore
+        :type ignore_directories: collections.Iterable
+        :type ignore_files: collections.Iterable
+        """
+        directories = [directory.rstrip("/") + "/" for directory in ignore_directories if directory.rstrip("/")]
+        self.directories = re.compile("|".join(re.escape(directory) for directory in directories)) if directories else None
+        self.files = frozenset(file_name for file_name in ignore_files if file_name)
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _get(ignore_directories, ignore_files):
+        """
+        Compile the ignore lists, the results are cached by the (hashable) tuples of the lists
+        :rtype: IgnoreMatcher
+        """
+        return IgnoreMatcher(ignore_directories, ignore_files)
+
+    @classmethod
+    def get(cls, ignore_directories, ignore_files):
+        """
+        Get the compiled matcher of the ignore lists, every combination of lists is only compiled once per process
+        :param ignore_directories: Directories to ignore
+        :param ignore_files: File names to ignore
+        :type ignore_directories: collections.Iterable
+        :type ignore_files: collections.Iterable
+        :rtype: IgnoreMatcher
+        """
+        return cls._get(tuple(ignore_directories), tuple(ignore_files))
+
+    def matches(self, path):
+        """
+        Check if a file is ignored
+        :param path: Absolute path of the file
+        :type path: str
+        :return: True if the file should be ignored
+        :rtype: bool
+        """
+        if self.files and path[path.rfind("/") + 1:] in self.files:
+            return True
+
+        return self.directories is not None and self.directories.search(path) is not None
+
+    def matches_directory(self, path):
+        """
+        Check if all files in a directory are ignored, so it doesn't have to be listed
+        :param path: Absolute path of the directory
+        :type path: str
+        :rtype: bool
+        """
+        return self.directories is not None and self.directories.search(path.rstrip("/") + "/") is not None
+
+
 class Config:
     """
     Configuration object
     """
 
-    def __int__(self):
+    # Options of every section, a fleet configuration file sets them per host without a section
+    OPTIONS = {
+        "server": ["server_name", "server_port", "server_address", "server_baseline", "server_backend"],
+        "auth": ["auth_username", "auth_private_key"],
+        "filter": [
+            "ignore_files", "ignore_directories", "start_directory", "extra_directories", "scan_php_modules", "hash_algorithm",
+            "scan_interval", "partial_hash_threshold", "partial_hash_chunks", "partial_hash_full_interval", "roots"],
+        "quick_check": ["quick_check_runs", "quick_check_risky_extensions", "quick_check_max_staleness"],
+        "email": ["email_smtp_host", "email_smtp_user", "email_smtp_pass", "email_recipients", "email_noreply_address"],
+        "telegram": ["telegram_api_token", "telegram_api_chat_id", "telegram_api_url"],
+        "logging": ["logging_syslog_host"],
+        "database": ["database_path", "database_storage"],
+        "retention": ["retention_days", "retention_max_events", "retention_archive_directory", "retention_vacuum"],
+        "metrics": ["metrics_textfile", "metrics_listen_address", "metrics_listen_port"],
+    }
+
+    def __init__(self):
 
         # [server]
         self.server_name = None
         self.server_port = None
         self.server_address = None
+        self.server_baseline = None
+        self.server_backend = "ssh"
 
         # [auth]
         self.auth_username = None
@@ -24,9 +175,23 @@ class Config:
 
         # [filter]
         self.start_directory = None
+        self.extra_directories = []
         self.ignore_files = []
         self.ignore_directories = []
         self.scan_php_modules = True
+        self.hash_algorithm = "sha512"
+        self.scan_interval = None
+        self.scan_roots = []
+        self.due_roots = None
+        self.partial_hash_threshold = None
+        self.partial_hash_chunks = 8
+        self.partial_hash_full_interval = None
+        self.full_hash_roots = []
+
+        # [quick_check]
+        self.quick_check_runs = 24
+        self.quick_check_risky_extensions = []
+        self.quick_check_max_staleness = None
 
         # [email]
         self.email_smtp_host = None
@@ -38,10 +203,26 @@ class Config:
         # [telegram]
         self.telegram_api_token = None
         self.telegram_api_chat_id = None
+        self.telegram_api_url = None
 
         # [logging]
         self.logging_syslog_host = None
 
+        # [database]
+        self.database_path = None
+        self.database_storage = "plain"
+
+        # [retention]
+        self.retention_days = None
+        self.retention_max_events = None
+        self.retention_archive_directory = None
+        self.retention_vacuum = "none"
+
+        # [metrics]
+        self.metrics_textfile = None
+        self.metrics_listen_address = None
+        self.metrics_listen_port = None
+
     def smtp_auth_enabled(self):
         """
         Check if SMTP should log in or not
@@ -49,6 +230,42 @@ class Config:
         """
         return self.email_smtp_user and self.email_smtp_pass
 
+    def retention_enabled(self):
+        """
+        Check if old events should be pruned
+        :return: True if a TTL or maximum amount of events is configured
+        """
+        return self.retention_days or self.retention_max_events
+
+    def get_scan_roots(self, due_only=False):
+        """
+        Get all roots of the server, starting with the default root
+        :param due_only: Only return the roots that are due this run
+        :type due_only: bool
+        :return: List of scan roots
+        :rtype: list[ScanRoot]
+        """
+        default = ScanRoot(
+            name=ScanRoot.DEFAULT,
+            directories=[self.start_directory] + self.extra_directories,
+            ignore_files=self.ignore_files,
+            ignore_directories=self.ignore_directories,
+            hash_algorithm=self.hash_algorithm,
+            scan_interval=self.scan_interval,
+            partial_hash_threshold=self.partial_hash_threshold,
+            partial_hash_chunks=self.partial_hash_chunks,
+            partial_hash_full_interval=self.partial_hash_full_interval)
+
+        roots = [default] + self.scan_roots
+        return [root for root in roots if not due_only or self.due_roots is None or root.name in self.due_roots]
+
+    def metrics_enabled(self):
+        """
+        Check if scan metrics should be collected
+        :return: True if a metrics textfile or listen port is configured
+        """
+        return self.metrics_textfile or self.metrics_listen_port
+
     @staticmethod
     def load(path):
         """
@@ -57,34 +274,122 @@ class Config:
         :return: New instance of the config object
         :rtype: Config
         """
-        if not os.path.exists(path):
-            raise ConfigurationException("Configuration file '{}' does not exist, did you specify the correct path?".format(path))
+        return Config.parse(read_parser(path), path)
 
-        config = Config()
+    @staticmethod
+    def load_all(path):
+        """
+        Read a configuration file of a single server or a fleet configuration file
+        :param path: Path to the configuration file to be loaded
+        :return: Configurations of all servers in the file
+        :rtype: list[Config]
+        """
+        parser = read_parser(path)
 
-        parser = ConfigParser()
-        parser.read(path)
+        if any(section.startswith(("host:", "template:")) for section in parser.sections()):
+            return Config.parse_fleet(parser, path)
+
+        return [Config.parse(parser, path)]
+
+    @staticmethod
+    def parse_fleet(parser, path):
+        """
+        Extract the configurations of all hosts of a fleet configuration file
+        The regular sections contain the defaults of every host. A [host:NAME] or [template:NAME] section overrides
+        options of any section without naming it, and can inherit the options of a template with `inherit`.
+        :param parser: Parser of the fleet configuration file
+        :param path: Path to the fleet configuration file
+        :type parser: ConfigParser
+        :type path: str
+        :return: Configurations of all hosts, in the order of the file
+        :rtype: list[Config]
+        """
+        sections = {option: section for section, options in Config.OPTIONS.items() for option in options}
+        defaults = {section: dict(parser.items(section, raw=True)) for section in parser.sections() if not section.startswith(("host:", "template:"))}
+        hosts = [section.split(":", 1)[1] for section in parser.sections() if section.startswith("host:")]
+
+        for section in parser.sections():
+            if section.startswith(("host:", "template:")):
+                for option in parser.options(section):
+                    if option not in sections and option != "inherit" and option not in parser.defaults():
+                        raise ConfigurationException("Unknown option '{}' in section [{}] of configuration file '{}'".format(option, section, path))
+
+        configs = []
+
+        for host in hosts:
+            values = {section: dict(options) for section, options in defaults.items()}
+            values["server"] = dict(values.get("server", {}), server_name=host)
+
+            for section in reversed(get_inheritance(parser, "host:" + host, path)):
+                for option, value in parser.items(section, raw=True):
+                    if option in sections:
+                        values.setdefault(sections[option], {})[option] = value
+
+            host_parser = ConfigParser()
+            host_parser.read_dict(values)
+            configs.append(Config.parse(host_parser, "{} [host:{}]".format(path, host)))
+
+        duplicate = get_duplicate(config.server_name for config in configs)
+
+        if duplicate is not None:
+            raise ConfigurationException("Duplicate server_name '{}' in configuration file '{}'".format(duplicate, path))
+
+        return configs
+
+    @staticmethod
+    def parse(parser, path):
+        """
+        Extract and validate the configuration of a single server
+        :param parser: Parser of the configuration file
+        :param path: Path to the configuration file, used in error messages
+        :type parser: ConfigParser
+        :type path: str
+        :return: New instance of the config object
+        :rtype: Config
+        """
+        config = Config()
 
         try:
             config.server_name = parser.get("server", "server_name")
             config.server_port = parser.getint("server", "server_port", fallback=21)
-            config.server_address = parser.get("server", "server_address")
+            config.server_baseline = parser.get("server", "server_baseline", fallback=None) or None
+            config.server_backend = parser.get("server", "server_backend", fallback=None) or "ssh"
 
-            config.auth_username = parser.get("auth", "auth_username")
-            config.auth_private_key = os.path.expanduser(parser.get("auth", "auth_private_key"))
+            # The local backend scans the host the tool runs on, it doesn't need an address or credentials
+            if config.server_backend == "local":
+                config.server_address = parser.get("server", "server_address", fallback=None) or "localhost"
+            else:
+                config.server_address = parser.get("server", "server_address")
+                config.auth_username = parser.get("auth", "auth_username")
+                config.auth_private_key = os.path.expanduser(parser.get("auth", "auth_private_key"))
 
-            config.ignore_files = parser.get("filter", "ignore_files").split(",") or []
-            config.ignore_directories = parser.get("filter", "ignore_directories").split(",") or []
+            config.ignore_files = split_list(parser.get("filter", "ignore_files"))
+            config.ignore_directories = split_list(parser.get("filter", "ignore_directories"))
             config.start_directory = parser.get("filter", "start_directory")
+            config.extra_directories = split_list(parser.get("filter", "extra_directories", fallback=""))
             config.scan_php_modules = parser.getboolean("filter", "scan_php_modules")
+            config.hash_algorithm = parser.get("filter", "hash_algorithm", fallback=None) or "sha512"
+            config.scan_interval = get_optional_int(parser, "filter", "scan_interval")
+            config.partial_hash_threshold = get_optional_int(parser, "filter", "partial_hash_threshold")
+            config.partial_hash_chunks = get_optional_int(parser, "filter", "partial_hash_chunks") or 8
+            config.partial_hash_full_interval = get_optional_int(parser, "filter", "partial_hash_full_interval")
+            config.due_roots = None
+            config.full_hash_roots = []
+            config.scan_roots = [ScanRoot.load(parser, name, config) for name in split_list(parser.get("filter", "roots", fallback=""))]
+
+            config.quick_check_runs = get_optional_int(parser, "quick_check", "quick_check_runs") or 24
+            config.quick_check_risky_extensions = split_list(parser.get(
+                "quick_check", "quick_check_risky_extensions", fallback=None) or "php,phtml,phar,inc,sh,pl,py,cgi,so")
+            config.quick_check_max_staleness = get_optional_int(parser, "quick_check", "quick_check_max_staleness")
 
             config.email_smtp_host = parser.get("email", "email_smtp_host") or None
             config.email_smtp_user = parser.get("email", "email_smtp_user") or None
             config.email_smtp_pass = parser.get("email", "email_smtp_pass") or None
-            config.email_recipients = parser.get("email", "email_recipients") or None
+            config.email_recipients = split_list(parser.get("email", "email_recipients"))
             config.email_noreply_address = parser.get("email", "email_noreply_address") or None
 
             config.telegram_api_token = parser.get("telegram", "telegram_api_token") or None
+            config.telegram_api_url = parser.get("telegram", "telegram_api_url", fallback=None) or "https://api.telegram.org"
 
             try:
                 config.telegram_api_chat_id = parser.getint("telegram", "telegram_api_chat_id") or None
@@ -93,12 +398,218 @@ class Config:
 
             config.logging_syslog_host = parser.get("logging", "logging_syslog_host") or None
 
+            config.database_path = parser.get("database", "database_path", fallback=None) or None
+            config.database_storage = parser.get("database", "database_storage", fallback=None) or "plain"
+
+            config.retention_days = get_optional_int(parser, "retention", "retention_days")
+            config.retention_max_events = get_optional_int(parser, "retention", "retention_max_events")
+            config.retention_archive_directory = parser.get("retention", "retention_archive_directory", fallback=None) or None
+            config.retention_vacuum = parser.get("retention", "retention_vacuum", fallback=None) or "none"
+
+            config.metrics_textfile = parser.get("metrics", "metrics_textfile", fallback=None) or None
+            config.metrics_listen_address = parser.get("metrics", "metrics_listen_address", fallback=None) or "127.0.0.1"
+
+            try:
+                config.metrics_listen_port = parser.getint("metrics", "metrics_listen_port", fallback=None) or None
+            except ValueError:
+                config.metrics_listen_port = None
+
         except (NoSectionError, NoOptionError) as e:
             raise ConfigurationException("{} in configuration file '{}'".format(str(e), path))
 
+        except ValueError as e:
+            raise ConfigurationException("{} in configuration file '{}'".format(str(e), path))
+
+        if config.server_backend not in ("ssh", "local"):
+            raise ConfigurationException("Invalid server_backend '{}' in configuration file '{}'".format(config.server_backend, path))
+
+        if config.database_storage not in ("plain", "normalized"):
+            raise ConfigurationException("Invalid database_storage '{}' in configuration file '{}'".format(config.database_storage, path))
+
+        names = [root.name for root in config.get_scan_roots()]
+
+        if len(set(names)) != len(names):
+            raise ConfigurationException("Duplicate root name in configuration file '{}'".format(path))
+
+        for root in config.get_scan_roots():
+            if root.hash_algorithm not in ScanRoot.HASH_COMMANDS:
+                raise ConfigurationException("Invalid hash_algorithm '{}' of root '{}' in configuration file '{}'".format(root.hash_algorithm, root.name, path))
+
+            if not root.name.replace("-", "").replace("_", "").isalnum() or not any(root.directories):
+                raise ConfigurationException("Invalid root '{}' in configuration file '{}'".format(root.name, path))
+
+            if root.partial_hash_threshold is not None and root.partial_hash_threshold < 0:
+                raise ConfigurationException("Invalid partial_hash_threshold '{}' of root '{}' in configuration file '{}'".format(
+                    root.partial_hash_threshold, root.name, path))
+
+        if config.partial_hash_threshold is not None and config.partial_hash_threshold < 0:
+            raise ConfigurationException("Invalid partial_hash_threshold '{}' in configuration file '{}'".format(config.partial_hash_threshold, path))
+
+        if config.quick_check_runs < 1:
+            raise ConfigurationException("Invalid quick_check_runs '{}' in configuration file '{}'".format(config.quick_check_runs, path))
+
+        if config.quick_check_max_staleness is not None and config.quick_check_max_staleness < 1:
+            raise ConfigurationException("Invalid quick_check_max_staleness '{}' in configuration file '{}'".format(
+                config.quick_check_max_staleness, path))
+
+        if config.retention_vacuum not in ("none", "incremental", "full"):
+            raise ConfigurationException("Invalid retention_vacuum '{}' in configuration file '{}'".format(config.retention_vacuum, path))
+
         for attr in config.__dict__.keys():
             if getattr(config, attr) == "":
                 raise ConfigurationException("Missing attribute value '{}' in configuration file '{}'".format(attr, path))
 
         return config
 
+
+class ConfigCache:
+    """
+    Loaded configurations keyed by path, a file is only read and validated again once its modification time changed
+    Used by the daemon to pick up changed configuration files every run without parsing all of them every run
+    """
+
+    def __init__(self):
+        """
+        Configuration cache constructor
+        """
+        self.entries = {}
+
+    def load(self, paths):
+        """
+        Load the configurations of all servers in the given files, all files are validated before any server is scanned
+        :param paths: Paths to configuration files of single servers or fleets
+        :type paths: list[str]
+        :return: Configurations of all servers
+        :rtype: list[Config]
+        """
+        configs = []
+
+        for path in paths:
+            try:
+                modified_at = os.stat(path).st_mtime_ns
+            except OSError:
+                raise ConfigurationException("Configuration file '{}' does not exist, did you specify the correct path?".format(path))
+
+            if path not in self.entries or self.entries[path][0] != modified_at:
+                self.entries[path] = (modified_at, Config.load_all(path))
+
+            configs += self.entries[path][1]
+
+        duplicate = get_duplicate(config.server_name for config in configs)
+
+        if duplicate is not None:
+            raise ConfigurationException("Server '{}' is configured more than once".format(duplicate))
+
+        return configs
+
+
+def read_parser(path):
+    """
+    Read a configuration file
+    :param path: Path to the configuration file
+    :type path: str
+    :rtype: ConfigParser
+    """
+    if not os.path.exists(path):
+        raise ConfigurationException("Configuration file '{}' does not exist, did you specify the correct path?".format(path))
+
+    parser = ConfigParser()
+
+    try:
+        parser.read(path)
+    except ParserError as e:
+        raise ConfigurationException("{} in configuration file '{}'".format(str(e).splitlines()[0], path))
+
+    return parser
+
+
+def get_inheritance(parser, section, path):
+    """
+    Get a section of a fleet configuration file followed by all templates it inherits from, nearest first
+    :param parser: Parser of the fleet configuration file
+    :param section: Name of the host or template section
+    :param path: Path to the fleet configuration file, used in error messages
+    :type parser: ConfigParser
+    :type section: str
+    :type path: str
+    :return: List of section names
+    :rtype: list[str]
+    """
+    chain = [section]
+
+    while parser.get(chain[-1], "inherit", fallback=None):
+        parent = "template:" + parser.get(chain[-1], "inherit").strip()
+
+        if not parser.has_section(parent):
+            raise ConfigurationException("Unknown template in section [{}] of configuration file '{}'".format(chain[-1], path))
+
+        if parent in chain:
+            raise ConfigurationException("Circular inheritance of section [{}] in configuration file '{}'".format(parent, path))
+
+        chain.append(parent)
+
+    return chain
+
+
+def get_duplicate(values):
+    """
+    Get the first value that occurs more than once
+    :param values: Values to check
+    :type values: collections.Iterable
+    :return: Duplicate value, None if all values are unique
+    """
+    seen = set()
+
+    for value in values:
+        if value in seen:
+            return value
+
+        seen.add(value)
+
+    return None
+
+
+def split_list(value):
+    """
+    Split a comma separated configuration value
+    :param value: Comma separated value
+    :type value: str
+    :return: List of non-empty, stripped items
+    :rtype: list[str]
+    """
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def get_optional_int(parser, section, option):
+    """
+    Read an optional integer, a missing or empty value results in None
+    :param parser: Parser of the configuration file
+    :param section: Name of the section
+    :param option: Name of the option
+    :type parser: ConfigParser
+    :type section: str
+    :type option: str
+    :return: Value, None if it isn't set or zero
+    :rtype: int
+    """
+    value = parser.get(section, option, fallback="").strip()
+    return int(value) or None if value else None
+
+
+def get_inherited_int(parser, section, option, default):
+    """
+    Read an optional integer that overrides a default, a missing or empty value results in the default
+    Zero explicitly disables the option, even if the default enables it
+    :param parser: Parser of the configuration file
+    :param section: Name of the section
+    :param option: Name of the option
+    :param default: Value to use if the option isn't set
+    :type parser: ConfigParser
+    :type section: str
+    :type option: str
+    :type default: int
+    :return: Value, None if it is zero
+    :rtype: int
+    """
+    value = parser.get(section, option, fallback="").strip()
+    return default if not value else int(value) or None
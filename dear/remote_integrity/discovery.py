@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import atexit
+import json
+import os
+from threading import Lock
+
+from dear.remote_integrity.models import database_is_read_only, get_database_path
+
+
+class DiscoveryCache:
+    """
+    Persistent cache of what was discovered on the remote servers (absolute scan roots and php extension directories)
+    The cache is stored as JSON next to the database and shared by all servers scanned by this process
+    Changes are written once by flush(), after all servers were scanned or when the process exits
+    While the database is opened read-only (eg. during a dry run) changes are only kept in memory
+    """
+
+    FILE_NAME = "discovery-cache.json"
+
+    lock = Lock()
+    path = None
+    entries = {}
+    dirty = False
+
+    @classmethod
+    def get(cls, server_name):
+        """
+        Get the discovery of a server
+        :param server_name: Name of the server
+        :type server_name: str
+        :return: Discovery, or None if the server wasn't discovered yet
+        :rtype: dict
+        """
+        with cls.lock:
+            cls._load()
+            return cls.entries.get(server_name)
+
+    @classmethod
+    def set(cls, server_name, discovery):
+        """
+        Store the discovery of a server
+        :param server_name: Name of the server
+        :param discovery: JSON serializable discovery
+        :type server_name: str
+        :type discovery: dict
+        :return: None
+        """
+        with cls.lock:
+            cls._load()
+            cls.entries[server_name] = discovery
+            cls.dirty = True
+
+    @classmethod
+    def discard(cls, server_name):
+        """
+        Remove the discovery of a server, so it is discovered again on the next scan
+        :param server_name: Name of the server
+        :type server_name: str
+        :return: None
+        """
+        with cls.lock:
+            cls._load()
+
+            if cls.entries.pop(server_name, None) is not None:
+                cls.dirty = True
+
+    @classmethod
+    def flush(cls):
+        """
+        Write the changes of the cache to its file, if there are any
+        :return: None
+        """
+        with cls.lock:
+            if cls.dirty:
+                cls._save()
+
+    @classmethod
+    def _load(cls):
+        """
+        Read the cache file of the database in use, unless it was already read
+        Changes to the cache of a database that is no longer in use are written first
+        A missing or corrupt cache file results in an empty cache
+        :return: None
+        """
+        path = os.path.join(os.path.dirname(get_database_path()), cls.FILE_NAME)
+
+        if path == cls.path:
+            return
+
+        if cls.dirty:
+            cls._save()
+
+        cls.path = path
+
+        try:
+            with open(path) as file:
+                cls.entries = json.load(file)
+        except (OSError, ValueError):
+            cls.entries = {}
+
+    @classmethod
+    def _save(cls):
+        """
+        Write the cache file, the cache is only an optimization so failures are ignored
+        :return: None
+        """
+        cls.dirty = False
+
+        if database_is_read_only():
+            return
+
+        try:
+            with open(cls.path + ".tmp", "w") as file:
+                json.dump(cls.entries, file, indent=2, sort_keys=True)
+
+            os.replace(cls.path + ".tmp", cls.path)
+        except OSError as e:
+            print("[!] Warning: Unable to write discovery cache '{}', reason: {}".format(cls.path, e))
+
+
+atexit.register(DiscoveryCache.flush)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+from collections import namedtuple
+
+from dear.remote_integrity.golden import GoldenBaseline
+from dear.remote_integrity.models import database_exists, database_is_upgraded, Checksum, Event, Root, Server
+
+
+class PredictedEvent(namedtuple("PredictedEvent", ["event", "path", "root"])):
+    """
+    Event that a regular scan would have stored
+    """
+
+    __slots__ = ()
+
+    @property
+    def description(self):
+        """
+        Get the human readable description of the event
+        :rtype: str
+        """
+        return Event.DESCRIPTIONS[self.event].format(path=self.path)
+
+
+class DryRun:
+    """
+    Predicts the events of a scan of a server, without writing to the database or sending notifications
+    The checksum list is diffed against the stored checksums (or the golden baseline) exactly like a regular scan does,
+    so additions on the first scan of a server or root and modifications after a hash algorithm change aren't predicted.
+    The database should be opened read-only with models.use_database, a missing database predicts a first run.
+    Databases that weren't upgraded to the current schema yet are read as they are, so a read-only replica can be checked.
+    """
+
+    def __init__(self, config, pipeline):
+        """
+        Dry run constructor
+        :param config: Configuration of the server
+        :param pipeline: Pipeline used to diff the checksum list
+        :type config: config.Config
+        :type pipeline: pipeline.Pipeline
+        """
+        self.config = config
+        self.pipeline = pipeline
+        self.server = Server.get(config.server_name) if database_exists() else None
+        self.upgraded = self.server is None or database_is_upgraded()
+        self.changes = {}
+        self.events = []
+
+    def predict(self, listing):
+        """
+        Predict the events of a checksum list
+        :param listing: Current checksum list of the server, parsed by the pipeline
+        :type listing: pipeline.Listing
+        :return: Predicted events
+        :rtype: list[PredictedEvent]
+        """
+        if self.config.server_baseline:
+            deviations = GoldenBaseline.load(self.config.server_baseline).compare(self.config.server_name, listing)
+            self.events = [PredictedEvent(deviation.event, deviation.path, None) for deviation in deviations]
+            return self.events
+
+        if self.server is None:
+            print("[+] Server '{}' is not in the database, a scan would set up the tracker without reporting changes".format(self.config.server_name))
+
+        roots = {root.name: root for root in self.config.get_scan_roots()}
+
+        for name in listing.roots:
+            self._predict_root(roots[name], listing)
+
+        return self.events
+
+    def _predict_root(self, root, listing):
+        """
+        Predict the events of a single root, like integrity.Integrity does when identifying its changes
+        :param root: Root to predict the events of
+        :param listing: Current checksum list of the server
+        :type root: config.ScanRoot
+        :type listing: pipeline.Listing
+        :return: None
+        """
+        index = self._get_index(root)
+        record = Root.get_settings(self.server, root.name) if self.server else None
+        policy_changed = record is not None and record.partial_hash_threshold != root.partial_hash_threshold
+        changes = self.pipeline.diff(listing, root.name, index, policy_changed)
+
+        root_is_new = record is None and not any(changes.modified + changes.removed) and len(changes.added) == changes.files_seen
+        algorithm_changed = record is not None and record.hash_algorithm != root.hash_algorithm
+
+        if root_is_new and self.server is not None:
+            print("[+] Root '{}' was never scanned, a scan wouldn't report its files as new".format(root.name))
+
+        if algorithm_changed:
+            print("[+] Hash algorithm of root '{}' changed to {}, a scan would update its checksums without reporting modifications".format(
+                root.name, root.hash_algorithm))
+
+        if any(changes.rehashed):
+            print("[+] A scan would update {} checksums of root '{}' that were calculated in another hash mode".format(len(changes.rehashed), root.name))
+
+        if self.server is None or root_is_new:
+            changes = changes._replace(added=[])
+
+        if algorithm_changed:
+            changes = changes._replace(modified=[])
+
+        self.changes[root.name] = changes
+        self.events += [PredictedEvent(Event.FILE_ADDED, path, root.name) for path, checksum in changes.added]
+        self.events += [PredictedEvent(Event.FILE_MODIFIED, path, root.name) for checksum_id, path, checksum in changes.modified]
+        self.events += [PredictedEvent(Event.FILE_REMOVED, path, root.name) for checksum_id, path in changes.removed]
+
+    def _get_index(self, root):
+        """
+        Get the stored checksums of a root, from the table layout of the database
+        :param root: Root to get the checksums of
+        :type root: config.ScanRoot
+        :return: Stored (id, path, checksum) tuples
+        :rtype: collections.Iterable
+        """
+        if self.server is None:
+            return []
+
+        if not self.upgraded:
+            return Checksum.get_legacy_index(self.server, root.name)
+
+        return Checksum.get_index(self.server, root.name)
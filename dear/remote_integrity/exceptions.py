@@ -23,3 +23,23 @@ class DirectoryNotFoundException(DearBytesException):
 
 class IntegrityException(DearBytesException):
     pass
+
+
+class MetricsException(DearBytesException):
+    pass
+
+
+class RetentionException(DearBytesException):
+    pass
+
+
+class FeedException(DearBytesException):
+    pass
+
+
+class NotificationException(DearBytesException):
+    pass
+
+
+class SnapshotException(DearBytesException):
+    pass
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import json
+import os
+import sys
+import time
+
+from dear.remote_integrity.exceptions import FeedException
+from dear.remote_integrity.models import session, Event
+
+
+class ChangeFeed:
+    """
+    Cursor based feed over the events table, so other systems (eg. a SIEM) can ingest the events incrementally
+    The cursor is the ID of the last event that was read. Event IDs only increase and pruned IDs are never handed out
+    again (the table uses AUTOINCREMENT), so every event is read once. Nothing is written to the database.
+    If a cursor file is given the cursor is read from it and committed to it, so the next feed continues where this one stopped.
+    """
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, cursor_path=None, server_name=None):
+        """
+        Change feed constructor
+        :param cursor_path: File the cursor is stored in, without a file all events are read
+        :param server_name: Only read the events of this server
+        :type cursor_path: str
+        :type server_name: str
+        """
+        self.cursor_path = os.path.expanduser(cursor_path) if cursor_path else None
+        self.server_name = server_name
+        self.cursor = self._load_cursor()
+
+    def read(self, limit=BATCH_SIZE):
+        """
+        Read the next batch of events and move the cursor past them
+        :param limit: Maximum amount of events
+        :type limit: int
+        :return: List of JSON serializable event dicts, oldest first
+        :rtype: list[dict]
+        """
+        records = Event.feed(self.cursor, limit, self.server_name)
+        events = [record.to_archive_dict() for record in records]
+
+        for record in records:
+            session.expunge(record)
+
+        if any(events):
+            self.cursor = events[-1]["id"]
+
+        return events
+
+    def commit(self):
+        """
+        Store the cursor in the cursor file
+        :return: None
+        """
+        if not self.cursor_path:
+            return
+
+        try:
+            with open(self.cursor_path + ".tmp", "w") as file:
+                json.dump({"cursor": self.cursor}, file)
+
+            os.replace(self.cursor_path + ".tmp", self.cursor_path)
+        except OSError as e:
+            raise FeedException("Unable to write cursor file '{}', reason: {}".format(self.cursor_path, e))
+
+    def _load_cursor(self):
+        """
+        Read the cursor from the cursor file, a missing file starts at the first event
+        :return: ID of the last event that was read
+        :rtype: int
+        """
+        if not self.cursor_path or not os.path.exists(self.cursor_path):
+            return 0
+
+        try:
+            with open(self.cursor_path) as file:
+                return int(json.load(file)["cursor"])
+
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise FeedException("Unable to read cursor file '{}', reason: {}".format(self.cursor_path, e))
+
+
+class NdjsonExporter:
+    """
+    Streams the events of a change feed as JSON Lines (NDJSON), one event per line
+    Events are appended to a file (eg. tailed by a log shipper) or written to stdout (eg. piped into a socket).
+    The cursor is committed after every batch that was written, so an interrupted export never skips events.
+    """
+
+    def __init__(self, feed, path="-"):
+        """
+        Exporter constructor
+        :param feed: Change feed to export
+        :param path: File to append the events to, - writes to stdout
+        :type feed: ChangeFeed
+        :type path: str
+        """
+        self.feed = feed
+        self.path = path
+        self.exported = 0
+
+    def export(self):
+        """
+        Export all events that are available
+        :return: Amount of events that were exported
+        :rtype: int
+        """
+        exported = self.exported
+        file = self._open()
+
+        try:
+            for events in iter(self.feed.read, []):
+                file.writelines(json.dumps(event) + "\n" for event in events)
+                file.flush()
+                self.feed.commit()
+                self.exported += len(events)
+
+        except OSError as e:
+            raise FeedException("Unable to export events to '{}', reason: {}".format(self.path, e))
+
+        finally:
+            if file is not sys.stdout:
+                file.close()
+
+        return self.exported - exported
+
+    def follow(self, interval):
+        """
+        Keep exporting new events, the database is polled every interval
+        :param interval: Amount of seconds between two polls
+        :type interval: int
+        :return: None
+        """
+        while True:
+            self.export()
+            time.sleep(interval)
+
+    def _open(self):
+        """
+        Open the output of the exporter
+        :return: File object
+        """
+        if self.path == "-":
+            return sys.stdout
+
+        try:
+            return open(os.path.expanduser(self.path), "a", encoding="utf-8")
+        except OSError as e:
+            raise FeedException("Unable to open export file '{}', reason: {}".format(self.path, e))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+from collections import namedtuple
+from datetime import datetime
+
+from dear.remote_integrity.exceptions import IntegrityException
+from dear.remote_integrity.hashing import compare_checksums, SAME, EXTENDED
+from dear.remote_integrity.models import Baseline, Event
+
+
+class Deviation(namedtuple("Deviation", ["event", "path", "expected", "actual", "server", "baseline", "timestamp"])):
+    """
+    Immutable record of a difference between a server and a golden baseline
+    """
+
+    __slots__ = ()
+
+    @property
+    def description(self):
+        """
+        Get the human readable description of the deviation
+        :rtype: str
+        """
+        return Event.DESCRIPTIONS[self.event].format(path=self.path) + " (compared to baseline '{}')".format(self.baseline)
+
+
+class GoldenBaseline:
+    """
+    Reference snapshot that any number of servers can be checked against
+    The digests are loaded into memory once per process and shared by all servers using the baseline
+    """
+
+    loaded = {}
+
+    def __init__(self, name, index):
+        """
+        Golden baseline constructor
+        :param name: Name of the baseline
+        :param index: Dict of checksums keyed by path
+        :type name: str
+        :type index: dict
+        """
+        self.name = name
+        self.index = index
+
+    @classmethod
+    def load(cls, name):
+        """
+        Get a golden baseline by name, it is only read from the database the first time
+        :param name: Name of the baseline
+        :type name: str
+        :return: Golden baseline
+        :rtype: GoldenBaseline
+        """
+        if name not in cls.loaded:
+            baseline = Baseline.get(name)
+
+            if baseline is None:
+                raise IntegrityException("Baseline '{}' does not exist, register it with --register-baseline first".format(name))
+
+            cls.loaded[name] = cls(name, baseline.get_index())
+            print("[+] Loaded baseline '{}' ({} files)".format(name, len(cls.loaded[name].index)))
+
+        return cls.loaded[name]
+
+    @classmethod
+    def register(cls, name, output):
+        """
+        Store a new reference snapshot, replacing an existing snapshot with the same name
+        :param name: Name of the baseline
+        :param output: List of (path, checksum) tuples
+        :type name: str
+        :type output: list
+        :return: Golden baseline
+        :rtype: GoldenBaseline
+        """
+        Baseline.register(name, output)
+        cls.loaded[name] = cls(name, dict(output))
+        return cls.loaded[name]
+
+    def compare(self, server_name, output):
+        """
+        Compare the checksum list of a server to the baseline
+        :param server_name: Name of the server the output belongs to
+        :param output: List of (path, checksum) tuples
+        :type server_name: str
+        :type output: list
+        :return: List of deviations
+        :rtype: list[Deviation]
+        """
+        timestamp = datetime.now()
+        deviations = []
+        seen = set()
+
+        for path, checksum in output:
+            expected = self.index.get(path)
+            seen.add(path)
+
+            if expected is None:
+                deviations.append(Deviation(Event.FILE_ADDED, path, None, checksum, server_name, self.name, timestamp))
+            elif expected != checksum and compare_checksums(expected, checksum) not in (SAME, EXTENDED):
+                deviations.append(Deviation(Event.FILE_MODIFIED, path, expected, checksum, server_name, self.name, timestamp))
+
+        for path in sorted(self.index.keys() - seen):
+            deviations.append(Deviation(Event.FILE_REMOVED, path, self.index[path], None, server_name, self.name, timestamp))
+
+        return deviations
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+
+# Hash modes of a checksum
+FULL = "full"
+PARTIAL = "partial"
+
+# Results of comparing two checksums
+SAME = "same"
+EXTENDED = "extended"
+MODIFIED = "modified"
+INCOMPARABLE = "incomparable"
+
+
+def format_checksum(hash_mode, checksum, full_checksum=None):
+    """
+    Format a checksum as it appears in a checksum list
+    Full checksums are plain hex strings, partial checksums are written as `partial:CHECKSUM[:FULL_CHECKSUM]`
+    :param hash_mode: Hash mode of the checksum
+    :param checksum: Hex encoded checksum
+    :param full_checksum: Hex encoded checksum of the whole file, only for partial checksums
+    :type hash_mode: str
+    :type checksum: str
+    :type full_checksum: str
+    :rtype: str
+    """
+    if hash_mode != PARTIAL:
+        return checksum
+
+    return ":".join([PARTIAL, checksum] + ([full_checksum] if full_checksum else []))
+
+
+def parse_checksum(token):
+    """
+    Parse a checksum as it appears in a checksum list
+    :param token: Formatted checksum
+    :type token: str
+    :return: Tuple of the hash mode, checksum and full checksum (None if unknown)
+    :rtype: tuple
+    """
+    if not token.startswith(PARTIAL + ":"):
+        return FULL, token, None
+
+    parts = token.split(":")
+    return PARTIAL, parts[1], parts[2] if len(parts) > 2 else None
+
+
+def compare_checksums(stored, current):
+    """
+    Compare two formatted checksums, only checksums calculated in the same way are compared
+    A partial checksum without a full checksum matches the same partial checksum with any full checksum.
+    Checksums of different hash modes are compared by their full checksums if both have one.
+    :param stored: Known checksum
+    :param current: Current checksum
+    :type stored: str
+    :type current: str
+    :return: SAME, EXTENDED if only the current checksum contains a full checksum, MODIFIED or INCOMPARABLE if the hash modes differ
+    :rtype: str
+    """
+    stored_mode, stored_checksum, stored_full = parse_checksum(stored)
+    current_mode, current_checksum, current_full = parse_checksum(current)
+
+    if stored_mode != current_mode:
+        stored_full = stored_checksum if stored_mode == FULL else stored_full
+        current_full = current_checksum if current_mode == FULL else current_full
+        return MODIFIED if stored_full and current_full and stored_full != current_full else INCOMPARABLE
+
+    if stored_checksum != current_checksum or (stored_full and current_full and stored_full != current_full):
+        return MODIFIED
+
+    return EXTENDED if current_full and not stored_full else SAME
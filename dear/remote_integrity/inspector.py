@@ -2,7 +2,7 @@
 # Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
 from tabulate import tabulate
 
-from dear.remote_integrity.models import Server, Checksum, Event
+from dear.remote_integrity.models import database_exists, upgrade_database, Server, Checksum, Event, ScanRun, Baseline, Root
 
 
 class Inspector:
@@ -19,6 +19,9 @@ class Inspector:
         Run the database inspector
         :return: None
         """
+        if database_exists():
+            upgrade_database()
+
         if self.args.list == "servers":
             return self._list_servers()
 
@@ -28,6 +31,21 @@ class Inspector:
         if self.args.list == "events":
             return self._list_events()
 
+        if self.args.list == "runs":
+            return self._list_runs()
+
+        if self.args.list == "drift":
+            return self._list_drift()
+
+        if self.args.list == "baselines":
+            return self._list_baselines()
+
+        if self.args.list == "roots":
+            return self._list_roots()
+
+        if self.args.list == "coverage":
+            return self._list_coverage()
+
     def _list_servers(self):
         """
         Print a list of all servers
@@ -51,3 +69,43 @@ class Inspector:
         """
         data = Event.query().all()
         print(tabulate([d.values() for d in data], Event.keys(), "grid"))
+
+    def _list_roots(self):
+        """
+        Print a list of the roots of all servers and the last time they were scanned
+        :return: None
+        """
+        data = Root.query().all()
+        print(tabulate([d.values() for d in data], Root.keys(), "grid"))
+
+    def _list_coverage(self):
+        """
+        Print how many files of every server were verified and when the least recently verified file was hashed
+        :return: None
+        """
+        data = [row + ("{:.1%}".format(row[2] / row[1]),) for row in Checksum.get_coverage(server_name=self.args.server)]
+        print(tabulate(data, ["server", "files", "verified", "oldest verification", "coverage"], "grid"))
+
+    def _list_runs(self):
+        """
+        Print a list of the latest scan runs, optionally filtered by server and limited in amount
+        :return: None
+        """
+        data = ScanRun.latest(server_name=self.args.server, limit=self.args.limit)
+        print(tabulate([d.values() + [d.duration] for d in data], ScanRun.keys() + ["duration"], "grid"))
+
+    def _list_drift(self):
+        """
+        Print the servers tracking a path grouped by checksum, or all paths that differ across servers
+        :return: None
+        """
+        data = Checksum.drift(path=self.args.path)
+        print(tabulate(data, ["path", "checksum", "servers", "server names"], "grid"))
+
+    def _list_baselines(self):
+        """
+        Print a list of all golden baselines
+        :return: None
+        """
+        data = Baseline.query().all()
+        print(tabulate([d.values() + [d.count()] for d in data], Baseline.keys() + ["files"], "grid"))
@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 # Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+from datetime import datetime
+
 from axel import Event as EventHandler
 
-from dear.remote_integrity.models import database_exists, create_database, DATABASE_PATH, Server, Checksum, Event
+from dear.remote_integrity.models import database_exists, prepare_database, get_database_path
+from dear.remote_integrity.models import Server, Checksum, Event, ScanRun, Root
+from dear.remote_integrity.pipeline import Pipeline, Listing
 
 
 class Integrity:
@@ -11,16 +15,22 @@ class Integrity:
     If the current server does not exist in the database, a new record will be added
     """
 
-    def __init__(self, config):
+    def __init__(self, config, pipeline=None):
         """
         Integrity constructor
         :param config: Configuration object
+        :param pipeline: Pipeline used to diff the checksum list, defaults to diffing in the current process
         :type config: config.Config
+        :type pipeline: pipeline.Pipeline
         """
         self.config = config
+        self.pipeline = pipeline or Pipeline()
         self.server = None
         self.server_is_new = False  # If set to true, no events will be fired
         self.events = []
+        self.scan_run = None
+        self.quick_check = None  # Set when only a sample of the files was hashed this run
+        self.started_at = datetime.now()
 
         self.on_events_detected = EventHandler()
 
@@ -30,16 +40,34 @@ class Integrity:
         :return: None
         """
         if not database_exists():
-            print("[+] No database found, creating database '{}'".format(DATABASE_PATH))
-            create_database()
+            print("[+] No database found, creating database '{}'".format(get_database_path()))
+
+        prepare_database()
 
         if self._server_exists():
             self._load_server()
         else:
-            print("[+] First run detected for server '{}', setting up tracker.".format(self.config.server_name))
-            print("[?] Note: No changes will be able to be detected this session")
             self._add_server()
 
+            if not self.config.server_baseline:
+                print("[+] First run detected for server '{}', setting up tracker.".format(self.config.server_name))
+                print("[?] Note: No changes will be able to be detected this session")
+
+        self._load_storage_mode()
+
+    def _load_storage_mode(self):
+        """
+        Set the checksum storage mode, existing checksums are converted when switching to normalized storage
+        :return: None
+        """
+        Checksum.normalized = self.config.database_storage == "normalized"
+
+        if Checksum.normalized and not self.server_is_new:
+            converted = Checksum.normalize(self.server)
+
+            if converted:
+                print("[+] Converted {} checksums to normalized storage".format(converted))
+
     def _server_exists(self):
         """
         Check if this server already is being tracked
@@ -63,82 +91,201 @@ class Integrity:
         """
         self.server = Server.get(name=self.config.server_name)
 
-    def identify(self, output):
+    def finish_scan_run(self, files_seen, bytes_transferred):
         """
-        Identify
-        :param output: Server output
-        :type output: list
-        :return:
+        Record the summary of the current scan run, events detected during this run will reference it
+        Must be called after identify()
+        :param files_seen: Amount of files that were found on the server
+        :param bytes_transferred: Amount of bytes received from the server
+        :type files_seen: int
+        :type bytes_transferred: int
+        :return: Scan run record
+        :rtype: models.ScanRun
         """
-        for index, (path, checksum) in enumerate(output):
+        self.scan_run = ScanRun.create(
+            server=self.server,
+            status=ScanRun.SUCCESS,
+            started_at=self.started_at,
+            mode=ScanRun.QUICK if self.quick_check else ScanRun.FULL,
+            files_seen=files_seen,
+            files_hashed=self.quick_check.files_hashed if self.quick_check else files_seen,
+            bytes_transferred=bytes_transferred,
+            files_added=self._get_addition_event_count(),
+            files_removed=self._get_removal_event_count(),
+            files_modified=self._get_modified_event_count())
 
-            # Find the checksum record
-            checksum_record = self.server.get_related_checksum(path, checksum)
+        for event in self.events:
+            if isinstance(event, Event):
+                event.scan_run = self.scan_run
 
-            # New (unknown) file detected
-            if checksum_record is None:
-                checksum_record = Checksum.create(path=path, checksum=checksum, server=self.server)
-                self._handle_file_added(checksum_record)
-                continue
+        return self.scan_run
 
-            # Check if the file was modified
-            if checksum_record.checksum != checksum:
-                self._handle_file_modified(checksum_record, checksum)
-                checksum_record.checksum = checksum
-                continue
+    def record_failed_scan_run(self, error):
+        """
+        Record a failed scan run, pending changes of this run must have been rolled back
+        Nothing is recorded for servers that were not stored yet, so the next run is still treated as the first run
+        :param error: Reason the run failed
+        :type error: str
+        :return: None
+        """
+        server = Server.get(name=self.config.server_name)
+
+        if server is not None:
+            self.scan_run = ScanRun.create(server=server, status=ScanRun.FAILED, started_at=self.started_at, error=error)
+
+    def identify(self, output):
+        """
+        Identify the changes between the stored checksums of the server and its current checksum list
+        Every root in the output is diffed separately, roots that weren't scanned are left untouched
+        :param output: Server output, a list of (path, checksum) tuples of the default root or a listing parsed by the pipeline
+        :type output: list|pipeline.Listing
+        :return: None
+        """
+        if not isinstance(output, Listing):
+            output = Listing.from_pairs(output, self.pipeline.shards)
 
-        # Loop through all known records first and try to find them
-        for checksum_record in self.server.checksums:
-            if not any([o for o in output if o[0] == checksum_record.path]):
-                self._handle_file_removed(checksum_record)
-                checksum_record.delete()
+        roots = {root.name: root for root in self.config.get_scan_roots()}
+
+        for name in output.roots:
+            self._identify_root(roots[name], output)
 
         # On events detected
         if any(self.events):
-            self.on_events_detected.fire(self._get_events_as_anonymous_obj_list())
+            self.on_events_detected.fire(self._get_event_records())
+
+    def _identify_root(self, root, listing):
+        """
+        Identify the changes of a single root, the diff runs on the pipeline and the changes are written in bulk
+        Additions are not logged on the first scan of a root, modifications are not logged when its hash algorithm changed
+        Files that crossed the partial hash threshold are modified, unless the threshold of the root changed since its last scan,
+        then checksums that were calculated in another hash mode (partial or full) are updated without logging a modification
+        :param root: Root to identify the changes of
+        :param listing: Current checksum list of the server
+        :type root: config.ScanRoot
+        :type listing: pipeline.Listing
+        :return: None
+        """
+        index = Checksum.get_index(self.server, root.name)
+        record = Root.get(self.server, root.name)
+        policy_changed = record is not None and record.partial_hash_threshold != root.partial_hash_threshold
+        changes = self.pipeline.diff(listing, root.name, index, policy_changed)
+
+        Checksum.bulk_create(self.server, root.name, changes.added)
+        Checksum.bulk_update(changes.modified + changes.rehashed)
+        Checksum.bulk_delete([checksum_id for checksum_id, path in changes.removed] + changes.duplicates)
+
+        root_is_new = record is None and not any(changes.modified + changes.removed) and len(changes.added) == changes.files_seen
+        algorithm_changed = record is not None and record.hash_algorithm != root.hash_algorithm
+
+        if root_is_new and not self.server_is_new:
+            print("[+] First scan of root '{}' detected, no new files will be reported this session".format(root.name))
+
+        if algorithm_changed:
+            print("[+] Hash algorithm of root '{}' changed to {}, updating checksums".format(root.name, root.hash_algorithm))
+
+        if any(changes.rehashed):
+            print("[+] Updated {} checksums of root '{}' that were calculated in another hash mode".format(len(changes.rehashed), root.name))
+
+        full_hashed = root.name in self.config.full_hash_roots and not self.quick_check
+        Root.touch(self.server, root.name, root.hash_algorithm, self.started_at, full_hashed, root.partial_hash_threshold, self.quick_check is not None)
+        self._record_verification(root.name)
+        self._handle_changes(root.name, changes, not (self.server_is_new or root_is_new), not algorithm_changed)
+
+    def _record_verification(self, root):
+        """
+        Record which files of a root were hashed this run, a quick check also stores the metadata of the hashed files
+        :param root: Name of the root
+        :type root: str
+        :return: None
+        """
+        if self.quick_check:
+            Checksum.bulk_verify(self.server, root, self.quick_check.stats[root], self.started_at)
+        else:
+            Checksum.verify_all(self.server, root, self.started_at)
+
+    def _handle_changes(self, root, changes, log_additions, log_modifications):
+        """
+        Log an event for every change
+        :param root: Name of the root the changes belong to
+        :param changes: Changes that were written to the database
+        :param log_additions: Whether or not additions should be logged
+        :param log_modifications: Whether or not modifications should be logged
+        :type root: str
+        :type changes: pipeline.Changes
+        :type log_additions: bool
+        :type log_modifications: bool
+        :return: None
+        """
+        if log_additions:
+            ids = Checksum.get_ids(self.server, root, [path for path, checksum in changes.added])
+
+            for path, checksum in changes.added:
+                self._handle_file_added(path, ids[path])
+
+        if log_modifications:
+            for checksum_id, path, checksum in changes.modified:
+                self._handle_file_modified(path, checksum_id)
+
+        for checksum_id, path in changes.removed:
+            self._handle_file_removed(path, checksum_id)
+
+    def compare_with_baseline(self, baseline, output):
+        """
+        Compare the server to a golden baseline instead of its own previous state
+        Deviations are reported every run for as long as they exist, they are not stored as events
+        :param baseline: Golden baseline to compare to
+        :param output: Server output
+        :type baseline: golden.GoldenBaseline
+        :type output: list
+        :return: None
+        """
+        self.events = baseline.compare(self.config.server_name, output)
+
+        if any(self.events):
+            self.on_events_detected.fire(self.events)
 
-    def _get_events_as_anonymous_obj_list(self):
+    def _get_event_records(self):
         """
-        Convert the events dict to a list of anonymous objects
-        :return: List of anonymous objects
-        :rtype: dict[object]
+        Convert the events to a list of immutable records
+        :return: List of event records
+        :rtype: list[tuple]
         """
-        return [e.to_anonymous_object() for e in self.events]
+        return [e.to_record() for e in self.events]
 
-    def _handle_file_added(self, checksum_record):
+    def _handle_file_added(self, path, checksum_id):
         """
         An unknown new file was detected, log the event
-        :param checksum_record: Checksum record which the event will be related to
-        :type checksum_record: models.Checksum
+        :param path: Path to the file
+        :param checksum_id: ID of the checksum record which the event will be related to
+        :type path: str
+        :type checksum_id: int
         :return: None
         """
-        if not self.server_is_new:
-            description = "A new file was detected at '{path}'".format(path=checksum_record.path)
-            event = Event.create(event=Event.FILE_ADDED, description=description, checksum=checksum_record)
-            self.events.append(event)
+        event = Event.create(event=Event.FILE_ADDED, path=path, server=self.server, checksum_id=checksum_id)
+        self.events.append(event)
 
-    def _handle_file_modified(self, checksum_record, checksum):
+    def _handle_file_modified(self, path, checksum_id):
         """
         A known file was modified, log the event
-        :param checksum_record: Checksum record which the event will be related to
-        :param checksum: The new checksum that was detected
-        :type checksum_record: models.Checksum
-        :type checksum: str
+        :param path: Path to the file
+        :param checksum_id: ID of the checksum record which the event will be related to
+        :type path: str
+        :type checksum_id: int
         :return: None
         """
-        description = "File modification was detected at '{path}'".format(path=checksum_record.path)
-        event = Event.create(event=Event.FILE_MODIFIED, description=description, checksum=checksum_record)
+        event = Event.create(event=Event.FILE_MODIFIED, path=path, server=self.server, checksum_id=checksum_id)
         self.events.append(event)
 
-    def _handle_file_removed(self, checksum_record):
+    def _handle_file_removed(self, path, checksum_id):
         """
-        A known file was modified, log the event
-        :param checksum_record: Checksum record which the event will be related to
-        :type checksum_record: models.Checksum
+        A known file was removed, log the event
+        :param path: Path to the file
+        :param checksum_id: ID of the checksum record which the event will be related to
+        :type path: str
+        :type checksum_id: int
         :return: None
         """
-        description = "File removal was detected at '{path}'".format(path=checksum_record.path)
-        event = Event.create(event=Event.FILE_REMOVED, description=description, checksum=checksum_record)
+        event = Event.create(event=Event.FILE_REMOVED, path=path, server=self.server, checksum_id=checksum_id)
         self.events.append(event)
 
     def print_statistics(self):
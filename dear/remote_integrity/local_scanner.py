@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import glob
+import hashlib
+import mmap
+import os
+import stat
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from dear.remote_integrity.commands import PARTIAL_HASH_CHUNK_SIZE, PHP_CONFIG_PATTERNS, merge_roots, split_output_lines
+from dear.remote_integrity.config import ScanRoot
+from dear.remote_integrity.exceptions import ServerException
+from dear.remote_integrity.hashing import format_checksum, PARTIAL
+
+
+class LocalScanner:
+    """
+    Scans the file system of the host the tool runs on, without SSH and without running find or a hash command
+    Directories are walked with os.scandir and ignored directories are skipped during the walk. Files are hashed with
+    hashlib on a thread pool, which releases the GIL while hashing, large files are memory-mapped instead of read.
+    Implements the acquire methods of server.Server, so it can be used by the scanner, quick checks and snapshots.
+    """
+
+    # Files of at least this size are memory-mapped
+    MMAP_THRESHOLD = 1024 * 1024
+
+    # Amount of files hashed by a single task of the thread pool
+    BATCH_SIZE = 64
+
+    def __init__(self, config, workers=None):
+        """
+        Local scanner constructor
+        :param config: Configuration to use
+        :param workers: Amount of hashing threads, defaults to a few per CPU since hashing also waits for the disk
+        :type config: config.Config
+        :type workers: int
+        """
+        self.config = config
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self.bytes_received = 0
+
+    def connect(self):
+        """
+        Nothing to connect to, only present to match server.Server
+        :return: None
+        """
+
+    def acquire_checksum_list(self):
+        """
+        Acquire a list of checksums of all files of all roots that are due
+        :return: List of (path, checksum) tuples
+        :rtype: list
+        """
+        pairs = []
+
+        for raw in self.acquire_checksum_output().values():
+            for line in split_output_lines(raw.decode("utf-8")):
+                checksum, path = line.split("  ", 1)
+                pairs.append((path, checksum))
+
+        return pairs
+
+    def acquire_checksum_output(self):
+        """
+        Acquire the raw checksum list output of all roots that are due, in the format of the remote hash commands
+        :return: Dict of raw outputs keyed by root name
+        :rtype: dict
+        """
+        return {root.name: self._hash_root(root) for root in self.config.get_scan_roots(due_only=True)}
+
+    def acquire_metadata_output(self):
+        """
+        Acquire the raw metadata listing of all roots that are due, in the format of server.Server.METADATA_FORMAT
+        :return: Dict of raw outputs keyed by root name
+        :rtype: dict
+        """
+        return {root.name: "".join(format_metadata(path, st) for path, st in self._walk(root)).encode("utf-8")
+                for root in self.config.get_scan_roots(due_only=True)}
+
+    def acquire_checksums(self, root, paths, partial_paths=()):
+        """
+        Acquire the raw checksum list output of the given files only
+        :param root: Root the files belong to, which determines the hash algorithm
+        :param paths: Absolute paths of the files to hash in full
+        :param partial_paths: Absolute paths of the large files to hash partially
+        :type root: config.ScanRoot
+        :type paths: list[str]
+        :type partial_paths: list[str]
+        :return: Raw checksum list output
+        :rtype: bytes
+        """
+        files = [(path, False) for path in paths] + [(path, True) for path in partial_paths]
+        return self._hash_files(root, files, full=False)
+
+    def _hash_root(self, root):
+        """
+        Hash all files of a root, large files are hashed partially according to the policy of the root
+        :param root: Root to hash
+        :type root: config.ScanRoot
+        :return: Raw checksum list output
+        :rtype: bytes
+        """
+        threshold = root.partial_hash_threshold
+        files = [(path, bool(threshold) and st.st_size >= threshold) for path, st in self._walk(root)]
+        return self._hash_files(root, files, full=root.name in self.config.full_hash_roots)
+
+    def _hash_files(self, root, files, full):
+        """
+        Hash files on the thread pool
+        :param root: Root the files belong to
+        :param files: List of (path, partial) tuples
+        :param full: Also hash partially hashed files in full
+        :type root: config.ScanRoot
+        :type files: list[tuple]
+        :type full: bool
+        :return: Raw checksum list output
+        :rtype: bytes
+        """
+        batches = [files[i:i + self.BATCH_SIZE] for i in range(0, len(files), self.BATCH_SIZE)]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return b"".join(executor.map(lambda batch: self._hash_batch(root, batch, full), batches))
+
+    def _hash_batch(self, root, files, full):
+        """
+        Hash a batch of files, files that were removed since they were listed are skipped
+        :param root: Root the files belong to
+        :param files: List of (path, partial) tuples
+        :param full: Also hash partially hashed files in full
+        :type root: config.ScanRoot
+        :type files: list[tuple]
+        :type full: bool
+        :return: Raw checksum list output of the batch
+        :rtype: bytes
+        """
+        lines = []
+
+        for path, partial in files:
+            try:
+                checksum = partial_checksum(path, root, full) if partial else file_checksum(path, root.hash_algorithm)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                raise ServerException("Unable to calculate checksums, reason: {}".format(e))
+
+            lines.append("{}  {}\n".format(checksum, path))
+
+        return "".join(lines).encode("utf-8")
+
+    def _walk(self, root):
+        """
+        Walk all directories of a root, overlapping directories are only walked once
+        Directories that only contain ignored paths are not entered, symbolic links are not followed
+        Paths that aren't valid UTF-8 can't be listed in a checksum list, they are skipped with a warning
+        :param root: Root to walk
+        :type root: config.ScanRoot
+        :return: Generator of (path, stat) tuples of all files that aren't blacklisted
+        :rtype: collections.Generator
+        """
+        directories = [resolve_directory(directory) for directory in root.directories]
+
+        if root.name == ScanRoot.DEFAULT and self.config.scan_php_modules:
+            directories += get_php_extension_dirs()
+
+        matcher = root.ignore_matcher
+        stack = merge_roots(directories)
+
+        while stack:
+            directory = stack.pop()
+
+            try:
+                with os.scandir(directory) as iterator:
+                    entries = list(iterator)
+
+            except OSError as e:
+                raise ServerException("Unable to retrieve checksum list, reason: {}".format(e))
+
+            for entry in entries:
+                if not is_valid_path(entry.path):
+                    print("[!] Warning: Skipping '{}', its path isn't valid UTF-8".format(os.fsencode(entry.path).decode("utf-8", "replace")))
+                    continue
+
+                if entry.is_dir(follow_symlinks=False):
+                    if not matcher.matches_directory(entry.path):
+                        stack.append(entry.path)
+
+                elif entry.is_file(follow_symlinks=False):
+                    if not matcher.matches(entry.path):
+                        yield entry.path, entry.stat(follow_symlinks=False)
+
+
+def resolve_directory(directory):
+    """
+    Get the absolute path of a configured directory, relative directories are relative to the home directory like they are over SSH
+    :param directory: Directory as it is written in the configuration
+    :type directory: str
+    :rtype: str
+    """
+    return os.path.normpath(os.path.join(os.path.expanduser("~"), os.path.expanduser(directory)))
+
+
+def is_valid_path(path):
+    """
+    Check if a path can be encoded as UTF-8, file names that aren't are decoded by os.scandir with surrogate escapes
+    :param path: Path as returned by os.scandir
+    :type path: str
+    :rtype: bool
+    """
+    try:
+        path.encode("utf-8")
+    except UnicodeEncodeError:
+        return False
+
+    return True
+
+
+def get_php_extension_dirs():
+    """
+    Get the extension directories of all installed PHP versions
+    :return: List of extension directories
+    :rtype: list[str]
+    """
+    extension_dirs = []
+
+    for php_config in sorted(path for pattern in PHP_CONFIG_PATTERNS for path in glob.glob(pattern)):
+        try:
+            extension_dir = subprocess.check_output([php_config, "--extension-dir"], stderr=subprocess.DEVNULL).decode("utf-8").strip()
+        except (OSError, subprocess.CalledProcessError):
+            print("[!] Unable to locate the php extension directory of '{}', skipping..".format(php_config))
+            continue
+
+        if extension_dir not in extension_dirs:
+            extension_dirs.append(extension_dir)
+
+    return extension_dirs
+
+
+def format_metadata(path, st):
+    """
+    Format the metadata of a file like find does with server.Server.METADATA_FORMAT
+    :param path: Absolute path of the file
+    :param st: Result of stat on the file
+    :type path: str
+    :type st: os.stat_result
+    :rtype: str
+    """
+    return "{} {} {} {:o} {}\n".format(
+        st.st_size, format_timestamp(st.st_mtime_ns), format_timestamp(st.st_ctime_ns), stat.S_IMODE(st.st_mode), path)
+
+
+def format_timestamp(nanoseconds):
+    """
+    Format a timestamp like find does for %T@ and %C@
+    :param nanoseconds: Timestamp in nanoseconds since the epoch
+    :type nanoseconds: int
+    :rtype: str
+    """
+    return "{}.{:09d}0".format(nanoseconds // 10 ** 9, nanoseconds % 10 ** 9)
+
+
+def file_checksum(path, algorithm):
+    """
+    Hash a whole file, large files are memory-mapped
+    :param path: Absolute path of the file
+    :param algorithm: Name of the hashlib algorithm
+    :type path: str
+    :type algorithm: str
+    :return: Hex encoded checksum
+    :rtype: str
+    """
+    checksum = hashlib.new(algorithm)
+
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size < LocalScanner.MMAP_THRESHOLD:
+            checksum.update(file.read())
+        else:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                checksum.update(data)
+
+    return checksum.hexdigest()
+
+
+def partial_checksum(path, root, full):
+    """
+    Hash a file partially, exactly like server.Server.PARTIAL_HASH_SCRIPT does
+    The size, the first and last chunk and evenly spaced chunks in between are hashed
+    :param path: Absolute path of the file
+    :param root: Root the file belongs to, which determines the hash algorithm and amount of chunks
+    :param full: Also hash the file in full
+    :type path: str
+    :type root: config.ScanRoot
+    :type full: bool
+    :return: Formatted partial checksum
+    :rtype: str
+    """
+    checksum = hashlib.new(root.hash_algorithm)
+    chunk_size = PARTIAL_HASH_CHUNK_SIZE
+
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        # An empty file has no chunks, every read is empty like the reads of dd
+        chunks = max(1, (size + chunk_size - 1) // chunk_size)
+        checksum.update("{}\n".format(size).encode("utf-8"))
+
+        for i in range(root.partial_hash_chunks + 2):
+            file.seek(i * (chunks - 1) // (root.partial_hash_chunks + 1) * chunk_size)
+            checksum.update(file.read(chunk_size))
+
+    return format_checksum(PARTIAL, checksum.hexdigest(), file_checksum(path, root.hash_algorithm) if full else None)
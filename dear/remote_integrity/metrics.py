@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import os
+import re
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Lock, Thread
+
+from dear.remote_integrity.exceptions import MetricsException
+
+
+class Metrics:
+    """
+    Collects scan metrics and renders them in the Prometheus/OpenMetrics text format
+    Metrics can either be written to a node_exporter textfile or served over HTTP on /metrics
+    """
+
+    NAMESPACE = "remote_integrity"
+
+    DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+    COUNTERS = {
+        "events_total": "Number of integrity events detected, by event type",
+        "files_hashed_total": "Number of files hashed on the remote server",
+        "bytes_transferred_total": "Number of bytes received from the remote server",
+        "ssh_errors_total": "Number of failed connections or remote commands",
+        "runs_total": "Number of scan runs, by status",
+    }
+
+    HISTOGRAMS = {
+        "phase_duration_seconds": "Duration of each scan phase in seconds",
+    }
+
+    SAMPLE_REGEX = re.compile(r'^(?P<name>[a-z_]+)(?:\{(?P<labels>.*)\})? (?P<value>\S+)$')
+    LABEL_REGEX = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+    def __init__(self):
+        """
+        Metrics constructor
+        """
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, amount=1, **labels):
+        """
+        Increment a counter
+        :param name: Name of the counter (without namespace)
+        :param amount: Amount to increment the counter with
+        :param labels: Labels of the sample (eg. server, type)
+        :type name: str
+        :type amount: int|float
+        :return: None
+        """
+        key = (name, self._label_key(labels))
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """
+        Add an observation to a histogram
+        :param name: Name of the histogram (without namespace)
+        :param value: Observed value
+        :param labels: Labels of the sample (eg. server, phase)
+        :type name: str
+        :type value: float
+        :return: None
+        """
+        key = (name, self._label_key(labels))
+
+        with self.lock:
+            buckets, total, count = self.histograms.get(key, ([0] * len(self.DURATION_BUCKETS), 0.0, 0))
+            buckets = [amount + (1 if value <= bound else 0) for amount, bound in zip(buckets, self.DURATION_BUCKETS)]
+            self.histograms[key] = (buckets, total + value, count + 1)
+
+    @contextmanager
+    def time_phase(self, server, phase):
+        """
+        Measure the duration of a scan phase
+        :param server: Name of the server the phase runs for
+        :param phase: Name of the phase (eg. connect, acquire, identify, commit)
+        :type server: str
+        :type phase: str
+        :return: Context manager
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe("phase_duration_seconds", time.monotonic() - start, server=server, phase=phase)
+
+    def get_phase_durations(self, server):
+        """
+        Get the total duration of every phase that was measured for a server
+        :param server: Name of the server
+        :type server: str
+        :return: Dict of seconds keyed by phase
+        :rtype: dict
+        """
+        with self.lock:
+            samples = [(dict(labels), total) for (name, labels), (buckets, total, count) in self.histograms.items() if name == "phase_duration_seconds"]
+
+        return {labels["phase"]: total for labels, total in samples if labels.get("server") == server}
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format
+        :return: Rendered metrics
+        :rtype: str
+        """
+        lines = []
+
+        with self.lock:
+            for name, description in sorted(self.COUNTERS.items()):
+                lines += self._render_header(name, description, "counter")
+                lines += self._render_counter(name)
+
+            for name, description in sorted(self.HISTOGRAMS.items()):
+                lines += self._render_header(name, description, "histogram")
+                lines += self._render_histogram(name)
+
+        return "\n".join(lines) + "\n"
+
+    def _render_header(self, name, description, metric_type):
+        """
+        Render the HELP and TYPE lines of a metric
+        :return: List of lines
+        :rtype: list
+        """
+        return [
+            "# HELP {}_{} {}".format(self.NAMESPACE, name, description),
+            "# TYPE {}_{} {}".format(self.NAMESPACE, name, metric_type),
+        ]
+
+    def _render_counter(self, name):
+        """
+        Render all samples of a counter
+        :return: List of lines
+        :rtype: list
+        """
+        return [self._render_sample(name, labels, value) for (key, labels), value in sorted(self.counters.items()) if key == name]
+
+    def _render_histogram(self, name):
+        """
+        Render all samples of a histogram (cumulative buckets, sum and count)
+        :return: List of lines
+        :rtype: list
+        """
+        lines = []
+
+        for (key, labels), (buckets, total, count) in sorted(self.histograms.items()):
+            if key != name:
+                continue
+
+            for bound, amount in zip(self.DURATION_BUCKETS, buckets):
+                lines.append(self._render_sample(name + "_bucket", labels + (("le", repr(bound)),), amount))
+
+            lines.append(self._render_sample(name + "_bucket", labels + (("le", "+Inf"),), count))
+            lines.append(self._render_sample(name + "_sum", labels, total))
+            lines.append(self._render_sample(name + "_count", labels, count))
+
+        return lines
+
+    def _render_sample(self, name, labels, value):
+        """
+        Render a single sample line
+        :return: Rendered sample
+        :rtype: str
+        """
+        label_text = ",".join('{}="{}"'.format(key, self._escape(val)) for key, val in labels)
+        return "{}_{}{} {}".format(self.NAMESPACE, name, "{" + label_text + "}" if label_text else "", value)
+
+    def write_textfile(self, path):
+        """
+        Atomically write the metrics to a textfile (for the node_exporter textfile collector)
+        :param path: Path to the .prom file
+        :type path: str
+        :return: None
+        """
+        temp_path = path + ".tmp"
+
+        try:
+            with open(temp_path, "w") as file:
+                file.write(self.render())
+            os.replace(temp_path, path)
+        except OSError as e:
+            raise MetricsException("Unable to write metrics to '{}', reason: {}".format(path, e))
+
+    def load_textfile(self, path):
+        """
+        Load previously written counters and histograms from a textfile
+        This keeps counters monotonic when the tool is run periodically (eg. from cron)
+        :param path: Path to the .prom file
+        :type path: str
+        :return: None
+        """
+        if not os.path.exists(path):
+            return
+
+        with open(path) as file:
+            for line in file:
+                self._load_sample(line.strip())
+
+    def _load_sample(self, line):
+        """
+        Load a single sample line that was rendered by this class
+        :param line: Rendered sample line
+        :type line: str
+        :return: None
+        """
+        match = self.SAMPLE_REGEX.match(line)
+        prefix = self.NAMESPACE + "_"
+
+        if line.startswith("#") or not match or not match.group("name").startswith(prefix):
+            return
+
+        name = match.group("name")[len(prefix):]
+        labels = tuple((key, self._unescape(value)) for key, value in self.LABEL_REGEX.findall(match.group("labels") or ""))
+        value = float(match.group("value"))
+        value = int(value) if value.is_integer() else value
+
+        if name in self.COUNTERS:
+            self.counters[(name, labels)] = value
+
+        for histogram in self.HISTOGRAMS:
+            self._load_histogram_sample(histogram, name, labels, value)
+
+    def _load_histogram_sample(self, histogram, name, labels, value):
+        """
+        Load a single histogram sample (bucket, sum or count) into the histogram state
+        :return: None
+        """
+        if not name.startswith(histogram + "_"):
+            return
+
+        suffix = name[len(histogram) + 1:]
+        bound = dict(labels).get("le")
+        labels = tuple(label for label in labels if label[0] != "le")
+        buckets, total, count = self.histograms.get((histogram, labels), ([0] * len(self.DURATION_BUCKETS), 0.0, 0))
+
+        if suffix == "bucket" and bound != "+Inf" and float(bound) in self.DURATION_BUCKETS:
+            buckets[self.DURATION_BUCKETS.index(float(bound))] = int(value)
+        elif suffix == "sum":
+            total = value
+        elif suffix == "count":
+            count = int(value)
+
+        self.histograms[(histogram, labels)] = (buckets, total, count)
+
+    def serve(self, address, port):
+        """
+        Serve the metrics on http://address:port/metrics in a background thread
+        :param address: Address to listen on
+        :param port: Port to listen on
+        :type address: str
+        :type port: int
+        :return: HTTP server instance
+        :rtype: HTTPServer
+        """
+        metrics = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    return self.send_error(404)
+
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            server = HTTPServer((address, port), MetricsRequestHandler)
+        except OSError as e:
+            raise MetricsException("Unable to listen on {}:{} for metrics, reason: {}".format(address, port, e))
+
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    @staticmethod
+    def _label_key(labels):
+        """
+        Convert a dict of labels into a hashable, sorted key
+        :return: Tuple of (key, value) pairs
+        :rtype: tuple
+        """
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    @staticmethod
+    def _escape(value):
+        """
+        Escape a label value
+        :rtype: str
+        """
+        return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    @staticmethod
+    def _unescape(value):
+        """
+        Unescape a label value
+        :rtype: str
+        """
+        return re.sub(r'\\(.)', lambda m: "\n" if m.group(1) == "n" else m.group(1), value)
@@ -1,20 +1,35 @@
 #!/usr/bin/env python
 # Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
 import os
+from collections import namedtuple
 from datetime import datetime
+from urllib.parse import quote
 
 from sqlalchemy import Column
 from sqlalchemy import DateTime
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
 from sqlalchemy import Integer
+from sqlalchemy import LargeBinary
 from sqlalchemy import String
+from sqlalchemy import bindparam
 from sqlalchemy import create_engine
+from sqlalchemy import func
+from sqlalchemy import inspect
+from sqlalchemy import literal
+from sqlalchemy import null
 from sqlalchemy.orm import relationship
+from sqlalchemy.schema import CreateTable
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.event import listens_for
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.hybrid import hybrid_property
 
+from dear.remote_integrity.hashing import format_checksum, parse_checksum, FULL
 
-DATABASE_PATH = os.path.join(os.getcwd(), 'integrity.db')
+
+DATABASE_PATH = os.environ.get('REMOTE_INTEGRITY_DATABASE') or os.path.join(os.getcwd(), 'integrity.db')
+DATABASE_READ_ONLY = False
 
 engine = create_engine('sqlite:///' + DATABASE_PATH)
 
@@ -22,17 +37,31 @@ Base = declarative_base()
 Session = sessionmaker(bind=engine)
 session = Session()
 
+# Maximum amount of bound parameters per statement of batched queries, well below the SQLite limit
+BATCH_SIZE = 500
+
 
 class Model(object):
 
-    def to_anonymous_object(self):
+    def to_record(self):
         """
-        Convert the current model properties to an anonymous object
-        This is to prevent the data from not being able to be accesses outside of the main thread it was created in
-        :return: Object containing all keys and values that the current model does
-        :rtype: object
+        Convert the current model properties to an immutable record
+        This is to prevent the data from not being able to be accessed outside of the main thread it was created in
+        :return: Named tuple containing all keys and values that the current model does
+        :rtype: tuple
         """
-        return type('', (object,), self.to_dict())()
+        return self.get_record_type()(*self.values())
+
+    @classmethod
+    def get_record_type(cls):
+        """
+        Get the named tuple type of the records of the model, it is only created once per model
+        :rtype: type
+        """
+        if "_record_type" not in cls.__dict__:
+            cls._record_type = namedtuple(cls.__name__ + "Record", cls.keys())
+
+        return cls._record_type
 
     def to_dict(self):
         """
@@ -40,7 +69,7 @@ class Model(object):
         :return: Dict containing all keys and values that the current model does
         :rtype: dict
         """
-        return dict(((key, getattr(self, key)) for key in self.__mapper__.columns.keys()))
+        return dict(((key, getattr(self, key)) for key in self.keys()))
 
     def values(self):
         """
@@ -54,10 +83,12 @@ class Model(object):
     def keys(cls):
         """
         Get all keys in the current row as a list
+        The keys are in the order of the columns of the table, columns mapped to a private attribute (eg. _description)
+        are exposed through their public property
         :return: List containing all keys that the current model does
         :rtype: list
         """
-        return cls.__mapper__.columns.keys()
+        return [cls.__mapper__.get_property_by_column(column).key.lstrip("_") for column in cls.__table__.columns]
 
     def delete(self):
         """
@@ -127,29 +158,287 @@ class Server(Model, Base):
         session.add(server)
         return server
 
-    def get_related_checksum(self, path, checksum):
+
+class Digest(Model, Base):
+    __tablename__ = "digests"
+    id = Column(Integer, primary_key=True)
+    digest = Column(LargeBinary(64), nullable=False, unique=True)
+
+    cache = {}
+
+    @classmethod
+    def intern(cls, checksum):
         """
-        Get a related checksum by certain criteria
-        :param checksum: Checksum of the file
-        :param path: Path to the file
+        Get the digest record of a checksum, the record is created if it doesn't exist yet
+        Records are cached, so every unique digest is only looked up once per process
+        :param checksum: Hex encoded checksum
         :type checksum: str
-        :type path: str
-        :return: Returns a checksum if one is found, otherwise None
+        :return: Digest record
+        :rtype: models.Digest
+        """
+        record = cls.cache.get(checksum)
+
+        if record is None:
+            with session.no_autoflush:
+                record = session.query(cls).filter(cls.digest == bytes.fromhex(checksum)).one_or_none()
+
+        if record is None:
+            record = cls(digest=bytes.fromhex(checksum))
+            session.add(record)
+
+        cls.cache[checksum] = record
+        return record
+
+    @classmethod
+    def get_ids(cls, checksums):
+        """
+        Get the IDs of the digest records of many checksums at once, records that don't exist yet are inserted
+        :param checksums: Hex encoded checksums
+        :type checksums: collections.Iterable
+        :return: Dict of digest IDs keyed by checksum
+        :rtype: dict
+        """
+        digests = {bytes.fromhex(checksum): checksum for checksum in checksums}
+        ids = cls._select_ids(digests)
+        missing = [{"digest": digest} for digest, checksum in digests.items() if checksum not in ids]
+
+        if any(missing):
+            session.execute(cls.__table__.insert(), missing)
+            ids.update(cls._select_ids(digests))
+
+        return ids
+
+    @classmethod
+    def _select_ids(cls, digests):
+        """
+        Look up the IDs of existing digest records, in batches
+        :param digests: Dict of hex encoded checksums keyed by binary digest
+        :type digests: dict
+        :return: Dict of digest IDs keyed by checksum
+        :rtype: dict
+        """
+        keys = list(digests)
+        ids = {}
+
+        for start in range(0, len(keys), BATCH_SIZE):
+            for digest_id, digest in session.query(cls.id, cls.digest).filter(cls.digest.in_(keys[start:start + BATCH_SIZE])):
+                ids[digests[digest]] = digest_id
+
+        return ids
+
+    @classmethod
+    def delete_orphans(cls, ids=None):
+        """
+        Delete the digest records no longer referenced by any checksum
+        :param ids: Only consider these digest IDs, all digests are considered when omitted
+        :type ids: collections.Iterable
+        :return: Amount of deleted digests
+        :rtype: int
+        """
+        referenced = session.query(Checksum.digest_id).filter(Checksum.digest_id.isnot(None))
+
+        if ids is None:
+            cls.cache.clear()
+            return session.query(cls).filter(~cls.id.in_(referenced)).delete(synchronize_session=False)
+
+        ids = list(set(ids) - {None})
+        deleted = 0
+
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start:start + BATCH_SIZE]
+            query = session.query(cls).filter(cls.id.in_(batch), ~cls.id.in_(referenced.filter(Checksum.digest_id.in_(batch))))
+            deleted += query.delete(synchronize_session=False)
+
+        if deleted:
+            cls.cache = {checksum: record for checksum, record in cls.cache.items() if record.id not in ids}
+
+        return deleted
+
+
+class Directory(Model, Base):
+    """
+    Directory of the checksums, every directory is stored once and refers to its parent directory
+    The path of the directory is stored as well, so paths can be looked up without walking the tree.
+    Paths are stored without trailing slash, the root directory has an empty path.
+    """
+
+    __tablename__ = "directories"
+    id = Column(Integer, primary_key=True)
+    path = Column(String, nullable=False, unique=True)
+    parent_id = Column(Integer, ForeignKey("directories.id"), index=True, nullable=True)
+
+    cache = {}
+
+    @classmethod
+    def get_ids(cls, paths):
+        """
+        Get the IDs of many directories at once, directories that don't exist yet are inserted along with their parents
+        IDs are cached, so every directory is only looked up once per process
+        :param paths: Paths of the directories
+        :type paths: collections.Iterable
+        :return: Dict of directory IDs keyed by path
+        :rtype: dict
+        """
+        paths = set(paths)
+        unknown = set()
+
+        for path in paths:
+            while path is not None and path not in cls.cache and path not in unknown:
+                unknown.add(path)
+                path = get_parent_directory(path)
+
+        cls._select_ids(unknown)
+
+        for depth, level in cls._group_by_depth(path for path in unknown if path not in cls.cache):
+            rows = [{"path": path, "parent_id": cls.cache.get(get_parent_directory(path))} for path in level]
+            session.execute(cls.__table__.insert(), rows)
+            cls._select_ids(level)
+
+        return {path: cls.cache[path] for path in paths}
+
+    @classmethod
+    def _select_ids(cls, paths):
+        """
+        Look up the IDs of existing directories and cache them, in batches
+        :param paths: Paths of the directories
+        :type paths: collections.Iterable
+        :return: None
+        """
+        paths = list(paths)
+
+        for start in range(0, len(paths), BATCH_SIZE):
+            cls.cache.update(session.query(cls.path, cls.id).filter(cls.path.in_(paths[start:start + BATCH_SIZE])))
+
+    @staticmethod
+    def _group_by_depth(paths):
+        """
+        Group directories by depth, parents come before their children
+        :param paths: Paths of the directories
+        :type paths: collections.Iterable
+        :return: Sorted list of (depth, paths) tuples
+        :rtype: list
         """
-        for row in self.checksums:
-            if row.path == path and row.checksum == checksum:
-                return row
+        levels = {}
+
+        for path in paths:
+            levels.setdefault(path.count("/"), []).append(path)
+
+        return sorted(levels.items())
+
+
+@listens_for(Session, "after_rollback")
+def _clear_digest_cache(session):
+    """
+    Digests and directories that were interned during a rolled back transaction no longer exist
+    :return: None
+    """
+    Digest.cache.clear()
+    Directory.cache.clear()
 
 
 class Checksum(Model, Base):
     __tablename__ = "checksums"
+    __table_args__ = (Index("ix_checksums_server_id_root_directory_id_name", "server_id", "root", "directory_id", "name"),)
+
     id = Column(Integer, primary_key=True)
-    path = Column(String, nullable=False)
-    checksum = Column(String(128), nullable=False)
+    root = Column(String, nullable=False, default="default")
+    _checksum = Column("checksum", String(128), nullable=False, default="")
+
+    # Large files are hashed partially, their full checksum is only known after a periodic full hash
+    hash_mode = Column(String, nullable=False, default="full")
+    full_checksum = Column(String(128), nullable=True)
+
+    # Size, modification time, change time and permissions of the file when it was last hashed by a quick check
+    stat = Column(String, nullable=True)
+    verified_at = Column(DateTime, nullable=True)
 
     server = relationship(Server, backref="checksums")
     server_id = Column(Integer, ForeignKey("servers.id"), index=True, nullable=False)
 
+    # Paths are stored as the directory of the file and its name
+    directory = relationship(Directory, lazy="joined")
+    directory_id = Column(Integer, ForeignKey("directories.id"), index=True, nullable=False)
+    name = Column(String, nullable=False)
+
+    digest = relationship(Digest, lazy="joined")
+    digest_id = Column(Integer, ForeignKey("digests.id"), index=True, nullable=True)
+
+    # If set, checksums are stored as a reference to a unique binary digest instead of a hex string per row
+    normalized = False
+
+    @hybrid_property
+    def path(self):
+        """
+        Get the absolute path of the file
+        :rtype: str
+        """
+        return join_path(self.directory.path, self.name)
+
+    @path.setter
+    def path(self, path):
+        """
+        Set the absolute path of the file, its directory is created if it doesn't exist yet
+        :param path: Absolute path
+        :type path: str
+        :return: None
+        """
+        directory, self.name = split_path(path)
+        self.directory_id = Directory.get_ids([directory])[directory]
+
+    @path.expression
+    def path(cls):
+        """
+        Get the SQL expression of the absolute path of the file
+        Requires a join on the directories
+        :return: SQL expression
+        """
+        return Directory.path + "/" + cls.name
+
+    @classmethod
+    def keys(cls):
+        """
+        Get all keys in the current row as a list, the path is exposed instead of the directory and name it is stored as
+        The path takes the place of the column it was stored in before paths were split, right after the ID
+        :rtype: list
+        """
+        keys = [key for key in super().keys() if key not in ("directory_id", "name")]
+        keys.insert(keys.index("id") + 1, "path")
+        return keys
+
+    @property
+    def checksum(self):
+        """
+        Get the hex encoded checksum of the file, regardless of the storage mode
+        :rtype: str
+        """
+        return self.digest.digest.hex() if self.digest is not None else self._checksum
+
+    @checksum.setter
+    def checksum(self, checksum):
+        """
+        Set the checksum of the file, according to the storage mode
+        :param checksum: Hex encoded checksum
+        :type checksum: str
+        :return: None
+        """
+        if self.normalized and self._is_hex(checksum):
+            self.digest = Digest.intern(checksum)
+            self._checksum = ""
+        else:
+            self.digest = None
+            self._checksum = checksum
+
+    @staticmethod
+    def _is_hex(checksum):
+        """
+        Check if a checksum can be stored as a binary digest
+        :rtype: bool
+        """
+        try:
+            return len(bytes.fromhex(checksum)) <= 64
+        except ValueError:
+            return False
+
     @classmethod
     def create(cls, path, checksum, server):
         """
@@ -166,37 +455,762 @@ class Checksum(Model, Base):
         session.add(record)
         return record
 
+    @classmethod
+    def normalize(cls, server):
+        """
+        Convert all checksums of a server that are stored as a hex string to digest references
+        :param server: Server of which the checksums should be converted
+        :type server: models.Server
+        :return: Amount of converted checksums
+        :rtype: int
+        """
+        records = session.query(cls).filter(cls.server == server, cls.digest_id.is_(None), cls._checksum != "").all()
+
+        for record in records:
+            record.checksum = record._checksum
+
+        return len(records)
+
+    @classmethod
+    def get_index(cls, server, root):
+        """
+        Get the ID, path and hex encoded checksum of all checksums of a root, without loading them as records
+        :param server: Server to get the checksums of
+        :param root: Name of the root
+        :type server: models.Server
+        :type root: str
+        :return: Generator of (id, path, checksum) tuples, the checksums are formatted according to their hash mode
+        :rtype: collections.Iterable
+        """
+        session.flush()
+        columns = [cls.id, Directory.path, cls.name, cls.get_checksum_expression(), cls.hash_mode, cls.full_checksum]
+        query = session.query(*columns).join(Directory).outerjoin(Digest)
+        query = query.filter(cls.server_id == server.id, cls.root == root).yield_per(10000)
+
+        return (
+            (checksum_id, join_path(directory, name), format_checksum(mode, checksum, full))
+            for checksum_id, directory, name, checksum, mode, full in query
+        )
+
+    @classmethod
+    def get_legacy_index(cls, server, root):
+        """
+        Get the same tuples as get_index() from a database that wasn't upgraded yet, in which checksums store their full path
+        Only reads the columns the checksums table has, so databases of every earlier version can be read without altering them
+        :param server: Server to get the checksums of
+        :param root: Name of the root
+        :type server: models.Server
+        :type root: str
+        :return: Generator of (id, path, checksum) tuples, the checksums are formatted according to their hash mode
+        :rtype: collections.Iterable
+        """
+        columns = get_column_names(cls.__tablename__)
+        checksum = "c.checksum"
+        joins = ""
+
+        if "digest_id" in columns and table_exists(Digest.__tablename__):
+            checksum = "COALESCE(NULLIF(LOWER(HEX(d.digest)), ''), c.checksum)"
+            joins = " LEFT OUTER JOIN {} d ON d.id = c.digest_id".format(Digest.__tablename__)
+
+        query = "SELECT c.id, c.path, {}, {}, {} FROM {} c{} WHERE c.server_id = :server_id AND {}".format(
+            checksum,
+            "c.hash_mode" if "hash_mode" in columns else "'{}'".format(FULL),
+            "c.full_checksum" if "full_checksum" in columns else "NULL",
+            cls.__tablename__,
+            joins,
+            "c.root = :root" if "root" in columns else ":root = '{}'".format(cls.__table__.c.root.default.arg))
+
+        return (
+            (checksum_id, path, format_checksum(mode, checksum, full))
+            for checksum_id, path, checksum, mode, full in session.execute(query, {"server_id": server.id, "root": root})
+        )
+
+    @classmethod
+    def get_stat_index(cls, server, root):
+        """
+        Get the hex encoded checksum, the stored metadata and the last verification of all checksums of a root
+        :param server: Server to get the checksums of
+        :param root: Name of the root
+        :type server: models.Server
+        :type root: str
+        :return: Dict of (checksum, stat, verified_at) tuples keyed by path
+        :rtype: dict
+        """
+        session.flush()
+        columns = [Directory.path, cls.name, cls.get_checksum_expression(), cls.hash_mode, cls.full_checksum, cls.stat, cls.verified_at]
+        query = session.query(*columns).join(Directory).outerjoin(Digest).filter(cls.server_id == server.id, cls.root == root)
+
+        return {
+            join_path(directory, name): (format_checksum(hash_mode, checksum, full), stat, verified_at)
+            for directory, name, checksum, hash_mode, full, stat, verified_at in query
+        }
+
+    @classmethod
+    def get_ids(cls, server, root, paths):
+        """
+        Get the IDs of the checksums of a root by path, in batches
+        :param server: Server the checksums belong to
+        :param root: Name of the root
+        :param paths: Paths to get the IDs of
+        :type server: models.Server
+        :type root: str
+        :type paths: list
+        :return: Dict of checksum IDs keyed by path
+        :rtype: dict
+        """
+        paths = set(paths)
+        directory_ids = Directory.get_ids(split_path(path)[0] for path in paths)
+        directories = {directory_id: directory for directory, directory_id in directory_ids.items()}
+        keys = list(directories)
+        ids = {}
+
+        for start in range(0, len(keys), BATCH_SIZE):
+            query = session.query(cls.directory_id, cls.name, cls.id).filter(cls.server_id == server.id, cls.root == root)
+
+            for directory_id, name, checksum_id in query.filter(cls.directory_id.in_(keys[start:start + BATCH_SIZE])):
+                path = join_path(directories[directory_id], name)
+
+                if path in paths:
+                    ids[path] = checksum_id
+
+        return ids
+
+    @classmethod
+    def bulk_create(cls, server, root, output):
+        """
+        Insert many checksums at once, without creating records for them
+        :param server: Server the checksums belong to
+        :param root: Name of the root the files belong to
+        :param output: List of (path, checksum) tuples
+        :type server: models.Server
+        :type root: str
+        :type output: list
+        :return: None
+        """
+        values = cls._get_column_values([checksum for path, checksum in output])
+        paths = [split_path(path) for path, checksum in output]
+        directory_ids = Directory.get_ids(directory for directory, name in paths)
+
+        rows = [
+            dict(directory_id=directory_ids[directory], name=name, root=root, server_id=server.id, **values[checksum])
+            for (directory, name), (path, checksum) in zip(paths, output)
+        ]
+
+        if any(rows):
+            session.execute(cls.__table__.insert(), rows)
+
+    @classmethod
+    def bulk_update(cls, changes):
+        """
+        Update the checksums of many records at once
+        :param changes: List of (id, path, checksum) tuples
+        :type changes: list
+        :return: None
+        """
+        values = cls._get_column_values([checksum for checksum_id, path, checksum in changes])
+        rows = [dict(checksum_id=checksum_id, **values[checksum]) for checksum_id, path, checksum in changes]
+        statement = cls.__table__.update().where(cls.__table__.c.id == bindparam("checksum_id"))
+        digest_ids = cls._get_digest_ids([checksum_id for checksum_id, path, checksum in changes])
+
+        if any(rows):
+            session.execute(statement, rows)
+            Digest.delete_orphans(digest_ids)
+
+    @classmethod
+    def bulk_verify(cls, server, root, stats, verified_at):
+        """
+        Record that many files of a root were hashed, along with their current metadata
+        :param server: Server the checksums belong to
+        :param root: Name of the root
+        :param stats: Metadata of the hashed files keyed by path
+        :param verified_at: Time at which the files were hashed
+        :type server: models.Server
+        :type root: str
+        :type stats: dict
+        :type verified_at: datetime
+        :return: None
+        """
+        table = cls.__table__
+        paths = {path: split_path(path) for path in stats}
+        directory_ids = Directory.get_ids(directory for directory, name in paths.values())
+        rows = [
+            dict(file_directory_id=directory_ids[paths[path][0]], file_name=paths[path][1], file_stat=stat)
+            for path, stat in stats.items()
+        ]
+
+        statement = table.update().where(table.c.server_id == server.id).where(table.c.root == root)
+        statement = statement.where(table.c.directory_id == bindparam("file_directory_id")).where(table.c.name == bindparam("file_name"))
+
+        if any(rows):
+            session.execute(statement.values(stat=bindparam("file_stat"), verified_at=verified_at), rows)
+
+    @classmethod
+    def verify_all(cls, server, root, verified_at):
+        """
+        Record that all files of a root were hashed
+        :param server: Server the checksums belong to
+        :param root: Name of the root
+        :param verified_at: Time at which the files were hashed
+        :type server: models.Server
+        :type root: str
+        :type verified_at: datetime
+        :return: None
+        """
+        query = session.query(cls).filter(cls.server_id == server.id, cls.root == root)
+        query.update({cls.verified_at: verified_at}, synchronize_session=False)
+
+    @classmethod
+    def get_coverage(cls, server_name=None):
+        """
+        Get the verification coverage of every server
+        :param server_name: Only return the coverage of this server
+        :type server_name: str
+        :return: List of (server name, files, verified files, oldest verification) tuples
+        :rtype: list[tuple]
+        """
+        query = session.query(Server.name, func.count(cls.id), func.count(cls.verified_at), func.min(cls.verified_at))
+        query = query.join(Server)
+
+        if server_name:
+            query = query.filter(Server.name == server_name)
+
+        return query.group_by(Server.name).order_by(Server.name).all()
+
+    @classmethod
+    def bulk_delete(cls, ids):
+        """
+        Delete many records at once, in batches
+        :param ids: IDs of the records to delete
+        :type ids: list[int]
+        :return: None
+        """
+        digest_ids = cls._get_digest_ids(ids)
+
+        for start in range(0, len(ids), BATCH_SIZE):
+            session.query(cls).filter(cls.id.in_(ids[start:start + BATCH_SIZE])).delete(synchronize_session=False)
+
+        Digest.delete_orphans(digest_ids)
+
+    @classmethod
+    def _get_digest_ids(cls, ids):
+        """
+        Get the digests referenced by many records at once, in batches
+        :param ids: IDs of the records
+        :type ids: list[int]
+        :return: Set of digest IDs
+        :rtype: set
+        """
+        digest_ids = set()
+
+        for start in range(0, len(ids), BATCH_SIZE):
+            query = session.query(cls.digest_id).filter(cls.id.in_(ids[start:start + BATCH_SIZE]), cls.digest_id.isnot(None))
+            digest_ids.update(digest_id for digest_id, in query)
+
+        return digest_ids
+
+    @classmethod
+    def _get_column_values(cls, checksums):
+        """
+        Get the column values every checksum is stored as, according to the storage mode
+        :param checksums: Checksums, formatted according to their hash mode
+        :type checksums: list
+        :return: Dict of column values keyed by checksum
+        :rtype: dict
+        """
+        parsed = {token: parse_checksum(token) for token in set(checksums)}
+        digests = Digest.get_ids(c for mode, c, full in parsed.values() if cls._is_hex(c)) if cls.normalized else {}
+        values = {}
+
+        for token, (hash_mode, checksum, full_checksum) in parsed.items():
+            values[token] = {"hash_mode": hash_mode, "full_checksum": full_checksum, "digest_id": digests.get(checksum)}
+            values[token]["checksum"] = "" if checksum in digests else checksum
+
+        return values
+
+    @classmethod
+    def get_checksum_expression(cls):
+        """
+        Get the SQL expression of the hex encoded checksum, regardless of the storage mode
+        Requires an outer join on the digests
+        :return: SQL expression
+        """
+        return func.coalesce(func.nullif(func.lower(func.hex(Digest.digest)), ""), cls._checksum)
+
+    @classmethod
+    def drift(cls, path=None):
+        """
+        Group the servers tracking a path by the checksum they have for it
+        Without a path, all paths that have more than one distinct checksum across servers are returned
+        :param path: Absolute path of the file
+        :type path: str
+        :return: List of (path, checksum, amount of servers, comma separated server names) tuples
+        :rtype: list[tuple]
+        """
+        checksum = cls.get_checksum_expression()
+        query = session.query(cls.path, checksum, func.count(Server.id), func.group_concat(Server.name, ", "))
+        query = query.join(Server).join(Directory).outerjoin(Digest)
+
+        if path:
+            directory, name = split_path(path)
+            query = query.filter(Directory.path == directory, cls.name == name)
+        else:
+            drifting = session.query(cls.path).join(Directory).outerjoin(Digest).group_by(cls.path).having(func.count(checksum.distinct()) > 1)
+            query = query.filter(cls.path.in_(drifting.subquery()))
+
+        return query.group_by(cls.path, checksum).order_by(cls.path, func.count(Server.id).desc()).all()
+
+
+class ScanRun(Model, Base):
+    SUCCESS = "success"
+    FAILED = "failed"
+
+    FULL = "full"
+    QUICK = "quick"
+
+    __tablename__ = "scan_runs"
+    __table_args__ = (Index("ix_scan_runs_server_id_started_at", "server_id", "started_at"),)
+
+    id = Column(Integer, primary_key=True)
+    status = Column(String, nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=False)
+    files_seen = Column(Integer, nullable=False, default=0)
+    bytes_transferred = Column(Integer, nullable=False, default=0)
+    files_added = Column(Integer, nullable=False, default=0)
+    files_removed = Column(Integer, nullable=False, default=0)
+    files_modified = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    mode = Column(String, nullable=False, default="full")
+    files_hashed = Column(Integer, nullable=False, default=0)
+
+    server = relationship(Server, backref="scan_runs")
+    server_id = Column(Integer, ForeignKey("servers.id"), nullable=False)
+
+    @classmethod
+    def create(cls, server, status, started_at, **summary):
+        """
+        Create a new scan run record and return it
+        :param server: Server that was scanned
+        :param status: Status of the run (constant)
+        :param started_at: Time at which the run was started
+        :param summary: Summary columns of the run (eg. files_seen, files_added, error)
+        :type server: models.Server
+        :type status: str
+        :type started_at: datetime
+        :return: Returns the record that was just added
+        :rtype: models.ScanRun
+        """
+        record = cls(server=server, status=status, started_at=started_at, finished_at=datetime.now(), **summary)
+        session.add(record)
+        return record
+
+    @classmethod
+    def latest(cls, server_name=None, limit=None):
+        """
+        Get the latest scan runs, newest first
+        :param server_name: Only return runs of this server
+        :param limit: Maximum amount of runs to return
+        :type server_name: str
+        :type limit: int
+        :return: List of scan runs
+        :rtype: list[models.ScanRun]
+        """
+        query = session.query(cls).order_by(cls.started_at.desc())
+
+        if server_name:
+            query = query.join(Server).filter(Server.name == server_name)
+
+        return query.limit(limit).all()
+
+    @property
+    def duration(self):
+        """
+        Get the duration of the run in seconds
+        :rtype: float
+        """
+        return (self.finished_at - self.started_at).total_seconds()
+
+
+class Root(Model, Base):
+    __tablename__ = "roots"
+    __table_args__ = (Index("ix_roots_server_id_name", "server_id", "name", unique=True),)
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    hash_algorithm = Column(String, nullable=False)
+    partial_hash_threshold = Column(Integer, nullable=True)
+    scanned_at = Column(DateTime, nullable=False)
+    full_hashed_at = Column(DateTime, nullable=True)
+    quick_checks = Column(Integer, nullable=False, default=0)
+
+    server = relationship(Server, backref="roots")
+    server_id = Column(Integer, ForeignKey("servers.id"), nullable=False)
+
+    @classmethod
+    def get(cls, server, name):
+        """
+        Get a root of a server by name
+        :param server: Server the root belongs to
+        :param name: Name of the root
+        :type server: models.Server
+        :type name: str
+        :return: Root if found, else None
+        :rtype: models.Root
+        """
+        return session.query(cls).filter(cls.server == server, cls.name == name).one_or_none()
+
+    @classmethod
+    def get_settings(cls, server, name):
+        """
+        Get the settings a root was last scanned with, only reading the columns the roots table has
+        Databases that weren't upgraded yet can be read without altering them, settings they don't store are None
+        :param server: Server the root belongs to
+        :param name: Name of the root
+        :type server: models.Server
+        :type name: str
+        :return: Tuple of the hash algorithm and partial hash threshold, None if the root was never scanned
+        :rtype: tuple
+        """
+        if not table_exists(cls.__tablename__):
+            return None
+
+        columns = get_column_names(cls.__tablename__)
+        threshold = cls.partial_hash_threshold if "partial_hash_threshold" in columns else literal(None)
+        query = session.query(cls.hash_algorithm, threshold.label("partial_hash_threshold"))
+        return query.filter(cls.server_id == server.id, cls.name == name).first()
+
+    @classmethod
+    def get_full_hashed_at(cls, server_name):
+        """
+        Get the last time the large files of every root of a server were hashed in full
+        :param server_name: Name of the server
+        :type server_name: str
+        :return: Dict of times keyed by root name, None if the large files of a root were never hashed in full
+        :rtype: dict
+        """
+        return dict(session.query(cls.name, cls.full_hashed_at).join(Server).filter(Server.name == server_name))
+
+    @classmethod
+    def get_scanned_at(cls, server_name):
+        """
+        Get the last time every root of a server was scanned successfully
+        :param server_name: Name of the server
+        :type server_name: str
+        :return: Dict of scan times keyed by root name
+        :rtype: dict
+        """
+        return dict(session.query(cls.name, cls.scanned_at).join(Server).filter(Server.name == server_name))
+
+    @classmethod
+    def touch(cls, server, name, hash_algorithm, scanned_at, full_hashed=False, partial_hash_threshold=None, quick_checked=False):
+        """
+        Record a scan of a root, the root is created if it doesn't exist yet
+        :param server: Server the root belongs to
+        :param name: Name of the root
+        :param hash_algorithm: Hash algorithm the checksums were calculated with
+        :param scanned_at: Time at which the scan was started
+        :param full_hashed: Whether or not the large files of the root were hashed in full
+        :param partial_hash_threshold: Size from which files were hashed partially, None if they were all hashed in full
+        :param quick_checked: Whether or not only a sample of the files was hashed, which moves its quick check rotation forward
+        :type server: models.Server
+        :type name: str
+        :type hash_algorithm: str
+        :type scanned_at: datetime
+        :type full_hashed: bool
+        :type partial_hash_threshold: int
+        :type quick_checked: bool
+        :return: Root record
+        :rtype: models.Root
+        """
+        record = cls.get(server, name) or cls(server=server, name=name)
+        record.hash_algorithm = hash_algorithm
+        record.partial_hash_threshold = partial_hash_threshold
+        record.scanned_at = scanned_at
+
+        if full_hashed:
+            record.full_hashed_at = scanned_at
+
+        if quick_checked:
+            record.quick_checks = (record.quick_checks or 0) + 1
+        session.add(record)
+        return record
+
+
+class Baseline(Model, Base):
+    __tablename__ = "baselines"
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False, unique=True)
+    created_at = Column(DateTime, nullable=False)
+
+    @classmethod
+    def get(cls, name):
+        """
+        Get a baseline by name
+        :param name: Name of the baseline
+        :type name: str
+        :return: Baseline if found, else None
+        :rtype: models.Baseline
+        """
+        return session.query(cls).filter(cls.name == name).one_or_none()
+
+    @classmethod
+    def register(cls, name, output):
+        """
+        Store a reference snapshot under a name, an existing snapshot with the same name is replaced
+        :param name: Name of the baseline
+        :param output: List of (path, checksum) tuples
+        :type name: str
+        :type output: list
+        :return: Baseline record
+        :rtype: models.Baseline
+        """
+        baseline = cls.get(name)
+
+        if baseline is None:
+            baseline = cls(name=name)
+            session.add(baseline)
+        else:
+            session.query(BaselineChecksum).filter(BaselineChecksum.baseline_id == baseline.id).delete(synchronize_session=False)
+
+        baseline.created_at = datetime.now()
+        session.flush()
+
+        rows = [dict(baseline_id=baseline.id, path=path, checksum=checksum) for path, checksum in output]
+        session.bulk_insert_mappings(BaselineChecksum, rows)
+        return baseline
+
+    def get_index(self):
+        """
+        Get all checksums of the baseline
+        :return: Dict of checksums keyed by path
+        :rtype: dict
+        """
+        query = session.query(BaselineChecksum.path, BaselineChecksum.checksum)
+        return dict(query.filter(BaselineChecksum.baseline_id == self.id))
+
+    def count(self):
+        """
+        Get the amount of files in the baseline
+        :rtype: int
+        """
+        return session.query(BaselineChecksum).filter(BaselineChecksum.baseline_id == self.id).count()
+
+
+class BaselineChecksum(Model, Base):
+    __tablename__ = "baseline_checksums"
+    __table_args__ = (Index("ix_baseline_checksums_baseline_id_path", "baseline_id", "path", unique=True),)
+
+    id = Column(Integer, primary_key=True)
+    path = Column(String, nullable=False)
+    checksum = Column(String(128), nullable=False)
+
+    baseline = relationship(Baseline)
+    baseline_id = Column(Integer, ForeignKey("baselines.id"), nullable=False)
+
 
 class Event(Model, Base):
     FILE_ADDED = 1
     FILE_REMOVED = 2
     FILE_MODIFIED = 3
 
+    NAMES = {
+        FILE_ADDED: "added",
+        FILE_REMOVED: "removed",
+        FILE_MODIFIED: "modified",
+    }
+
+    DESCRIPTIONS = {
+        FILE_ADDED: "A new file was detected at '{path}'",
+        FILE_REMOVED: "File removal was detected at '{path}'",
+        FILE_MODIFIED: "File modification was detected at '{path}'",
+    }
+
     __tablename__ = "events"
+    __table_args__ = {"sqlite_autoincrement": True}
     id = Column(Integer, primary_key=True)
     event = Column(Integer, nullable=False)
-    description = Column(String, nullable=False)
-    timestamp = Column(DateTime, nullable=False)
+    path = Column(String, nullable=True)
+    _description = Column("description", String, nullable=False, default="")
+    timestamp = Column(DateTime, nullable=False, index=True)
+
+    server = relationship(Server)
+    server_id = Column(Integer, ForeignKey("servers.id"), index=True, nullable=True)
 
     checksum = relationship(Checksum)
     checksum_id = Column(Integer, ForeignKey("checksums.id"), index=True, nullable=False)
 
+    scan_run = relationship(ScanRun, backref="events")
+    scan_run_id = Column(Integer, ForeignKey("scan_runs.id"), index=True, nullable=True)
+
+    @property
+    def description(self):
+        """
+        Get the human readable description of the event
+        Events are stored as structured fields, older records may still contain a stored description
+        :rtype: str
+        """
+        return self._description or self.DESCRIPTIONS[self.event].format(path=self.path)
+
     @classmethod
-    def create(cls, event, description, checksum):
+    def create(cls, event, path, server, checksum_id):
         """
         Create a new event and store it in the database
         :param event: What type of event was it (constant)
-        :param description: Description of the event
-        :param checksum: What checksum was it related to
+        :param path: Path to the file
+        :param server: Server the file belongs to
+        :param checksum_id: ID of the checksum it is related to
         :type event: int
-        :type description: str
-        :type checksum: models.Checksum
+        :type path: str
+        :type server: models.Server
+        :type checksum_id: int
         :return: Returns the instance of the event
         """
-        record = cls(event=event, description=description, checksum=checksum, timestamp=datetime.now())
+        record = cls(event=event, path=path, server=server, checksum_id=checksum_id, timestamp=datetime.now())
         session.add(record)
         return record
 
+    @classmethod
+    def backfill(cls):
+        """
+        Fill the structured fields (server and path) of events that were stored with a description only
+        :return: None
+        """
+        checksums = session.query(Checksum.server_id).filter(Checksum.id == cls.checksum_id).as_scalar()
+        session.query(cls).filter(cls.server_id.is_(None)).update({cls.server_id: checksums}, synchronize_session=False)
+
+        for record in session.query(cls).filter(cls.path.is_(None)).yield_per(1000):
+            record.path = record._description.partition("'")[2].rpartition("'")[0]
+
+    @classmethod
+    def get_paths(cls, server, since):
+        """
+        Get the paths of the events of a server since a point in time
+        :param server: Server to get the events of
+        :param since: Only get the events that were detected after this time
+        :type server: models.Server
+        :type since: datetime
+        :return: List of paths
+        :rtype: list[str]
+        """
+        query = session.query(cls.path).filter(cls.server_id == server.id, cls.timestamp >= since, cls.path.isnot(None))
+        return [path for path, in query]
+
+    @classmethod
+    def feed(cls, after=0, limit=1000, server_name=None):
+        """
+        Get the events that were stored after a cursor, oldest first
+        :param after: ID of the last event that was already read
+        :param limit: Maximum amount of events
+        :param server_name: Only get the events of this server
+        :type after: int
+        :type limit: int
+        :type server_name: str
+        :return: List of events
+        :rtype: list[Event]
+        """
+        query = cls.query().filter(cls.id > after)
+
+        if server_name:
+            query = query.join(Server).filter(Server.name == server_name)
+
+        return query.order_by(cls.id).limit(limit).all()
+
+    def to_archive_dict(self):
+        """
+        Convert the event to a JSON serializable dict for archiving
+        :return: Dict containing the structured fields of the event
+        :rtype: dict
+        """
+        return {
+            "id": self.id,
+            "server": self.server.name if self.server else None,
+            "event": self.NAMES[self.event],
+            "path": self.path,
+            "description": self.description,
+            "timestamp": self.timestamp.isoformat(),
+            "checksum_id": self.checksum_id,
+            "scan_run_id": self.scan_run_id,
+        }
+
+
+def use_database(path, read_only=False):
+    """
+    Bind the engine and session to another database file
+    :param path: Path to the SQLite database file
+    :param read_only: Open the database read-only, every write fails and a missing database isn't created
+    :type path: str
+    :type read_only: bool
+    :return: None
+    """
+    global DATABASE_PATH, DATABASE_READ_ONLY, engine
+
+    DATABASE_PATH = os.path.abspath(os.path.expanduser(path))
+    DATABASE_READ_ONLY = read_only
+    engine = create_engine('sqlite:///file:{}?mode=ro&uri=true'.format(quote(DATABASE_PATH)) if read_only else 'sqlite:///' + DATABASE_PATH)
+
+    session.close()
+    session.bind = engine
+    Digest.cache.clear()
+    Directory.cache.clear()
+    Session.configure(bind=engine)
+
+
+def get_database_path():
+    """
+    Get the path of the database file currently in use
+    :return: Absolute path to the database file
+    :rtype: str
+    """
+    return DATABASE_PATH
+
+
+def database_is_upgraded():
+    """
+    Check if the schema of the database is current, older databases still store the full path of every checksum
+    :return: True if upgrade_database() doesn't have to convert the checksums
+    :rtype: bool
+    """
+    return "path" not in get_column_names(Checksum.__tablename__)
+
+
+def table_exists(name):
+    """
+    Check if a table exists in the database
+    :param name: Name of the table
+    :type name: str
+    :rtype: bool
+    """
+    return name in inspect(engine).get_table_names()
+
+
+def get_column_names(name):
+    """
+    Get the names of the columns of a table as it exists in the database
+    :param name: Name of the table
+    :type name: str
+    :rtype: set[str]
+    """
+    return set(column["name"] for column in inspect(engine).get_columns(name))
+
+
+def get_table_definition(name):
+    """
+    Get the CREATE TABLE statement of a table as it exists in the database
+    :param name: Name of the table
+    :type name: str
+    :rtype: str
+    """
+    return session.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name", {"name": name}).scalar() or ""
+
+
+def database_is_read_only():
+    """
+    Check if the database in use was opened read-only, files stored next to it shouldn't be written either
+    :return: True if the database is read-only
+    :rtype: bool
+    """
+    return DATABASE_READ_ONLY
+
 
 def create_database():
     """"
@@ -206,6 +1220,184 @@ def create_database():
     Base.metadata.create_all(engine)
 
 
+def prepare_database():
+    """
+    Create the database, or upgrade it if it already exists
+    :return: None
+    """
+    if database_exists():
+        upgrade_database()
+    else:
+        create_database()
+
+
+def upgrade_database():
+    """
+    Upgrade an existing database to the current schema
+    Missing tables are created, missing columns (which must be nullable or have a default) and their indexes are added
+    :return: None
+    """
+    Base.metadata.create_all(engine)
+
+    if not database_is_upgraded():
+        _split_checksum_paths(inspect(engine))
+
+    if "AUTOINCREMENT" not in get_table_definition(Event.__tablename__).upper():
+        _rebuild_events_table(inspect(engine))
+
+    inspector = inspect(engine)
+
+    for table in Base.metadata.sorted_tables:
+        columns = set(column["name"] for column in inspector.get_columns(table.name))
+        indexes = set(index["name"] for index in inspector.get_indexes(table.name))
+
+        for column in table.columns:
+            if column.name not in columns:
+                _add_column(table, column)
+
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(engine)
+
+
+def _split_checksum_paths(inspector):
+    """
+    Rebuild the checksums table of a database in which checksums still store their full path
+    Paths are split into a directory and a name, the IDs of the checksums are kept so events keep referring to them.
+    Columns the old table doesn't have are filled with their defaults. The table is rebuilt in a single transaction,
+    so a failing upgrade leaves the old table untouched and is retried on the next run.
+    The indexes are created afterwards by upgrade_database() and the file is vacuumed to release the space of the old table.
+    :param inspector: Inspector of the database
+    :type inspector: sqlalchemy.engine.reflection.Inspector
+    :return: None
+    """
+    columns = set(column["name"] for column in inspector.get_columns(Checksum.__tablename__))
+    table = Checksum.__table__
+    copied = [column.name for column in table.columns if column.name in columns]
+    defaults = {column.name: column.default.arg for column in table.columns
+                if column.name not in columns and column.default is not None and column.default.is_scalar}
+
+    print("[+] Moving the paths of all checksums to the directories table, this may take a while")
+
+    session.commit()
+
+    # Keep the references of other tables to the checksums table when it is renamed
+    session.execute("PRAGMA legacy_alter_table = ON")
+
+    try:
+        # The sqlite3 module doesn't start a transaction for DDL statements by itself
+        session.execute("BEGIN")
+
+        for index in inspector.get_indexes(table.name):
+            session.execute("DROP INDEX {}".format(index["name"]))
+
+        session.execute("ALTER TABLE {0} RENAME TO {0}_old".format(table.name))
+        session.execute(CreateTable(table))
+        rows = session.execute("SELECT path, {} FROM {}_old".format(", ".join(copied), table.name))
+        names = copied + list(defaults) + ["directory_id", "name"]
+        insert = "INSERT INTO {} ({}) VALUES ({})".format(table.name, ", ".join(names), ", ".join(":" + name for name in names))
+
+        for batch in iter(lambda: rows.fetchmany(10000), []):
+            paths = [split_path(row[0]) for row in batch]
+            directory_ids = Directory.get_ids(directory for directory, name in paths)
+            values = [dict(zip(copied, row[1:]), directory_id=directory_ids[directory], name=name, **defaults)
+                      for (directory, name), row in zip(paths, batch)]
+            session.execute(insert, values)
+
+        session.execute("DROP TABLE {}_old".format(table.name))
+        session.commit()
+
+    except Exception:
+        session.rollback()
+        raise
+
+    finally:
+        session.execute("PRAGMA legacy_alter_table = OFF")
+
+    vacuum_database()
+
+
+def _rebuild_events_table(inspector):
+    """
+    Rebuild the events table of a database in which event IDs can be reused
+    Without AUTOINCREMENT, SQLite hands out the ID of the newest event again once it was pruned, which the cursors of
+    change feeds can't detect. The IDs of the events are kept and events that were stored with a description only get
+    their server and path, so the feed can filter and export them. The table is rebuilt in a single transaction.
+    :param inspector: Inspector of the database
+    :type inspector: sqlalchemy.engine.reflection.Inspector
+    :return: None
+    """
+    columns = set(column["name"] for column in inspector.get_columns(Event.__tablename__))
+    table = Event.__table__
+    copied = ", ".join(column.name for column in table.columns if column.name in columns)
+
+    session.commit()
+
+    try:
+        # The sqlite3 module doesn't start a transaction for DDL statements by itself
+        session.execute("BEGIN")
+
+        for index in inspector.get_indexes(table.name):
+            session.execute("DROP INDEX {}".format(index["name"]))
+
+        session.execute("ALTER TABLE {0} RENAME TO {0}_old".format(table.name))
+        session.execute(CreateTable(table))
+        session.execute("INSERT INTO {0} ({1}) SELECT {1} FROM {0}_old".format(table.name, copied))
+        session.execute("DROP TABLE {}_old".format(table.name))
+        Event.backfill()
+        session.commit()
+
+    except Exception:
+        session.rollback()
+        raise
+
+
+def _add_column(table, column):
+    """
+    Add a column to an existing table
+    :param table: Table to add the column to
+    :param column: Column to add
+    :type table: sqlalchemy.Table
+    :type column: sqlalchemy.Column
+    :return: None
+    """
+    definition = "{} {}".format(column.name, column.type.compile(engine.dialect))
+
+    if column.default is not None and column.default.is_scalar:
+        value = column.default.arg
+        default = null() if value is None else literal(value, column.type)
+
+        if value is not None and not column.nullable:
+            definition += " NOT NULL"
+
+        definition += " DEFAULT {}".format(default.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+
+    engine.execute("ALTER TABLE {} ADD COLUMN {}".format(table.name, definition))
+
+
+def vacuum_database(incremental=False):
+    """
+    Reclaim unused space of the database file
+    Switching to incremental vacuuming requires a single full vacuum, which is done automatically
+    Digests no longer referenced by any checksum are deleted first
+    :param incremental: Only release free pages instead of rebuilding the whole file
+    :type incremental: bool
+    :return: None
+    """
+    Digest.delete_orphans()
+    session.commit()
+
+    with engine.connect() as connection:
+        if not incremental:
+            return connection.execute("VACUUM")
+
+        if connection.execute("PRAGMA auto_vacuum").scalar() != 2:
+            connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            connection.execute("VACUUM")
+
+        connection.execute("PRAGMA incremental_vacuum")
+
+
 def database_exists():
     """
     Check if the database exists
@@ -213,3 +1405,39 @@ def database_exists():
     :rtype: bool
     """
     return os.path.exists(DATABASE_PATH)
+
+
+def split_path(path):
+    """
+    Split an absolute path into the path of its directory and its name
+    :param path: Absolute path
+    :type path: str
+    :return: Tuple of the directory (without trailing slash) and the name
+    :rtype: tuple
+    """
+    directory, separator, name = path.rpartition("/")
+    return directory, name
+
+
+def join_path(directory, name):
+    """
+    Join the path of a directory and a name
+    :param directory: Path of the directory, without trailing slash
+    :param name: Name of the file
+    :type directory: str
+    :type name: str
+    :return: Absolute path
+    :rtype: str
+    """
+    return directory + "/" + name
+
+
+def get_parent_directory(path):
+    """
+    Get the path of the parent of a directory
+    :param path: Path of the directory, without trailing slash
+    :type path: str
+    :return: Path of the parent, None for the root directory
+    :rtype: str
+    """
+    return path.rpartition("/")[0] if path else None
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import json
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+from email.mime.text import MIMEText
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from smtplib import SMTP, SMTPException, SMTPServerDisconnected
+from threading import Lock
+from urllib.parse import urlsplit
+
+from dear.remote_integrity.exceptions import NotificationException
+
+
+class Alert(namedtuple("Alert", ["server_name", "server_address", "server_port", "timestamp", "descriptions"])):
+    """
+    Events of a single server that were detected in a single scan
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_events(cls, config, events):
+        """
+        Create an alert from the detected events
+        :param config: Configuration of the server
+        :param events: Events that were detected
+        :type config: config.Config
+        :type events: list
+        :rtype: Alert
+        """
+        return cls(config.server_name, config.server_address, config.server_port, datetime.now(), [e.description for e in events])
+
+
+class SmtpClient:
+    """
+    SMTP connection that stays open between messages and reconnects if the server closed it
+    """
+
+    def __init__(self, host, user=None, password=None):
+        """
+        SMTP client constructor
+        :param host: SMTP host
+        :param user: User to log in with, no login without a user and password
+        :param password: Password to log in with
+        :type host: str
+        :type user: str
+        :type password: str
+        """
+        self.host = host
+        self.user = user
+        self.password = password
+        self.connection = None
+
+    def send(self, sender, recipient, message):
+        """
+        Send a message, a connection that was closed by the server is reopened once
+        :param sender: Address of the sender
+        :param recipient: Address of the recipient
+        :param message: Message to send
+        :type sender: str
+        :type recipient: str
+        :type message: email.message.Message
+        :return: None
+        """
+        try:
+            self._get_connection().sendmail(sender, [recipient], message.as_string())
+        except (SMTPServerDisconnected, ConnectionError):
+            self.close()
+            self._get_connection().sendmail(sender, [recipient], message.as_string())
+
+    def close(self):
+        """
+        Close the connection
+        :return: None
+        """
+        if self.connection is None:
+            return
+
+        try:
+            self.connection.quit()
+        except (SMTPException, OSError):
+            pass
+
+        self.connection = None
+
+    def _get_connection(self):
+        """
+        Get the open connection, or connect and log in
+        :rtype: SMTP
+        """
+        if self.connection is None:
+            connection = SMTP(host=self.host)
+
+            if self.user and self.password:
+                connection.login(user=self.user, password=self.password)
+
+            self.connection = connection
+
+        return self.connection
+
+
+class TelegramClient:
+    """
+    Minimal client of the Telegram bot API, requests share a single keep-alive HTTP connection
+    """
+
+    API_URL = "https://api.telegram.org"
+
+    # Maximum length of a single message, longer texts are split
+    MAX_MESSAGE_LENGTH = 4096
+
+    TIMEOUT = 30
+
+    def __init__(self, token, api_url=API_URL):
+        """
+        Telegram client constructor
+        :param token: API token of the bot
+        :param api_url: Base URL of the bot API
+        :type token: str
+        :type api_url: str
+        """
+        url = urlsplit(api_url)
+        self.connection_class = HTTPSConnection if url.scheme == "https" else HTTPConnection
+        self.host = url.netloc
+        self.path = "{}/bot{}/sendMessage".format(url.path.rstrip("/"), token)
+        self.connection = None
+
+    def send_message(self, chat_id, text):
+        """
+        Send a text message to a chat
+        :param chat_id: ID of the chat
+        :param text: Text to send
+        :type chat_id: int
+        :type text: str
+        :return: None
+        """
+        for part in split_text(text, self.MAX_MESSAGE_LENGTH):
+            body = json.dumps({"chat_id": chat_id, "text": part}).encode("utf-8")
+
+            try:
+                response = self._post(body)
+            except (HTTPException, ConnectionError):
+                self.close()
+                response = self._post(body)
+
+            if not response.get("ok"):
+                raise NotificationException("Telegram API error: {}".format(response.get("description")))
+
+    def close(self):
+        """
+        Close the connection
+        :return: None
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def _post(self, body):
+        """
+        Post a JSON body to the sendMessage method
+        :param body: Encoded JSON body
+        :type body: bytes
+        :return: Decoded JSON response
+        :rtype: dict
+        """
+        if self.connection is None:
+            self.connection = self.connection_class(self.host, timeout=self.TIMEOUT)
+
+        self.connection.request("POST", self.path, body, {"Content-Type": "application/json"})
+        response = self.connection.getresponse()
+
+        try:
+            return json.loads(response.read().decode("utf-8"))
+        except ValueError:
+            raise NotificationException("Invalid response of the Telegram API (HTTP {})".format(response.status))
+
+
+class Notifier:
+    """
+    Batches the alerts of all servers of a scan pass into a single digest per email recipient and Telegram chat
+    The SMTP and Telegram clients are kept between passes, so a daemon reuses its connections.
+    Alerts are queued by the event handlers (which run on their own threads) and sent by flush().
+    """
+
+    def __init__(self):
+        """
+        Notifier constructor
+        """
+        self.mail = OrderedDict()
+        self.telegram = OrderedDict()
+        self.smtp_clients = {}
+        self.telegram_clients = {}
+        self.lock = Lock()
+
+    def queue_mail(self, config, events):
+        """
+        Queue the events of a server for every email recipient of the server
+        :param config: Configuration of the server
+        :param events: Events that were detected
+        :type config: config.Config
+        :type events: list
+        :return: None
+        """
+        alert = Alert.from_events(config, events)
+        smtp = (config.email_smtp_host, config.email_smtp_user, config.email_smtp_pass)
+
+        with self.lock:
+            for recipient in config.email_recipients:
+                self.mail.setdefault((smtp, config.email_noreply_address, recipient), []).append(alert)
+
+    def queue_telegram(self, config, events):
+        """
+        Queue the events of a server for the Telegram chat of the server
+        :param config: Configuration of the server
+        :param events: Events that were detected
+        :type config: config.Config
+        :type events: list
+        :return: None
+        """
+        alert = Alert.from_events(config, events)
+
+        with self.lock:
+            self.telegram.setdefault((config.telegram_api_url, config.telegram_api_token, config.telegram_api_chat_id), []).append(alert)
+
+    def flush(self):
+        """
+        Send a digest of all queued alerts to every recipient, a failing recipient doesn't stop the others
+        :return: None
+        """
+        with self.lock:
+            mail, self.mail = self.mail, OrderedDict()
+            telegram, self.telegram = self.telegram, OrderedDict()
+
+        for (smtp, sender, recipient), alerts in mail.items():
+            try:
+                self._send_mail(smtp, sender, recipient, alerts)
+                print("[+] Email notification sent to: {}".format(recipient))
+            except (SMTPException, OSError) as e:
+                print("[!] Unable to send email notification to '{}', reason: {}".format(recipient, e))
+
+        for (api_url, token, chat_id), alerts in telegram.items():
+            try:
+                self._get_telegram_client(api_url, token).send_message(chat_id, format_digest(alerts))
+                print("[+] Telegram push notification sent to chat: {}".format(chat_id))
+            except (NotificationException, HTTPException, OSError) as e:
+                print("[!] Unable to send telegram push notification to chat '{}', reason: {}".format(chat_id, e))
+
+    def close(self):
+        """
+        Close all connections
+        :return: None
+        """
+        for client in list(self.smtp_clients.values()) + list(self.telegram_clients.values()):
+            client.close()
+
+        self.smtp_clients.clear()
+        self.telegram_clients.clear()
+
+    def _send_mail(self, smtp, sender, recipient, alerts):
+        """
+        Send a digest email to a single recipient
+        :param smtp: Tuple of the SMTP host, user and password
+        :param sender: Address of the sender
+        :param recipient: Address of the recipient
+        :param alerts: Alerts to include in the digest
+        :type smtp: tuple
+        :type sender: str
+        :type recipient: str
+        :type alerts: list[Alert]
+        :return: None
+        """
+        incidents = sum(len(alert.descriptions) for alert in alerts)
+        email_from = "DearBytes Remote Integrity Tool <{}>".format(sender)
+
+        email = MIMEText(format_digest(alerts))
+        email["Subject"] = "Suspicious activity detected ({} incident{})".format(incidents, "s" if incidents > 1 else "")
+        email["From"] = email_from
+        email["To"] = recipient
+
+        if smtp not in self.smtp_clients:
+            self.smtp_clients[smtp] = SmtpClient(*smtp)
+
+        self.smtp_clients[smtp].send(email_from, recipient, email)
+
+    def _get_telegram_client(self, api_url, token):
+        """
+        Get the client of a bot, it is created once
+        :param api_url: Base URL of the bot API
+        :param token: API token of the bot
+        :type api_url: str
+        :type token: str
+        :rtype: TelegramClient
+        """
+        if (api_url, token) not in self.telegram_clients:
+            self.telegram_clients[(api_url, token)] = TelegramClient(token, api_url)
+
+        return self.telegram_clients[(api_url, token)]
+
+
+def format_digest(alerts):
+    """
+    Format the notification text of the alerts of one or more servers
+    :param alerts: Alerts to include
+    :type alerts: list[Alert]
+    :return: Formatted text
+    :rtype: str
+    """
+    incidents = sum(len(alert.descriptions) for alert in alerts)
+
+    text  = "Dear Administrator,\n"
+    text += "\n"
+    text += "The DearBytes remote integrity tool has detected suspicious activity on your server{}.\n".format("s" if len(alerts) > 1 else "")
+    text += "For your own protection we ask you to review the following incident{}:\n".format("s" if incidents > 1 else "")
+
+    for alert in alerts:
+        text += "\n"
+        text += "\tServer: '{name}' ({ip}:{port})\n".format(name=alert.server_name, ip=alert.server_address, port=alert.server_port)
+        text += "\tTimestamp: {timestamp}\n".format(timestamp=alert.timestamp.strftime("%B %d, %Y on %H:%M:%S"))
+        text += "\tNumber of incidents: {incidents}\n".format(incidents=len(alert.descriptions))
+        text += "\n"
+        text += "\n".join("\t" + description for description in alert.descriptions) + "\n"
+
+    text += "\n"
+    text += "Kind regards,\n"
+    text += "DearBytes"
+    return text
+
+
+def split_text(text, length):
+    """
+    Split a text into parts of at most the given length, preferably at line breaks
+    :param text: Text to split
+    :param length: Maximum length of a part
+    :type text: str
+    :type length: int
+    :return: List of parts
+    :rtype: list[str]
+    """
+    parts = []
+
+    while len(text) > length:
+        end = text.rfind("\n", 0, length) + 1 or length
+        parts.append(text[:end])
+        text = text[end:]
+
+    return parts + [text]
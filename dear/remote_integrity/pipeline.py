@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from dear.remote_integrity.commands import parse_checksum_output, split_output_lines
+from dear.remote_integrity.config import ScanRoot
+from dear.remote_integrity.hashing import compare_checksums, INCOMPARABLE, MODIFIED, SAME
+
+
+class Changes(namedtuple("Changes", ["added", "modified", "rehashed", "removed", "duplicates", "files_seen"])):
+    """
+    Differences between the stored checksums of a server and its current checksum list
+    Added files are (path, checksum) tuples, modified files (id, path, checksum) tuples and removed files (id, path) tuples.
+    Rehashed files are (id, path, checksum) tuples of files that were hashed in another mode or of which a full checksum
+    became known, without the file being modified. Duplicates are the IDs of redundant records of a path that was stored more than once.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def merge(cls, results):
+        """
+        Merge the changes of all shards, sorted by path
+        :param results: Changes of every shard
+        :type results: list[Changes]
+        :return: Merged changes
+        :rtype: Changes
+        """
+        return cls(
+            added=sorted(row for result in results for row in result.added),
+            modified=sorted((row for result in results for row in result.modified), key=lambda row: row[1]),
+            rehashed=[row for result in results for row in result.rehashed],
+            removed=sorted((row for result in results for row in result.removed), key=lambda row: row[1]),
+            duplicates=[checksum_id for result in results for checksum_id in result.duplicates],
+            files_seen=sum(result.files_seen for result in results))
+
+
+class Listing:
+    """
+    Checksum list of a server split into shards by path, per root
+    Every shard is a single bytes buffer of `checksum  path` lines, so it is passed to a worker process as one cheap copy
+    """
+
+    def __init__(self, shards):
+        """
+        Listing constructor
+        :param shards: Checksum list output per shard, keyed by root name
+        :type shards: dict
+        """
+        self.shards = shards
+        self.length = sum(shard.count(b"\n") for root in shards.values() for shard in root)
+
+    @classmethod
+    def from_pairs(cls, output, shards, root=ScanRoot.DEFAULT):
+        """
+        Create a listing of a single root from a list of (path, checksum) tuples
+        :param output: List of (path, checksum) tuples
+        :param shards: Amount of shards
+        :param root: Name of the root the files belong to
+        :type output: list
+        :type shards: int
+        :type root: str
+        :return: Sharded listing
+        :rtype: Listing
+        """
+        buffers = [[] for _ in range(shards)]
+
+        for path, checksum in output:
+            buffers[get_shard(path, shards)].append("{}  {}\n".format(checksum, path))
+
+        return cls({root: ["".join(lines).encode("utf-8") for lines in buffers]})
+
+    @property
+    def roots(self):
+        """
+        Get the names of the roots that were scanned
+        :rtype: list[str]
+        """
+        return list(self.shards)
+
+    def iterate_root(self, root):
+        """
+        Iterate over the (path, checksum) tuples of a single root
+        :param root: Name of the root
+        :type root: str
+        :rtype: collections.Generator
+        """
+        for shard in self.shards[root]:
+            yield from parse_checksum_output(shard, [], [])
+
+    def __iter__(self):
+        for root in self.shards:
+            yield from self.iterate_root(root)
+
+    def __len__(self):
+        return self.length
+
+
+class Pipeline:
+    """
+    Parses and diffs checksum lists on a pool of worker processes
+    Paths are sharded by hash, so every worker diffs an independent part of the tree without sharing any state.
+    The workers only return the changes, which are written to the database by the calling process.
+    """
+
+    CHUNK_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, workers=1):
+        """
+        Pipeline constructor
+        :param workers: Amount of worker processes, with a single worker everything runs in the current process
+        :type workers: int
+        """
+        self.workers = max(1, workers or 1)
+        self.shards = self.workers
+        self.executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+
+    def parse(self, output, config):
+        """
+        Parse the raw output of the checksum list commands into a sharded listing
+        The files of every root are filtered by the ignore lists of that root
+        :param output: Dict of raw checksum list outputs keyed by root name
+        :param config: Configuration containing the roots
+        :type output: dict
+        :type config: config.Config
+        :return: Sharded listing
+        :rtype: Listing
+        """
+        roots = {root.name: root for root in config.get_scan_roots()}
+        tasks = [(name, chunk) for name, raw in output.items() for chunk in split_lines(raw, self.CHUNK_SIZE)]
+
+        results = self._map(
+            parse_chunk,
+            [chunk for name, chunk in tasks],
+            [roots[name].ignore_directories for name, chunk in tasks],
+            [roots[name].ignore_files for name, chunk in tasks],
+            repeat(self.shards))
+
+        parts = {name: [] for name in output}
+
+        for (name, chunk), result in zip(tasks, results):
+            parts[name].append(result)
+
+        return Listing({name: [b"".join(shard) for shard in zip(*parts[name])] or [b""] * self.shards for name in parts})
+
+    def diff(self, listing, root, index, policy_changed=False):
+        """
+        Determine the changes between the stored checksums of a root and a listing
+        A file whose hash mode (partial or full) changed crossed the partial hash threshold, so its size and therefore
+        its contents changed, unless the partial hash policy of the root changed since its checksum was stored
+        :param listing: Current checksum list of the server, either a listing or a list of (path, checksum) tuples
+        :param root: Name of the root to diff
+        :param index: Stored (id, path, checksum) tuples of the root
+        :param policy_changed: Whether or not the partial hash policy of the root changed, files that changed hash mode are rehashed instead of modified
+        :type listing: Listing|list
+        :type root: str
+        :type index: collections.Iterable
+        :type policy_changed: bool
+        :return: Changes of all shards
+        :rtype: Changes
+        """
+        if not isinstance(listing, Listing):
+            listing = Listing.from_pairs(listing, self.shards, root)
+
+        shards = listing.shards[root]
+
+        if len(shards) != self.shards:
+            shards = Listing.from_pairs(listing.iterate_root(root), self.shards, root).shards[root]
+
+        buffers = [[] for _ in range(self.shards)]
+
+        for checksum_id, path, checksum in index:
+            buffers[get_shard(path, self.shards)].append("{}\t{}\t{}\n".format(checksum_id, checksum, path))
+
+        stored = ["".join(lines).encode("utf-8") for lines in buffers]
+        return Changes.merge(self._map(diff_shard, shards, stored, [policy_changed] * self.shards))
+
+    def close(self):
+        """
+        Stop the worker processes
+        :return: None
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def _map(self, function, *iterables):
+        """
+        Apply a function to every item, on the worker processes if there are any
+        :return: List of results
+        :rtype: list
+        """
+        if self.executor is None:
+            return list(map(function, *iterables))
+
+        return list(self.executor.map(function, *iterables))
+
+
+def get_shard(path, shards):
+    """
+    Get the shard a path belongs to, stable across processes
+    :param path: Path to the file
+    :param shards: Amount of shards
+    :type path: str
+    :type shards: int
+    :rtype: int
+    """
+    return zlib.crc32(path.encode("utf-8")) % shards
+
+
+def split_lines(buffer, size):
+    """
+    Split a buffer into chunks of about the given size, without splitting lines
+    :param buffer: Buffer to split
+    :param size: Minimum size of a chunk
+    :type buffer: bytes
+    :type size: int
+    :return: Generator of chunks
+    :rtype: collections.Generator
+    """
+    start = 0
+
+    while start < len(buffer):
+        end = buffer.find(b"\n", start + size)
+        end = len(buffer) if end == -1 else end + 1
+        yield buffer[start:end]
+        start = end
+
+
+def parse_chunk(chunk, ignore_directories, ignore_files, shards):
+    """
+    Parse a chunk of checksum list output and distribute the lines that aren't blacklisted over the shards
+    :return: Output per shard
+    :rtype: list[bytes]
+    """
+    buffers = [[] for _ in range(shards)]
+
+    for path, checksum in parse_checksum_output(chunk, ignore_directories, ignore_files):
+        buffers[get_shard(path, shards)].append("{}  {}\n".format(checksum, path))
+
+    return ["".join(lines).encode("utf-8") for lines in buffers]
+
+
+def diff_shard(listing, stored, policy_changed=False):
+    """
+    Diff a single shard of a listing against the stored checksums of the same shard
+    :param listing: Checksum list output of the shard
+    :param stored: Tab separated id, checksum and path lines of the stored checksums of the shard
+    :param policy_changed: Whether or not files that changed hash mode are rehashed instead of modified
+    :type listing: bytes
+    :type stored: bytes
+    :type policy_changed: bool
+    :return: Changes of the shard
+    :rtype: Changes
+    """
+    current = dict(parse_checksum_output(listing, [], []))
+    files_seen = len(current)
+    modified, rehashed, removed, duplicates, known = [], [], [], [], set()
+
+    for line in split_output_lines(stored.decode("utf-8")):
+        checksum_id, checksum, path = line.split("\t", 2)
+
+        if path in known:
+            duplicates.append(int(checksum_id))
+            continue
+
+        known.add(path)
+        actual = current.pop(path, None)
+
+        if actual is None:
+            removed.append((int(checksum_id), path))
+        else:
+            result = classify_change(checksum, actual, policy_changed)
+
+            if result == MODIFIED:
+                modified.append((int(checksum_id), path, actual))
+            elif result != SAME:
+                rehashed.append((int(checksum_id), path, actual))
+
+    return Changes(list(current.items()), modified, rehashed, removed, duplicates, files_seen)
+
+
+def classify_change(stored, current, policy_changed=False):
+    """
+    Compare the stored and current checksum of a file like every diff of a scan does
+    Files of which the hash mode changed can't be compared, they are modified unless the partial hash policy changed
+    :param stored: Stored checksum
+    :param current: Current checksum
+    :param policy_changed: Whether or not files that changed hash mode are rehashed instead of modified
+    :type stored: str
+    :type current: str
+    :type policy_changed: bool
+    :return: SAME, MODIFIED, or the result of hashing.compare_checksums if only the stored checksum has to be replaced
+    :rtype: str
+    """
+    if stored == current:
+        return SAME
+
+    result = compare_checksums(stored, current)
+    return MODIFIED if result == INCOMPARABLE and not policy_changed else result
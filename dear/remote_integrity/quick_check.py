@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import os
+import time
+import zlib
+
+from dear.remote_integrity.commands import parse_checksum_output, parse_metadata_output
+from dear.remote_integrity.models import Checksum, Root
+from dear.remote_integrity.schedule import AdaptiveSchedule
+
+
+class QuickCheck:
+    """
+    Hashes a rotating, deterministic sample of the files of a server instead of all of them
+    Every file is assigned to one of `quick_check_runs` buckets by a hash of its path and every run hashes the next
+    bucket of each root, so each file is hashed at least once every `quick_check_runs` successful quick checks of its root.
+    A root only moves to its next bucket when it was checked, so roots skipped by their scan interval miss no buckets.
+    High-risk files (executables, risky extensions and recently changed metadata) rotate through fewer buckets and are
+    hashed more often.
+    New files and files whose metadata differs from the stored metadata are always hashed, the checksums of all
+    other files are taken from the database. Large files are hashed partially according to the policy of their root,
+    they are never hashed in full by a quick check.
+    With `quick_check_max_staleness` the buckets are replaced by an adaptive schedule.AdaptiveSchedule, which hashes the
+    files of directories that changed often more often and every file at least once every `quick_check_max_staleness` seconds.
+    """
+
+    # High-risk files are hashed this many times as often as other files
+    RISK_WEIGHT = 4
+
+    # Files whose metadata changed less than this amount of seconds ago are high-risk
+    RECENT_CHANGE = 7 * 24 * 3600
+
+    def __init__(self, config, server):
+        """
+        Quick check constructor
+        :param config: Configuration of the server
+        :param server: Database record of the server
+        :type config: config.Config
+        :type server: models.Server
+        """
+        self.config = config
+        self.server = server
+        self.runs = config.quick_check_runs
+        self.rotation = {}
+        self.risky_extensions = set(extension.lstrip(".").lower() for extension in config.quick_check_risky_extensions)
+        self.schedule = AdaptiveSchedule(server, config.quick_check_max_staleness) if config.quick_check_max_staleness else None
+        self.stats = {}
+        self.files_hashed = 0
+        self.files_seen = 0
+
+    def acquire_checksum_output(self, remote):
+        """
+        List the metadata of all roots that are due and hash the sampled files
+        :param remote: Connected server to acquire the output from
+        :type remote: server.Server
+        :return: Dict of raw checksum list outputs keyed by root name, as if all files were hashed
+        :rtype: dict
+        """
+        roots = {root.name: root for root in self.config.get_scan_roots()}
+        output = {name: self._acquire_root(remote, roots[name], raw) for name, raw in remote.acquire_metadata_output().items()}
+
+        if self.schedule:
+            print("[+] Adaptive quick check of server '{}', hashed {} of {} files ({} volatile directories)".format(
+                self.config.server_name, self.files_hashed, self.files_seen, len(self.schedule.get_volatile_directories())))
+        else:
+            print("[+] Quick check of server '{}' ({}), hashed {} of {} files".format(
+                self.config.server_name, ", ".join("root '{}' run {} of {}".format(name, run + 1, self.runs) for name, run in self.rotation.items()),
+                self.files_hashed, self.files_seen))
+
+        return output
+
+    def _acquire_root(self, remote, root, raw):
+        """
+        Hash the sampled files of a single root
+        All files are hashed if the root wasn't scanned before or its hash algorithm changed
+        :param remote: Connected server
+        :param root: Root to check
+        :param raw: Raw metadata listing of the root
+        :type remote: server.Server
+        :type root: config.ScanRoot
+        :type raw: bytes
+        :return: Raw checksum list output of all files of the root
+        :rtype: bytes
+        """
+        listing = dict(parse_metadata_output(raw, root.ignore_directories, root.ignore_files))
+        stored = Checksum.get_stat_index(self.server, root.name)
+        record = Root.get(self.server, root.name)
+
+        if record is None or record.hash_algorithm != root.hash_algorithm:
+            stored = {}
+
+        run = self.rotation[root.name] = (record.quick_checks or 0) % self.runs if record is not None else 0
+        selected = [path for path, stat in listing.items() if self._is_selected(path, stat, stored.get(path), run)]
+        threshold = root.partial_hash_threshold
+        large = set(path for path in selected if threshold and int(listing[path].split(" ")[0]) >= threshold)
+        small = [path for path in selected if path not in large]
+        checksums = dict(parse_checksum_output(remote.acquire_checksums(root, small, sorted(large)), [], []))
+
+        self.stats[root.name] = {path: listing[path] for path in checksums if path in listing}
+        self.files_hashed += len(checksums)
+        self.files_seen += len(listing)
+
+        lines = ("{}  {}\n".format(checksums[path] if path in checksums else stored[path][0], path) for path in listing)
+        return "".join(lines).encode("utf-8")
+
+    def _is_selected(self, path, stat, stored, run):
+        """
+        Check if a file should be hashed this run
+        :param path: Path to the file
+        :param stat: Current metadata of the file
+        :param stored: Stored (checksum, stat, verified_at) tuple of the file, None if the file is unknown
+        :param run: Position of the root of the file in its rotation
+        :type path: str
+        :type stat: str
+        :type stored: tuple
+        :type run: int
+        :rtype: bool
+        """
+        if stored is None or stored[1] != stat:
+            return True
+
+        if self.schedule:
+            return self.schedule.is_due(path, stored[2], self.RISK_WEIGHT if self._is_risky(path, stat) else 1)
+
+        bucket = zlib.crc32(path.encode("utf-8"))
+
+        if bucket % self.runs == run:
+            return True
+
+        risky_runs = max(1, self.runs // self.RISK_WEIGHT)
+        return bucket % risky_runs == run % risky_runs and self._is_risky(path, stat)
+
+    def _is_risky(self, path, stat):
+        """
+        Check if a file is high-risk: an executable, a file with a risky extension or a file that recently changed
+        :param path: Path to the file
+        :param stat: Current metadata of the file
+        :type path: str
+        :type stat: str
+        :rtype: bool
+        """
+        size, modified_at, changed_at, mode = stat.split(" ")
+
+        if int(mode, 8) & 0o111:
+            return True
+
+        if os.path.splitext(path)[1][1:].lower() in self.risky_extensions:
+            return True
+
+        return float(changed_at) > time.time() - self.RECENT_CHANGE
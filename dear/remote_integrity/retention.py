@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+from dear.remote_integrity.exceptions import RetentionException
+from dear.remote_integrity.models import session, vacuum_database, Server, Event
+
+
+class Retention:
+    """
+    Prunes the events table according to the configured retention policy
+    Events older than the TTL and events exceeding the maximum amount per server are removed,
+    optionally after archiving them to compressed JSON Lines files
+    """
+
+    VACUUM_NONE = "none"
+    VACUUM_INCREMENTAL = "incremental"
+    VACUUM_FULL = "full"
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, config):
+        """
+        Retention constructor
+        :param config: Configuration object
+        :type config: config.Config
+        """
+        self.config = config
+        self.pruned = 0
+
+    def run(self, server=None):
+        """
+        Apply the retention policy and vacuum the database if events were removed
+        :param server: Only prune the events of this server, defaults to all servers and events of unknown servers
+        :type server: models.Server
+        :return: Amount of events that were removed
+        :rtype: int
+        """
+        Event.backfill()
+        servers = [server] if server else Server.query().all() + [None]
+
+        for record in servers:
+            self._prune(record, self._get_expired_events(record))
+            self._prune(record, self._get_excess_events(record))
+
+        session.commit()
+
+        if self.pruned and self.config.retention_vacuum != self.VACUUM_NONE:
+            vacuum_database(incremental=self.config.retention_vacuum == self.VACUUM_INCREMENTAL)
+
+        print("[+] Retention: {} event{} pruned".format(self.pruned, "s" if self.pruned != 1 else ""))
+        return self.pruned
+
+    def _get_expired_events(self, server):
+        """
+        Get the query of all events of a server that are older than the TTL
+        :param server: Server to get the events of
+        :type server: models.Server
+        :return: Query, or None if no TTL is configured
+        """
+        if not self.config.retention_days:
+            return None
+
+        expires_at = datetime.now() - timedelta(days=self.config.retention_days)
+        return Event.query().filter(Event.server_id == self._get_server_id(server), Event.timestamp < expires_at)
+
+    def _get_excess_events(self, server):
+        """
+        Get the query of the oldest events of a server that exceed the maximum amount of events
+        :param server: Server to get the events of
+        :type server: models.Server
+        :return: Query, or None if no maximum is configured or it isn't exceeded
+        """
+        if not self.config.retention_max_events:
+            return None
+
+        query = Event.query().filter(Event.server_id == self._get_server_id(server))
+        newest_pruned = query.order_by(Event.id.desc()).offset(self.config.retention_max_events).first()
+
+        if newest_pruned is None:
+            return None
+
+        return query.filter(Event.id <= newest_pruned.id)
+
+    def _prune(self, server, query):
+        """
+        Archive (if configured) and delete all events matched by a query, in batches
+        :param server: Server the events belong to
+        :param query: Events to prune, may be None
+        :type server: models.Server
+        :return: None
+        """
+        if query is None:
+            return
+
+        while True:
+            batch = query.order_by(Event.id).limit(self.BATCH_SIZE).all()
+
+            if not any(batch):
+                return
+
+            if self.config.retention_archive_directory:
+                self._archive(server, batch)
+
+            Event.query().filter(Event.id.in_([e.id for e in batch])).delete(synchronize_session=False)
+            self.pruned += len(batch)
+
+            for event in batch:
+                session.expunge(event)
+
+    @staticmethod
+    def _get_server_id(server):
+        """
+        Get the ID of a server, None matches events of which the server is unknown
+        :type server: models.Server
+        :rtype: int
+        """
+        return server.id if server else None
+
+    def _archive(self, server, events):
+        """
+        Append events to the archive of the server for the current month
+        :param server: Server the events belong to
+        :param events: Events to archive
+        :type server: models.Server
+        :type events: list[models.Event]
+        :return: None
+        """
+        directory = os.path.expanduser(self.config.retention_archive_directory)
+        name = "".join(c if c.isalnum() or c in "-_." else "_" for c in (server.name if server else "unknown"))
+        path = os.path.join(directory, "{}-{}.jsonl.gz".format(name, datetime.now().strftime("%Y-%m")))
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+
+            with gzip.open(path, "at", encoding="utf-8") as file:
+                for event in events:
+                    file.write(json.dumps(event.to_archive_dict()) + "\n")
+
+        except OSError as e:
+            raise RetentionException("Unable to archive events to '{}', reason: {}".format(path, e))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import zlib
+from datetime import datetime, timedelta
+
+from dear.remote_integrity.models import database_exists, get_parent_directory, Event, Root
+
+
+class Schedule:
+    """
+    Decides which roots of a server are due, based on their scan interval and the last time they were scanned
+    Roots without an interval are scanned every run, all roots are due when comparing to a golden baseline
+    Large files of roots with a partial hash policy are hashed in full once their `partial_hash_full_interval` has passed
+    An existing database must have been prepared with models.prepare_database before any schedule is made
+    """
+
+    def __init__(self, config):
+        """
+        Schedule constructor
+        :param config: Configuration of the server
+        :type config: config.Config
+        """
+        self.config = config
+
+    def get_due_roots(self, now=None):
+        """
+        Get the names of the roots that should be scanned now
+        :param now: Time to check against, defaults to the current time
+        :type now: datetime
+        :return: List of root names
+        :rtype: list[str]
+        """
+        roots = self.config.get_scan_roots()
+
+        if self.config.server_baseline or not database_exists():
+            return [root.name for root in roots]
+
+        scanned_at = Root.get_scanned_at(self.config.server_name)
+        now = now or datetime.now()
+
+        return [root.name for root in roots if self._is_due(root, scanned_at.get(root.name), now)]
+
+    def get_full_hash_roots(self, now=None):
+        """
+        Get the names of the roots whose large files should be hashed in full now
+        Golden baselines only contain partial checksums of large files, so they are never hashed in full when comparing to one
+        :param now: Time to check against, defaults to the current time
+        :type now: datetime
+        :return: List of root names
+        :rtype: list[str]
+        """
+        roots = [root for root in self.config.get_scan_roots() if root.partial_hash_threshold and root.partial_hash_full_interval]
+
+        if self.config.server_baseline:
+            return []
+
+        if not database_exists():
+            return [root.name for root in roots]
+
+        full_hashed_at = Root.get_full_hashed_at(self.config.server_name)
+        now = now or datetime.now()
+
+        return [root.name for root in roots if self._is_full_hash_due(root, full_hashed_at.get(root.name), now)]
+
+    @staticmethod
+    def _is_full_hash_due(root, full_hashed_at, now):
+        """
+        Check if the large files of a root should be hashed in full
+        :param root: Root to check
+        :param full_hashed_at: Last time the large files were hashed in full, None if they never were
+        :param now: Time to check against
+        :type root: config.ScanRoot
+        :type full_hashed_at: datetime
+        :type now: datetime
+        :rtype: bool
+        """
+        return full_hashed_at is None or now - full_hashed_at >= timedelta(seconds=root.partial_hash_full_interval)
+
+    @staticmethod
+    def _is_due(root, scanned_at, now):
+        """
+        Check if a root is due
+        :param root: Root to check
+        :param scanned_at: Last time the root was scanned, None if it was never scanned
+        :param now: Time to check against
+        :type root: config.ScanRoot
+        :type scanned_at: datetime
+        :type now: datetime
+        :rtype: bool
+        """
+        return not root.scan_interval or scanned_at is None or now - scanned_at >= timedelta(seconds=root.scan_interval)
+
+
+class AdaptiveSchedule:
+    """
+    Decides how often a quick check hashes the files of every directory, learned from the events of the server
+    A directory is expected to change as often as the events in and below it during the last `HISTORY` seconds did,
+    and its files are hashed about as often as that. Files of directories without events are hashed every `max_staleness`
+    seconds, which also bounds the interval of every other directory, so no file stays unverified for longer.
+    """
+
+    # Amount of seconds of event history the change rates are learned from
+    HISTORY = 30 * 24 * 3600
+
+    def __init__(self, server, max_staleness, now=None):
+        """
+        Adaptive schedule constructor
+        :param server: Database record of the server
+        :param max_staleness: Maximum amount of seconds between two verifications of a file
+        :param now: Time to check against, defaults to the current time
+        :type server: models.Server
+        :type max_staleness: int
+        :type now: datetime
+        """
+        self.max_staleness = max_staleness
+        self.now = now or datetime.now()
+        self.changes = count_changes(Event.get_paths(server, self.now - timedelta(seconds=self.HISTORY)))
+        self.intervals = {}
+
+    def get_interval(self, directory):
+        """
+        Get the amount of seconds between two verifications of the files of a directory
+        :param directory: Path of the directory, without trailing slash
+        :type directory: str
+        :rtype: float
+        """
+        if directory not in self.intervals:
+            changes = self.changes.get(directory)
+            self.intervals[directory] = min(self.max_staleness, self.HISTORY / changes) if changes else self.max_staleness
+
+        return self.intervals[directory]
+
+    def is_due(self, path, verified_at, weight=1):
+        """
+        Check if a file should be hashed, which is the case once it wasn't verified for the interval of its directory
+        Files become due somewhere in the second half of their interval (by a hash of their path), so the files
+        of a directory that were verified in the same run are spread over multiple runs afterwards
+        :param path: Absolute path of the file
+        :param verified_at: Last time the file was hashed, None if it never was
+        :param weight: Hash the file this many times as often as the other files of its directory
+        :type path: str
+        :type verified_at: datetime
+        :type weight: int
+        :rtype: bool
+        """
+        if verified_at is None:
+            return True
+
+        interval = self.get_interval(get_parent_directory(path)) / weight
+        spread = zlib.crc32(path.encode("utf-8")) % 1000 / 2000
+        return (self.now - verified_at).total_seconds() >= interval * (1 - spread)
+
+    def get_volatile_directories(self):
+        """
+        Get the directories whose files are hashed more often than every `max_staleness` seconds
+        :return: List of (directory, interval) tuples, most volatile first
+        :rtype: list[tuple]
+        """
+        intervals = [(directory, self.get_interval(directory)) for directory in self.changes]
+        return sorted([(directory, interval) for directory, interval in intervals if interval < self.max_staleness], key=lambda row: row[1])
+
+
+def count_changes(paths):
+    """
+    Count the changes in and below every directory
+    :param paths: Paths of the files that changed, a path occurs once for every change
+    :type paths: collections.Iterable
+    :return: Dict of amounts keyed by directory path
+    :rtype: dict
+    """
+    changes = {}
+
+    for path in paths:
+        directory = get_parent_directory(path)
+
+        while directory is not None:
+            changes[directory] = changes.get(directory, 0) + 1
+            directory = get_parent_directory(directory)
+
+    return changes
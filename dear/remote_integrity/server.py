@@ -1,31 +1,87 @@
 #!/usr/bin/env python
 # Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import re
 import shlex
 
 from paramiko import AutoAddPolicy
 from paramiko import RSAKey
 from paramiko import SSHClient
-from paramiko.ssh_exception import NoValidConnectionsError
+from paramiko.ssh_exception import NoValidConnectionsError, SSHException
 
+from dear.remote_integrity.commands import PARTIAL_HASH_CHUNK_SIZE, PHP_CONFIG_PATTERNS, merge_roots, split_arguments, path_is_blacklisted, parse_checksum_output
+from dear.remote_integrity.config import ScanRoot
+from dear.remote_integrity.discovery import DiscoveryCache
 from dear.remote_integrity.exceptions import ServerException, DirectoryNotFoundException
+from dear.remote_integrity.local_scanner import LocalScanner
 
 
 class Server:
     """"
     Server class to connect to a remote server
     Once there is a valid connection, all hashes will be calculated on every file
+
+    The remote commands are described by generators (the *_steps methods) that yield a command and receive
+    its (stdout, stderr) output, so the same logic can be driven by a blocking or an asynchronous transport
     """
 
-    def __init__(self, config):
+    # Locations of the php-config scripts of all installed PHP versions
+    PHP_CONFIG_PATTERNS = PHP_CONFIG_PATTERNS
+
+    PHP_CONFIG_MARKER = b"php-config "
+
+    # Printed before the checksum list of every root, the name of the root is captured by ROOT_MARKER_PATTERN
+    ROOT_MARKER = "==> {} <=="
+    ROOT_MARKER_PATTERN = re.compile(b"^==> ([\\w-]+) <==\n", re.MULTILINE)
+
+    # Printed for every file of a metadata listing: size, modification time, change time, permissions and path
+    METADATA_FORMAT = "%s %T@ %C@ %m %p\\n"
+
+    # Maximum length of the paths passed to a single hash command
+    MAX_ARGUMENTS_LENGTH = 64 * 1024
+
+    # Size of the chunks hashed of large files
+    PARTIAL_HASH_CHUNK_SIZE = PARTIAL_HASH_CHUNK_SIZE
+
+    # Hashes the size, the first and last chunk and evenly spaced chunks in between of every file, optionally followed
+    # by a hash of the whole file. Arguments: chunk size, amount of chunks in between, hash command, 1 to also hash in full, files..
+    PARTIAL_HASH_SCRIPT = "\n".join([
+        'b=$1 n=$2 h=$3 f=$4',
+        'shift 4',
+        'for p do',
+        '  s=$(stat -c %s "$p")',
+        '  k=$(( (s + b - 1) / b ))',
+        '  c=$(',
+        '    (',
+        '      echo "$s"',
+        '      i=0',
+        '      while [ $i -le $((n + 1)) ]',
+        '      do',
+        '        dd if="$p" bs=$b skip=$((i * (k - 1) / (n + 1))) count=1 2>/dev/null',
+        '        i=$((i + 1))',
+        '      done',
+        '    ) | $h | cut -d" " -f1',
+        '  )',
+        '  if [ "$f" = 1 ]',
+        '  then',
+        '    c="$c:$($h < "$p" | cut -d" " -f1)"',
+        '  fi',
+        '  printf "partial:%s  %s\\n" "$c" "$p"',
+        'done',
+    ])
+
+    def __init__(self, config, client=None):
         """
         Server constructor
         :param config: Configuration to use
+        :param client: SSH client to use, defaults to a new paramiko client
         :type config: config.Config
+        :type client: paramiko.SSHClient
         """
         self.config = config
-        self.client = SSHClient()
+        self.client = client or SSHClient()
         self.client.load_system_host_keys()
         self.connection = None
+        self.bytes_received = 0
 
     def connect(self):
         """
@@ -40,7 +96,7 @@ class Server:
                 username=self.config.auth_username,
                 pkey=RSAKey.from_private_key_file(self.config.auth_private_key))
 
-        except NoValidConnectionsError as e:
+        except (NoValidConnectionsError, SSHException) as e:
             raise ServerException(str(e))
 
     def acquire_checksum_generator(self, path=None):
@@ -49,15 +105,7 @@ class Server:
         :return: List of checksums
         :rtype: collections.Generator
         """
-        for line in self._exec_checksum_list_cmd(path).splitlines():
-            try:
-                checksum, path = line.split("  ")[0:2]
-            except ValueError:
-                print("[!] Warning: Unable to parse checksum output '{}'".format(line))
-                continue
-
-            if not self._path_is_blacklisted(path):
-                yield path, checksum
+        return self._parse_checksum_list(self._run_steps(self._checksum_list_cmd_steps(path)))
 
     def acquire_checksum_list(self):
         """
@@ -65,65 +113,313 @@ class Server:
         :return: List of checksums
         :rtype: list
         """
-        output  = list(self.acquire_checksum_generator())
+        return self._run_steps(self._acquire_checksum_list_steps())
 
-        if self.config.scan_php_modules:
-            try:
-                path = self._exec_php_extension_dir()
-                output += list(self.acquire_checksum_generator(path))
-            except DirectoryNotFoundException as e:
-                print("[!] {}".format(e))
-                print(" `- Please install the 'php-dev' package or create a second configuration file with a start directory pointing to your php modules.")
+    def acquire_checksum_output(self):
+        """
+        Attempts to acquire the raw, unparsed checksum list output of all roots that are due
+        :return: Dict of raw outputs keyed by root name
+        :rtype: dict
+        """
+        return self._run_steps(self._acquire_checksum_output_steps())
+
+    def acquire_metadata_output(self):
+        """
+        Attempts to acquire the raw metadata listing of all roots that are due, without hashing any file
+        Every line contains the size, modification time, change time, permissions and path of a file
+        :return: Dict of raw outputs keyed by root name
+        :rtype: dict
+        """
+        return self._run_steps(self._acquire_checksum_output_steps(metadata=True))
+
+    def acquire_checksums(self, root, paths, partial_paths=()):
+        """
+        Attempts to acquire the raw checksum list output of the given files only
+        :param root: Root the files belong to, which determines the hash algorithm
+        :param paths: Absolute paths of the files to hash in full
+        :param partial_paths: Absolute paths of the large files to hash partially
+        :type root: config.ScanRoot
+        :type paths: list[str]
+        :type partial_paths: list[str]
+        :return: Raw checksum list output
+        :rtype: bytes
+        """
+        return self._run_steps(self._checksums_steps(root, paths, partial_paths))
+
+    def _run_steps(self, steps):
+        """
+        Drive a generator of remote commands, every command it yields is executed and its output is sent back
+        :param steps: Generator yielding commands
+        :type steps: collections.Generator
+        :return: Return value of the generator
+        """
+        try:
+            command = next(steps)
+
+            while True:
+                command = steps.send(self._exec(command))
+
+        except StopIteration as e:
+            return e.value
+
+    def _exec(self, command):
+        """
+        Execute a command on the remote server
+        :param command: Command to execute
+        :type command: str
+        :return: Tuple of raw stdout and stderr output
+        :rtype: tuple
+        """
+        stdin, stdout, stderr = self.client.exec_command(command)
+
+        stdout = stdout.read()
+        stderr = stderr.read()
+        self.bytes_received += len(stdout) + len(stderr)
+
+        return stdout, stderr
+
+    def _acquire_checksum_list_steps(self):
+        """
+        Steps to acquire a list of checksums of all files recursively, including the php modules if enabled
+        :return: List of checksums
+        :rtype: list
+        """
+        output = yield from self._acquire_checksum_output_steps()
+        roots = {root.name: root for root in self.config.get_scan_roots()}
+        pairs = []
+
+        for name, raw in output.items():
+            pairs += parse_checksum_output(raw, roots[name].ignore_directories, roots[name].ignore_files)
+
+        return pairs
+
+    def _acquire_checksum_output_steps(self, metadata=False):
+        """
+        Steps to acquire the raw checksum list output of all roots that are due, including the php modules if enabled
+        All roots are scanned by a single remote command, using the cached discovery of the server.
+        The command also fingerprints the php-config scripts, if they changed the server is discovered and scanned again.
+        :param metadata: List the metadata of the files instead of their checksums
+        :type metadata: bool
+        :return: Dict of raw outputs keyed by root name
+        :rtype: dict
+        """
+        discovery = DiscoveryCache.get(self.config.server_name)
+
+        if discovery is None or "absolute_directories" not in discovery or discovery["directories"] != self._get_scan_directories():
+            discovery = yield from self._discover_steps()
+
+        fingerprint, output = yield from self._checksum_list_script_steps(discovery, metadata)
+
+        if fingerprint != discovery["php_fingerprint"]:
+            print("[+] PHP installation changed on server '{}', locating php extension directories".format(self.config.server_name))
+            discovery = yield from self._discover_steps()
+            fingerprint, output = yield from self._checksum_list_script_steps(discovery, metadata)
 
         return output
 
+    def _get_scan_directories(self):
+        """
+        Get the configured directories of all roots, as they are written in the configuration
+        :return: List of directories
+        :rtype: list[str]
+        """
+        return [directory for root in self.config.get_scan_roots() for directory in root.directories]
+
+    def _discover_steps(self):
+        """
+        Resolve the absolute directories of all roots and locate the php extension directories, the result is cached
+        :return: Discovery
+        :rtype: dict
+        """
+        absolute_directories = []
+
+        for directory in self._get_scan_directories():
+            absolute_directories.append((yield from self._absolute_start_directory_steps(directory)))
+
+        fingerprint, extension_dirs = "", []
+
+        if self.config.scan_php_modules:
+            fingerprint = yield from self._php_fingerprint_steps()
+            extension_dirs = yield from self._php_extension_dirs_steps(fingerprint)
+
+        discovery = {
+            "directories": self._get_scan_directories(),
+            "absolute_directories": absolute_directories,
+            "php_fingerprint": fingerprint,
+            "php_extension_dirs": extension_dirs,
+        }
+
+        DiscoveryCache.set(self.config.server_name, discovery)
+        return discovery
+
+    def _checksum_list_script_steps(self, discovery, metadata=False):
+        """
+        Execute a single command that fingerprints php-config and lists the checksums of all roots that are due
+        If stderr is set, the discovery is dropped from the cache and an exception will be thrown.
+        :param discovery: Discovery of the server
+        :param metadata: List the metadata of the files instead of their checksums
+        :type discovery: dict
+        :type metadata: bool
+        :return: Tuple of the php-config fingerprint and a dict of raw checksum list outputs keyed by root name
+        :rtype: tuple
+        """
+        commands = [self._php_fingerprint_command()] if self.config.scan_php_modules else []
+
+        for root in self.config.get_scan_roots(due_only=True):
+            commands.append("echo %s" % shlex.quote(self.ROOT_MARKER.format(root.name)))
+            commands.append(self._checksum_list_command(root, discovery, metadata))
+
+        stdout, stderr = yield "; ".join(commands)
+
+        if not self._exec_successful(stderr):
+            DiscoveryCache.discard(self.config.server_name)
+            raise ServerException("Unable to retrieve checksum list, reason: {}".format(stderr.decode("utf-8")))
+
+        fingerprint, stdout = self._split_php_fingerprint(stdout)
+        return fingerprint, self._split_roots(stdout)
+
+    def _checksum_list_command(self, root, discovery, metadata=False):
+        """
+        Get the command that lists the checksums of a root, overlapping directories are only scanned once
+        :param root: Root to scan
+        :param discovery: Discovery of the server
+        :param metadata: List the metadata of the files instead of their checksums
+        :type root: config.ScanRoot
+        :type discovery: dict
+        :type metadata: bool
+        :rtype: str
+        """
+        absolute_directories = dict(zip(discovery["directories"], discovery["absolute_directories"]))
+        directories = [absolute_directories[directory] for directory in root.directories]
+
+        if root.name == ScanRoot.DEFAULT:
+            directories += discovery["php_extension_dirs"]
+
+        directories = " ".join(shlex.quote(directory) for directory in merge_roots(directories))
+
+        if metadata:
+            return "find %s -type f -printf %s" % (directories, shlex.quote(self.METADATA_FORMAT))
+
+        if not root.partial_hash_threshold:
+            return 'find %s -type f -exec %s "{}" +' % (directories, root.hash_command)
+
+        return 'find %s -type f -size -%dc -exec %s "{}" +; find %s -type f -size +%dc -exec %s "{}" +' % (
+            directories, root.partial_hash_threshold, root.hash_command,
+            directories, root.partial_hash_threshold - 1, self._partial_hash_command(root, root.name in self.config.full_hash_roots))
+
+    def _partial_hash_command(self, root, full):
+        """
+        Get the command that hashes large files partially, the paths of the files must be appended
+        :param root: Root the files belong to
+        :param full: Also hash the files in full
+        :type root: config.ScanRoot
+        :type full: bool
+        :rtype: str
+        """
+        return "sh -c %s sh %d %d %s %d" % (
+            shlex.quote(self.PARTIAL_HASH_SCRIPT), self.PARTIAL_HASH_CHUNK_SIZE, root.partial_hash_chunks, root.hash_command, full)
+
+    def _checksums_steps(self, root, paths, partial_paths=()):
+        """
+        Hash the given files, the paths are split over as many commands as needed to stay below the argument limit
+        If stderr is set, an exception will be thrown.
+        :param root: Root the files belong to
+        :param paths: Absolute paths of the files to hash in full
+        :param partial_paths: Absolute paths of the large files to hash partially
+        :type root: config.ScanRoot
+        :type paths: list[str]
+        :type partial_paths: list[str]
+        :return: Raw checksum list output
+        :rtype: bytes
+        """
+        output = []
+        batches = [(root.hash_command + " --", batch) for batch in split_arguments([shlex.quote(p) for p in paths], self.MAX_ARGUMENTS_LENGTH)]
+        batches += [(self._partial_hash_command(root, False), batch) for batch in split_arguments(
+            [shlex.quote(path) for path in partial_paths], self.MAX_ARGUMENTS_LENGTH)]
+
+        for command, batch in batches:
+            stdout, stderr = yield "%s %s" % (command, " ".join(batch))
+
+            if not self._exec_successful(stderr):
+                raise ServerException("Unable to calculate checksums, reason: {}".format(stderr.decode("utf-8")))
+
+            output.append(stdout)
+
+        return b"".join(output)
+
+    def _split_roots(self, stdout):
+        """
+        Split the checksum list output of all roots by the root markers
+        :param stdout: Raw checksum list output, without the php-config fingerprint
+        :type stdout: bytes
+        :return: Dict of raw checksum list outputs keyed by root name
+        :rtype: dict
+        """
+        parts = self.ROOT_MARKER_PATTERN.split(stdout)
+        return {parts[i].decode("utf-8"): parts[i + 1] for i in range(1, len(parts), 2)}
+
+    def _split_php_fingerprint(self, stdout):
+        """
+        Split the php-config fingerprint lines, which are printed before the checksum list
+        :param stdout: Raw output of the checksum list script
+        :type stdout: bytes
+        :return: Tuple of the fingerprint and the raw checksum list output
+        :rtype: tuple
+        """
+        end = 0
+
+        while stdout.startswith(self.PHP_CONFIG_MARKER, end):
+            end = stdout.index(b"\n", end) + 1
+
+        return stdout[:end].decode("utf-8"), stdout[end:]
+
+    def _parse_checksum_list(self, output):
+        """
+        Parse the raw output of the checksum list command
+        :param output: Raw checksum list output
+        :type output: bytes
+        :return: Generator of (path, checksum) tuples of all files that aren't blacklisted
+        :rtype: collections.Generator
+        """
+        return parse_checksum_output(output, self.config.ignore_directories, self.config.ignore_files)
+
     def _path_is_blacklisted(self, path):
         """
         Check if the given path is blacklisted (directory/file based)
         :return:
         """
-        for directory in self.config.ignore_directories:
-            if directory + ("/" if not directory.endswith("/") else "") in path:
-                return True
-
-        for file_name in self.config.ignore_files:
-            if path.split("/")[-1] == file_name:
-                return True
+        return path_is_blacklisted(path, self.config.ignore_directories, self.config.ignore_files)
 
-    def _exec_pwd(self):
+    def _pwd_steps(self):
         """
         Executes the `pwd` command on the remote server to determine the current path
         :return: Returns the current working directory
         :rtype: str
         """
-        stdin, stdout, stderr = self.client.exec_command("pwd")
-        return stdout.read().decode("utf-8").strip()
+        stdout, stderr = yield "pwd"
+        return stdout.decode("utf-8").strip()
 
-    def _exec_home_dir(self):
+    def _home_dir_steps(self):
         """
         Get the home directory of the user
         :return: Current users' home directory
         :rtype: str
         """
-        stdin, stdout, stderr = self.client.exec_command("echo $HOME")
-        return stdout.read().decode("utf-8").strip()
+        stdout, stderr = yield "echo $HOME"
+        return stdout.decode("utf-8").strip()
 
-    def _exec_checksum_list_cmd(self, path=None):
+    def _checksum_list_cmd_steps(self, path=None):
         """
         Execute the checksum list command and return the raw output
         If stderr is set, an exception will be thrown.
         :return: Raw checksum list output
-        :rtype: str
+        :rtype: bytes
         """
-        path = self._get_absolute_start_directory(path)
-        command = 'find %s -type f -exec sha512sum "{}" +' % shlex.quote(path)
-        stdin, stdout, stderr = self.client.exec_command(command)
-
-        stdout = stdout.read()
-        stderr = stderr.read()
+        path = yield from self._absolute_start_directory_steps(path)
+        stdout, stderr = yield 'find %s -type f -exec sha512sum "{}" +' % shlex.quote(path)
 
         if self._exec_successful(stderr):
-            return stdout.decode("utf-8")
+            return stdout
         else:
             raise ServerException("Unable to retrieve checksum list, reason: {}".format(stderr.decode("utf-8")))
 
@@ -137,19 +433,66 @@ class Server:
         """
         return not any(stderr)
 
-    def _exec_php_extension_dir(self):
+    def _php_fingerprint_command(self):
+        """
+        Get the command that prints the path, modification time and size of every installed php-config script
+        :rtype: str
+        """
+        return "stat -L -c '%s%%n %%Y %%s' %s 2>/dev/null" % (self.PHP_CONFIG_MARKER.decode("utf-8"), " ".join(self.PHP_CONFIG_PATTERNS))
+
+    def _php_fingerprint_steps(self):
+        """
+        Fingerprint the installed php-config scripts
+        :return: Fingerprint lines
+        :rtype: str
+        """
+        stdout, stderr = yield self._php_fingerprint_command()
+        return stdout.decode("utf-8")
+
+    def _php_extension_dirs_steps(self, fingerprint):
+        """
+        Get the absolute paths to the PHP extension directories of all installed PHP versions
+        :param fingerprint: Fingerprint lines of the php-config scripts
+        :type fingerprint: str
+        :return: List of extension directories
+        :rtype: list[str]
+        """
+        extension_dirs = []
+
+        for line in fingerprint.splitlines():
+            path = line[len(self.PHP_CONFIG_MARKER):].rsplit(" ", 2)[0]
+
+            try:
+                extension_dir = yield from self._php_extension_dir_steps(path)
+            except DirectoryNotFoundException as e:
+                print("[!] {}".format(e))
+                continue
+
+            if extension_dir not in extension_dirs:
+                extension_dirs.append(extension_dir)
+
+        if not any(extension_dirs):
+            print("[!] Unable to locate the php extension directory, skipping check..")
+            print(" `- Please install the 'php-dev' package or add the php modules directory to extra_directories.")
+
+        return extension_dirs
+
+    def _php_extension_dir_steps(self, php_config="php-config"):
         """
         Get the absolute path to the PHP extension directory
-        :return:
+        :param php_config: Path to the php-config script of the PHP version
+        :type php_config: str
+        :return: Extension directory
+        :rtype: str
         """
-        stdin, stdout, stderr = self.client.exec_command("php-config --extension-dir")
+        stdout, stderr = yield "%s --extension-dir" % shlex.quote(php_config)
 
         if self._exec_successful(stderr):
-            return stdout.read().decode("utf-8").strip()
+            return stdout.decode("utf-8").strip()
         else:
-            raise DirectoryNotFoundException("Unable to locate the php extension directory, skipping check..")
+            raise DirectoryNotFoundException("Unable to locate the php extension directory of '{}', skipping..".format(php_config))
 
-    def _get_absolute_start_directory(self, path=None):
+    def _absolute_start_directory_steps(self, path=None):
         """
         Get the absolute start directory
         :return: Absolute path to the start directory
@@ -158,12 +501,26 @@ class Server:
         path = path or self.config.start_directory
 
         if path.startswith("~"):
-            path = path.replace("~", self._exec_home_dir())
+            path = path.replace("~", (yield from self._home_dir_steps()))
 
         if path.startswith("./"):
-            path = path.replace("./", self._exec_pwd())
+            path = path.replace("./", (yield from self._pwd_steps()))
 
         if not path.startswith("/"):
-            path = self._exec_pwd() + "/" + path
+            path = (yield from self._pwd_steps()) + "/" + path
 
         return path
+
+
+def create_scanner(config, factory=Server):
+    """
+    Create the scanner of a server, a local scanner if the server uses the local backend
+    :param config: Configuration of the server
+    :param factory: Callable returning a (remote) server for a config
+    :type config: config.Config
+    :return: Local scanner or server
+    """
+    if config.server_backend == "local":
+        return LocalScanner(config)
+
+    return factory(config)
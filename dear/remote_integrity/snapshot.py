@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import zlib
+from collections import namedtuple
+from datetime import datetime
+
+from dear.remote_integrity.commands import split_output_lines
+from dear.remote_integrity.exceptions import SnapshotException
+from dear.remote_integrity.hashing import MODIFIED, SAME
+from dear.remote_integrity.models import database_exists, Checksum, Server
+from dear.remote_integrity.pipeline import classify_change, Changes
+
+
+class Block(namedtuple("Block", ["first_path", "offset", "length", "count", "digest"])):
+    """
+    Location of a compressed block of entries in a snapshot file
+    The digest is a hash of the uncompressed entries, blocks with the same digest contain exactly the same entries
+    """
+
+    __slots__ = ()
+
+
+class Snapshot:
+    """
+    Compact, read-only file containing the (path, checksum, metadata) entries of all roots of a server
+    Every root is sorted by path and stored as zlib compressed blocks, followed by a compressed JSON index of all
+    blocks and a fixed size footer pointing to the index. The file is memory-mapped, so only the blocks that are
+    read are decompressed. Block boundaries depend on the paths, not on their position, so an added or removed
+    file only changes the block it belongs to and two snapshots of the same server share most of their blocks.
+    """
+
+    MAGIC = b"RISNAP1\n"
+    FOOTER = struct.Struct(">Q8s")
+    VERSION = 1
+
+    # A block ends at a path whose hash matches the boundary mask, within these limits
+    MIN_BLOCK_ENTRIES = 256
+    MAX_BLOCK_ENTRIES = 4096
+    BOUNDARY_MASK = 1023
+
+    def __init__(self, path):
+        """
+        Open a snapshot file
+        :param path: Path to the snapshot file
+        :type path: str
+        """
+        self.path = path
+
+        try:
+            with open(path, "rb") as file:
+                self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        except (OSError, ValueError) as e:
+            raise SnapshotException("Unable to open snapshot '{}', reason: {}".format(path, e))
+
+        self.index = self._read_index()
+        self.blocks = {name: [Block(*block) for block in root["blocks"]] for name, root in self.index["roots"].items()}
+        self.first_paths = {name: [block.first_path for block in blocks] for name, blocks in self.blocks.items()}
+
+    @property
+    def server_name(self):
+        """
+        Get the name of the server the snapshot was taken of
+        :rtype: str
+        """
+        return self.index["server"]
+
+    @property
+    def created_at(self):
+        """
+        Get the time the snapshot was taken
+        :rtype: datetime
+        """
+        return datetime.strptime(self.index["created_at"], "%Y-%m-%dT%H:%M:%S")
+
+    @property
+    def roots(self):
+        """
+        Get the names of the roots in the snapshot
+        :rtype: list[str]
+        """
+        return list(self.index["roots"])
+
+    def get_hash_algorithm(self, root):
+        """
+        Get the hash algorithm of the checksums of a root
+        :param root: Name of the root
+        :type root: str
+        :rtype: str
+        """
+        return self.index["roots"][root]["hash_algorithm"]
+
+    def count(self, root):
+        """
+        Get the amount of files of a root
+        :param root: Name of the root
+        :type root: str
+        :rtype: int
+        """
+        return sum(block.count for block in self.blocks.get(root, []))
+
+    def iterate_root(self, root, blocks=None):
+        """
+        Iterate over the entries of a root, sorted by path
+        :param root: Name of the root
+        :param blocks: Only iterate over these blocks of the root
+        :type root: str
+        :type blocks: list[Block]
+        :return: Generator of (path, checksum, stat) tuples
+        :rtype: collections.Generator
+        """
+        for block in self.blocks.get(root, []) if blocks is None else blocks:
+            yield from self._read_block(block)
+
+    def get(self, root, path):
+        """
+        Look up the entry of a single file, only the block containing the path is decompressed
+        :param root: Name of the root
+        :param path: Absolute path of the file
+        :type root: str
+        :type path: str
+        :return: (path, checksum, stat) tuple, None if the file isn't in the snapshot
+        :rtype: tuple
+        """
+        position = bisect.bisect_right(self.first_paths.get(root, []), path) - 1
+
+        if position < 0:
+            return None
+
+        return next((entry for entry in self._read_block(self.blocks[root][position]) if entry[0] == path), None)
+
+    def to_output(self, roots=None):
+        """
+        Convert the snapshot to raw checksum list output, as if the server was scanned
+        :param roots: Only convert these roots, defaults to all roots
+        :type roots: list[str]
+        :return: Dict of raw checksum list outputs keyed by root name
+        :rtype: dict
+        """
+        names = [name for name in self.roots if roots is None or name in roots]
+        return {name: "".join("{}  {}\n".format(checksum, path) for path, checksum, stat in self.iterate_root(name)).encode("utf-8") for name in names}
+
+    def close(self):
+        """
+        Close the memory map of the file
+        :return: None
+        """
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @classmethod
+    def write(cls, path, server_name, roots, hash_algorithms):
+        """
+        Write a snapshot file, an existing file is replaced once the new snapshot is complete
+        :param path: Path to the snapshot file
+        :param server_name: Name of the server the entries belong to
+        :param roots: Iterables of (path, checksum, stat) tuples keyed by root name, the last entry of a path wins
+        :param hash_algorithms: Hash algorithm of every root
+        :type path: str
+        :type server_name: str
+        :type roots: dict
+        :type hash_algorithms: dict
+        :return: None
+        """
+        index = {
+            "version": cls.VERSION,
+            "server": server_name,
+            "created_at": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+            "roots": {},
+        }
+
+        try:
+            with open(path + ".tmp", "wb") as file:
+                file.write(cls.MAGIC)
+
+                for name, entries in roots.items():
+                    files = {entry[0]: entry for entry in entries}
+                    blocks = [cls._write_block(file, chunk) for chunk in cls._split_blocks([files[p] for p in sorted(files)])]
+                    index["roots"][name] = {"hash_algorithm": hash_algorithms[name], "blocks": blocks}
+
+                offset = file.tell()
+                file.write(zlib.compress(json.dumps(index).encode("utf-8")))
+                file.write(cls.FOOTER.pack(offset, cls.MAGIC))
+
+            os.replace(path + ".tmp", path)
+
+        except OSError as e:
+            raise SnapshotException("Unable to write snapshot '{}', reason: {}".format(path, e))
+
+    @classmethod
+    def _split_blocks(cls, entries):
+        """
+        Split sorted entries into blocks, a block ends at a path whose hash matches the boundary mask
+        :param entries: Sorted (path, checksum, stat) tuples
+        :type entries: list[tuple]
+        :return: Generator of lists of entries
+        :rtype: collections.Generator
+        """
+        start = 0
+
+        for position, entry in enumerate(entries, 1):
+            size = position - start
+
+            if size >= cls.MAX_BLOCK_ENTRIES or (size >= cls.MIN_BLOCK_ENTRIES and not zlib.crc32(entry[0].encode("utf-8")) & cls.BOUNDARY_MASK):
+                yield entries[start:position]
+                start = position
+
+        if start < len(entries):
+            yield entries[start:]
+
+    @classmethod
+    def _write_block(cls, file, entries):
+        """
+        Compress and write a single block
+        :param file: File to write to
+        :param entries: Sorted (path, checksum, stat) tuples
+        :type entries: list[tuple]
+        :return: Index entry of the block
+        :rtype: list
+        """
+        data = "".join("{}\0{}\0{}\n".format(path, checksum, stat or "") for path, checksum, stat in entries).encode("utf-8")
+        compressed = zlib.compress(data)
+        offset = file.tell()
+        file.write(compressed)
+
+        return [entries[0][0], offset, len(compressed), len(entries), hashlib.sha1(data).hexdigest()]
+
+    def _read_block(self, block):
+        """
+        Decompress a single block
+        :param block: Block to read
+        :type block: Block
+        :return: List of (path, checksum, stat) tuples
+        :rtype: list[tuple]
+        """
+        data = zlib.decompress(self.map[block.offset:block.offset + block.length]).decode("utf-8")
+        return [tuple(line.split("\0")) for line in split_output_lines(data)]
+
+    def _read_index(self):
+        """
+        Read and validate the index of the snapshot
+        :return: Decoded index
+        :rtype: dict
+        """
+        try:
+            offset, magic = self.FOOTER.unpack(self.map[-self.FOOTER.size:])
+
+            if self.map[:len(self.MAGIC)] != self.MAGIC or magic != self.MAGIC:
+                raise ValueError("not a snapshot file")
+
+            index = json.loads(zlib.decompress(self.map[offset:-self.FOOTER.size]).decode("utf-8"))
+
+        except (struct.error, zlib.error, ValueError) as e:
+            raise SnapshotException("Invalid snapshot '{}', reason: {}".format(self.path, e))
+
+        if index.get("version") != self.VERSION:
+            raise SnapshotException("Unsupported version of snapshot '{}'".format(self.path))
+
+        return index
+
+
+def diff_snapshots(old, new, root):
+    """
+    Determine the changes of a root between two snapshots
+    Blocks with the same digest in both snapshots are skipped without decompressing them, only the remaining
+    entries are merged and classified like a scan does. There are no checksum records, so the IDs in the changes are None.
+    :param old: Snapshot to compare to
+    :param new: Current snapshot
+    :param root: Name of the root
+    :type old: Snapshot
+    :type new: Snapshot
+    :type root: str
+    :return: Changes of the root
+    :rtype: pipeline.Changes
+    """
+    shared = set(block.digest for block in old.blocks.get(root, [])) & set(block.digest for block in new.blocks.get(root, []))
+    old_entries = old.iterate_root(root, [block for block in old.blocks.get(root, []) if block.digest not in shared])
+    new_entries = new.iterate_root(root, [block for block in new.blocks.get(root, []) if block.digest not in shared])
+    added, modified, rehashed, removed = [], [], [], []
+
+    old_entry, new_entry = next(old_entries, None), next(new_entries, None)
+
+    while old_entry is not None or new_entry is not None:
+        if new_entry is None or (old_entry is not None and old_entry[0] < new_entry[0]):
+            removed.append((None, old_entry[0]))
+            old_entry = next(old_entries, None)
+            continue
+
+        if old_entry is None or new_entry[0] < old_entry[0]:
+            added.append((new_entry[0], new_entry[1]))
+            new_entry = next(new_entries, None)
+            continue
+
+        result = classify_change(old_entry[1], new_entry[1])
+
+        if result == MODIFIED:
+            modified.append((None, new_entry[0], new_entry[1]))
+        elif result != SAME:
+            rehashed.append((None, new_entry[0], new_entry[1]))
+
+        old_entry, new_entry = next(old_entries, None), next(new_entries, None)
+
+    return Changes(added, modified, rehashed, removed, [], new.count(root))
+
+
+def diff_database(snapshot, root, pipeline):
+    """
+    Determine the changes of a root between the stored checksums of the server of a snapshot and the snapshot
+    Nothing is written to the database
+    :param snapshot: Current snapshot
+    :param root: Name of the root
+    :param pipeline: Pipeline used to diff the checksums
+    :type snapshot: Snapshot
+    :type root: str
+    :type pipeline: pipeline.Pipeline
+    :return: Changes of the root
+    :rtype: pipeline.Changes
+    """
+    server = Server.get(snapshot.server_name) if database_exists() else None
+
+    if server is None:
+        raise SnapshotException("Server '{}' of snapshot '{}' is not in the database".format(snapshot.server_name, snapshot.path))
+
+    listing = [(path, checksum) for path, checksum, stat in snapshot.iterate_root(root)]
+    return pipeline.diff(listing, root, Checksum.get_index(server, root))
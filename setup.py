@@ -42,7 +42,6 @@ REQUIRED = [
     'pyasn1==0.2.1',
     'pycparser==2.17',
     'pyparsing==2.1.10',
-    'python-telegram-bot==5.3.0',
     'six==1.10.0',
     'SQLAlchemy==1.3.0',
     'tabulate==0.7.7',
@@ -51,6 +50,9 @@ REQUIRED = [
 ]
 
 EXTRAS_REQUIRE = {
+    'async': [
+        'asyncssh>=1.16.0',
+    ],
     'dev': [
         'twine',
         'wheel',
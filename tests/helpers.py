@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import os
+import sqlite3
+
+from dear.remote_integrity.config import Config
+
+CONFIGURATION = """
+[server]
+server_name=test
+server_port=22
+server_address=
+server_baseline=
+server_backend=local
+
+[auth]
+auth_username=
+auth_private_key=
+
+[filter]
+start_directory={directory}
+extra_directories=
+ignore_files=
+ignore_directories=
+scan_php_modules=0
+hash_algorithm=sha256
+scan_interval=
+partial_hash_threshold=
+partial_hash_chunks=8
+partial_hash_full_interval=
+roots=
+
+[quick_check]
+quick_check_runs=24
+quick_check_risky_extensions=php
+quick_check_max_staleness=
+
+[email]
+email_smtp_host=
+email_smtp_user=
+email_smtp_pass=
+email_recipients=
+email_noreply_address=noreply@example.com
+
+[logging]
+logging_syslog_host=
+
+[telegram]
+telegram_api_token=
+telegram_api_chat_id=
+
+[database]
+database_path={database}
+database_storage=plain
+
+[retention]
+retention_days=
+retention_max_events=
+retention_archive_directory=
+retention_vacuum=none
+
+[metrics]
+metrics_textfile=
+metrics_listen_address=127.0.0.1
+metrics_listen_port=
+"""
+
+# Schema of the databases created by the first release of the tool
+BASELINE_SCHEMA = """
+CREATE TABLE servers (id INTEGER NOT NULL, name VARCHAR NOT NULL, PRIMARY KEY (id), UNIQUE (name));
+CREATE TABLE checksums (
+    id INTEGER NOT NULL, path VARCHAR NOT NULL, checksum VARCHAR(128) NOT NULL, server_id INTEGER NOT NULL,
+    PRIMARY KEY (id), FOREIGN KEY(server_id) REFERENCES servers (id)
+);
+CREATE INDEX ix_checksums_server_id ON checksums (server_id);
+CREATE TABLE events (
+    id INTEGER NOT NULL, event INTEGER NOT NULL, description VARCHAR NOT NULL, timestamp DATETIME NOT NULL,
+    checksum_id INTEGER NOT NULL, PRIMARY KEY (id), FOREIGN KEY(checksum_id) REFERENCES checksums (id)
+);
+CREATE INDEX ix_events_checksum_id ON events (checksum_id);
+"""
+
+
+def write_baseline_database(path, rows):
+    """
+    Create a database with the schema of the first release of the tool
+    :param path: Path to the database file
+    :param rows: SQL statements inserting the rows
+    :type path: str
+    :type rows: str
+    :return: None
+    """
+    with sqlite3.connect(path) as connection:
+        connection.executescript(BASELINE_SCHEMA + rows)
+
+
+def write_config(directory, scanned, sections="", **options):
+    """
+    Write and load the configuration of a local server
+    :param directory: Directory to write the configuration and database to
+    :param scanned: Directory to scan
+    :param sections: Additional sections (eg. roots) to append to the configuration
+    :param options: Options to replace in the configuration, as option=value
+    :type directory: str
+    :type scanned: str
+    :type sections: str
+    :rtype: Config
+    """
+    text = CONFIGURATION.format(directory=scanned, database=os.path.join(directory, "integrity.db"))
+
+    for option, value in options.items():
+        text = "\n".join("{}={}".format(option, value) if line.startswith(option + "=") else line for line in text.splitlines())
+
+    text += sections
+
+    path = os.path.join(directory, "test.cfg")
+
+    with open(path, "w") as file:
+        file.write(text)
+
+    return Config.load(path)
+
+
+def write_file(path, data):
+    """
+    Write a file, its directory is created if it doesn't exist
+    :param path: Path to the file
+    :param data: Contents of the file
+    :type path: str
+    :type data: bytes
+    :return: None
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "wb") as file:
+        file.write(data)
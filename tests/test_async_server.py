@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from dear.remote_integrity import models
+from dear.remote_integrity.async_server import asyncssh, AsyncServer, FanOut
+from dear.remote_integrity.discovery import DiscoveryCache
+from dear.remote_integrity.exceptions import ServerException
+from dear.remote_integrity.local_scanner import LocalScanner
+from dear.remote_integrity.metrics import Metrics
+from dear.remote_integrity.models import session, use_database
+
+from tests.helpers import write_config, write_file
+
+
+class ShellServer:
+    """
+    In-process SSH server on the loopback interface that runs every command in a local shell
+    """
+
+    def __init__(self, directory):
+        """
+        Start the server on a background event loop
+        :param directory: Directory to write the keys to
+        :type directory: str
+        """
+        self.host_key = asyncssh.generate_private_key("ssh-ed25519")
+        self.client_key = asyncssh.generate_private_key("ssh-ed25519")
+        self.client_key_path = os.path.join(directory, "id_ed25519")
+        self.client_key.write_private_key(self.client_key_path)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.listener = asyncio.run_coroutine_threadsafe(self._listen(), self.loop).result()
+        self.port = self.listener.sockets[0].getsockname()[1]
+
+    def get_known_hosts_line(self, key=None):
+        """
+        Get the known_hosts entry of the server
+        :param key: Host key to list, defaults to the key of the server
+        :rtype: str
+        """
+        public_key = (key or self.host_key).export_public_key("openssh").decode("utf-8").strip()
+        return "[127.0.0.1]:{} {}\n".format(self.port, public_key)
+
+    def close(self):
+        """
+        Stop the server and its event loop, the listener is closed on the loop since it isn't thread-safe
+        :return: None
+        """
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def _close(self):
+        self.listener.close()
+        await self.listener.wait_closed()
+
+    async def _listen(self):
+        return await asyncssh.listen(
+            "127.0.0.1", 0,
+            server_host_keys=[self.host_key],
+            authorized_client_keys=asyncssh.import_authorized_keys(self.client_key.export_public_key().decode("utf-8")),
+            process_factory=self._run,
+            encoding=None)
+
+    @staticmethod
+    async def _run(process):
+        child = await asyncio.create_subprocess_shell(process.command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await child.communicate()
+        process.stdout.write(stdout)
+        process.stderr.write(stderr)
+        process.exit(child.returncode)
+
+
+@unittest.skipIf(asyncssh is None, "asyncssh is not installed")
+class AsyncServerTest(unittest.TestCase):
+    """
+    Scans over the asyncio transport against an in-process SSH server
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.home = os.path.join(self.directory.name, "home")
+        self.scanned = os.path.join(self.directory.name, "www")
+        os.makedirs(os.path.join(self.home, ".ssh"))
+        write_file(os.path.join(self.scanned, "index.php"), b"<?php echo 'hello';\n")
+        write_file(os.path.join(self.scanned, "lib", "db.php"), b"<?php // database\n")
+
+        self.server = ShellServer(self.directory.name)
+        self.config = write_config(self.directory.name, self.scanned, server_backend="ssh", server_address="127.0.0.1",
+                                   server_port=self.server.port, auth_username="scanner", auth_private_key=self.server.client_key_path)
+        self.environment = mock.patch.dict(os.environ, {"HOME": self.home})
+        self.environment.start()
+        os.environ.pop("SSH_AUTH_SOCK", None)
+        use_database(self.config.database_path)
+
+    def tearDown(self):
+        self.environment.stop()
+        self.server.close()
+        session.close()
+        models.engine.dispose()
+        self.directory.cleanup()
+
+    def write_known_hosts(self, line):
+        with open(os.path.join(self.home, ".ssh", "known_hosts"), "w") as file:
+            file.write(line)
+
+    def scan(self):
+        return [(result.output, result.error) for result in FanOut([self.config], Metrics())][0]
+
+    def test_unknown_host_key_is_refused(self):
+        output, error = self.scan()
+
+        self.assertIsNone(output)
+        self.assertIsInstance(error, ServerException)
+
+    def test_mismatching_host_key_is_refused(self):
+        self.write_known_hosts(self.server.get_known_hosts_line(asyncssh.generate_private_key("ssh-ed25519")))
+
+        with self.assertRaises(ServerException):
+            asyncio.new_event_loop().run_until_complete(AsyncServer(self.config).connect())
+
+    def test_known_host_is_scanned(self):
+        self.write_known_hosts(self.server.get_known_hosts_line())
+        output, error = self.scan()
+
+        self.assertIsNone(error)
+        self.assertEqual(sorted(output["default"].splitlines()), sorted(LocalScanner(self.config).acquire_checksum_output()["default"].splitlines()))
+        self.assertEqual(len(output["default"].splitlines()), 2)
+
+    def test_read_only_database_keeps_discovery_in_memory(self):
+        self.write_known_hosts(self.server.get_known_hosts_line())
+        cache = os.path.join(self.directory.name, DiscoveryCache.FILE_NAME)
+
+        use_database(self.config.database_path, read_only=True)
+        self.assertIsNone(self.scan()[1])
+        self.assertFalse(os.path.exists(cache))
+        self.assertIsNotNone(DiscoveryCache.get(self.config.server_name))
+
+        use_database(self.config.database_path)
+        DiscoveryCache.discard(self.config.server_name)
+        self.assertIsNone(self.scan()[1])
+        self.assertFalse(os.path.exists(cache))
+
+        DiscoveryCache.flush()
+        self.assertTrue(os.path.exists(cache))
+
+
+class FanOutTest(unittest.TestCase):
+    """
+    Handing the results of many servers to the calling thread
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scanned = os.path.join(self.directory.name, "www")
+        write_file(os.path.join(self.scanned, "index.php"), b"<?php echo 'hello';\n")
+        self.config = write_config(self.directory.name, self.scanned)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_results_are_bounded_by_concurrency(self):
+        fan_out = FanOut([self.config] * 8, Metrics(), concurrency=2)
+        results = []
+
+        for result in fan_out:
+            time.sleep(0.05)
+            self.assertLessEqual(fan_out.results.qsize(), 2)
+            results.append(result.get())
+
+        self.assertEqual(len(results), 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
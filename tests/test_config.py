@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import os
+import tempfile
+import unittest
+
+from dear.remote_integrity.config import Config, ConfigCache
+from dear.remote_integrity.exceptions import ConfigurationException
+
+from tests.helpers import CONFIGURATION, write_config
+
+ROOTS = """
+[root:inherited]
+directories=/srv/inherited
+partial_hash_threshold=
+partial_hash_full_interval=
+
+[root:disabled]
+directories=/srv/disabled
+partial_hash_threshold=0
+partial_hash_full_interval=0
+
+[root:overridden]
+directories=/srv/overridden
+partial_hash_threshold=500
+partial_hash_full_interval=60
+"""
+
+FLEET = """
+[template:web]
+hash_algorithm=sha512
+ignore_files=.htaccess
+server_port=2200
+
+[template:web-eu]
+inherit=web
+server_address=eu.example.com
+
+[host:web-01]
+inherit=web-eu
+server_port=2222
+
+[host:web-02]
+inherit=web
+
+[host:db-01]
+"""
+
+
+class ScanRootTest(unittest.TestCase):
+    """
+    Partial hash policies of roots that override the [filter] section
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def get_roots(self, sections=ROOTS, **options):
+        config = write_config(self.directory.name, "/srv/www", sections, roots="inherited,disabled,overridden", **options)
+        return {root.name: root for root in config.get_scan_roots()}
+
+    def test_roots_inherit_an_enabled_policy(self):
+        roots = self.get_roots(partial_hash_threshold=1000, partial_hash_full_interval=3600)
+
+        self.assertEqual([(name, root.partial_hash_threshold, root.partial_hash_full_interval) for name, root in sorted(roots.items())], [
+            ("default", 1000, 3600),
+            ("disabled", None, None),
+            ("inherited", 1000, 3600),
+            ("overridden", 500, 60),
+        ])
+
+    def test_roots_inherit_a_disabled_policy(self):
+        roots = self.get_roots()
+
+        self.assertIsNone(roots["inherited"].partial_hash_threshold)
+        self.assertIsNone(roots["disabled"].partial_hash_threshold)
+        self.assertEqual(roots["overridden"].partial_hash_threshold, 500)
+
+    def test_negative_root_threshold_is_invalid(self):
+        with self.assertRaises(ConfigurationException):
+            self.get_roots(ROOTS.replace("partial_hash_threshold=500", "partial_hash_threshold=-1"))
+
+
+class FleetConfigTest(unittest.TestCase):
+    """
+    Fleet configuration files with host and template sections, and the cache of loaded files
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "fleet.cfg")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, sections=FLEET, path=None, modified_at=None):
+        path = path or self.path
+
+        with open(path, "w") as file:
+            file.write(CONFIGURATION.format(directory="/srv/www", database=os.path.join(self.directory.name, "integrity.db")) + sections)
+
+        if modified_at is not None:
+            os.utime(path, (modified_at, modified_at))
+
+        return path
+
+    def load(self, sections=FLEET):
+        return {config.server_name: config for config in Config.load_all(self.write(sections))}
+
+    def test_hosts_inherit_templates(self):
+        configs = self.load()
+        options = [(config.server_address, config.server_port, config.hash_algorithm, config.ignore_files) for config in configs.values()]
+
+        self.assertEqual(list(configs), ["web-01", "web-02", "db-01"])
+        self.assertEqual(options, [
+            ("eu.example.com", 2222, "sha512", [".htaccess"]),
+            ("localhost", 2200, "sha512", [".htaccess"]),
+            ("localhost", 22, "sha256", []),
+        ])
+
+    def test_invalid_fleets(self):
+        for sections, message in (
+            ("[host:web-03]\nunknown_option=1\n", "Unknown option"),
+            ("[host:web-03]\ninherit=missing\n", "Unknown template"),
+            ("[template:a]\ninherit=b\n[template:b]\ninherit=a\n[host:web-03]\ninherit=a\n", "Circular inheritance"),
+            ("[host:web-03]\nserver_name=web-01\n", "Duplicate server_name"),
+        ):
+            with self.assertRaisesRegex(ConfigurationException, message):
+                self.load(FLEET + sections)
+
+    def test_cache_reloads_changed_files(self):
+        cache = ConfigCache()
+        other = self.write("[host:other]\n", os.path.join(self.directory.name, "other.cfg"))
+        configs = cache.load([self.write(modified_at=1000), other])
+
+        self.assertEqual([config.server_name for config in configs], ["web-01", "web-02", "db-01", "other"])
+        self.assertTrue(all(a is b for a, b in zip(cache.load([self.path, other]), configs)))
+
+        self.write(FLEET.replace("server_port=2222", "server_port=2223"), modified_at=2000)
+        reloaded = cache.load([self.path, other])
+
+        self.assertEqual(reloaded[0].server_port, 2223)
+        self.assertIs(reloaded[3], configs[3])
+
+        self.write(FLEET + "[host:web-03]\ninherit=missing\n", modified_at=3000)
+
+        with self.assertRaises(ConfigurationException):
+            cache.load([self.path, other])
+
+        self.assertEqual(cache.entries[self.path][1], reloaded[:3])
+
+    def test_cache_rejects_servers_in_several_files(self):
+        with self.assertRaises(ConfigurationException):
+            ConfigCache().load([self.write(), self.write("[host:web-01]\n", os.path.join(self.directory.name, "other.cfg"))])
+
+        with self.assertRaises(ConfigurationException):
+            ConfigCache().load([os.path.join(self.directory.name, "missing.cfg")])
+
+
+if __name__ == "__main__":
+    unittest.main()
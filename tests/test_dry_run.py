@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import hashlib
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from dear.remote_integrity import __main__ as main
+from dear.remote_integrity import models
+from dear.remote_integrity.dry_run import DryRun, PredictedEvent
+from dear.remote_integrity.metrics import Metrics
+from dear.remote_integrity.models import session, use_database, Event
+from dear.remote_integrity.pipeline import Pipeline
+from dear.remote_integrity.server import create_scanner
+
+from tests.helpers import write_baseline_database, write_config, write_file
+
+
+class LegacyDatabaseTest(unittest.TestCase):
+    """
+    Dry runs against a database that wasn't upgraded to the current schema
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scanned = os.path.join(self.directory.name, "www")
+        self.pipeline = Pipeline(1)
+        self.config = write_config(self.directory.name, self.scanned)
+
+        index = os.path.join(self.scanned, "index.php")
+        write_file(index, b"<?php echo 'hello';\n")
+        write_file(os.path.join(self.scanned, "lib", "db.php"), b"<?php\n")
+
+        write_baseline_database(self.config.database_path, """
+INSERT INTO servers (id, name) VALUES (1, 'test');
+INSERT INTO checksums (id, path, checksum, server_id) VALUES (1, '{index}', '{modified}', 1);
+INSERT INTO checksums (id, path, checksum, server_id) VALUES (2, '{db}', '{db_checksum}', 1);
+INSERT INTO checksums (id, path, checksum, server_id) VALUES (3, '{removed}', '{modified}', 1);
+""".format(index=index, db=os.path.join(self.scanned, "lib", "db.php"), removed=os.path.join(self.scanned, "old.php"),
+           modified="a" * 64, db_checksum=hashlib.sha256(b"<?php\n").hexdigest()))
+
+    def tearDown(self):
+        self.pipeline.close()
+        session.close()
+        models.engine.dispose()
+        self.directory.cleanup()
+
+    def test_events_are_predicted_without_upgrading(self):
+        with open(self.config.database_path, "rb") as file:
+            before = file.read()
+
+        use_database(self.config.database_path, read_only=True)
+        output = main.acquire_checksum_output(create_scanner(self.config), Metrics())[1]
+        events = DryRun(self.config, self.pipeline).predict(self.pipeline.parse(output, self.config))
+
+        self.assertEqual(sorted(events), [
+            PredictedEvent(Event.FILE_REMOVED, os.path.join(self.scanned, "old.php"), "default"),
+            PredictedEvent(Event.FILE_MODIFIED, os.path.join(self.scanned, "index.php"), "default"),
+        ])
+
+        with open(self.config.database_path, "rb") as file:
+            self.assertEqual(file.read(), before)
+
+        with sqlite3.connect(self.config.database_path) as connection:
+            self.assertIn("path", [row[1] for row in connection.execute("PRAGMA table_info(checksums)")])
+
+
+if __name__ == "__main__":
+    unittest.main()
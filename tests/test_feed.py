@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from dear.remote_integrity import models
+from dear.remote_integrity.feed import ChangeFeed, NdjsonExporter
+from dear.remote_integrity.models import session, use_database, prepare_database, Event, Server
+
+
+class Stop(Exception):
+    """
+    Raised to stop following a feed
+    """
+
+
+class ChangeFeedTest(unittest.TestCase):
+    """
+    Incremental exports of the events table
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cursor = os.path.join(self.directory.name, "cursor.json")
+        self.output = os.path.join(self.directory.name, "events.ndjson")
+        use_database(os.path.join(self.directory.name, "integrity.db"))
+        prepare_database()
+        self.servers = [Server.create("web-01"), Server.create("web-02")]
+        session.commit()
+
+    def tearDown(self):
+        session.close()
+        models.engine.dispose()
+        self.directory.cleanup()
+
+    def add_event(self, path, server=0):
+        Event.create(Event.FILE_MODIFIED, path, self.servers[server], 1)
+        session.commit()
+
+    def read_output(self):
+        with open(self.output) as file:
+            return [(event["server"], event["path"]) for event in map(json.loads, file)]
+
+    def test_export_resumes_at_cursor(self):
+        self.add_event("/var/www/a.php")
+        self.add_event("/var/www/b.php", server=1)
+        self.assertEqual(NdjsonExporter(ChangeFeed(self.cursor), self.output).export(), 2)
+
+        self.add_event("/var/www/c.php")
+        self.assertEqual(NdjsonExporter(ChangeFeed(self.cursor), self.output).export(), 1)
+        self.assertEqual(NdjsonExporter(ChangeFeed(self.cursor), self.output).export(), 0)
+
+        self.assertEqual(self.read_output(), [("web-01", "/var/www/a.php"), ("web-02", "/var/www/b.php"), ("web-01", "/var/www/c.php")])
+
+    def test_pruned_ids_are_not_reused(self):
+        self.add_event("/var/www/a.php")
+        self.add_event("/var/www/b.php")
+        NdjsonExporter(ChangeFeed(self.cursor), self.output).export()
+
+        session.query(Event).delete()
+        session.commit()
+        self.add_event("/var/www/c.php")
+
+        self.assertEqual(NdjsonExporter(ChangeFeed(self.cursor), self.output).export(), 1)
+
+    def test_server_filter(self):
+        self.add_event("/var/www/a.php")
+        self.add_event("/var/www/b.php", server=1)
+
+        self.assertEqual([event["path"] for event in ChangeFeed(server_name="web-02").read()], ["/var/www/b.php"])
+
+    def test_follow_exports_new_events(self):
+        self.add_event("/var/www/a.php")
+        polls = []
+
+        def sleep(interval):
+            polls.append(interval)
+
+            if len(polls) == 1:
+                self.add_event("/var/www/b.php")
+            elif len(polls) == 3:
+                raise Stop()
+
+        with mock.patch("dear.remote_integrity.feed.time.sleep", side_effect=sleep):
+            with self.assertRaises(Stop):
+                NdjsonExporter(ChangeFeed(self.cursor), self.output).follow(1)
+
+        self.assertEqual(self.read_output(), [("web-01", "/var/www/a.php"), ("web-01", "/var/www/b.php")])
+        self.assertEqual(NdjsonExporter(ChangeFeed(self.cursor), self.output).export(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
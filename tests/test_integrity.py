@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from dear.remote_integrity import __main__ as main
+from dear.remote_integrity import models
+from dear.remote_integrity.exceptions import IntegrityException
+from dear.remote_integrity.golden import GoldenBaseline
+from dear.remote_integrity.hashing import compare_checksums, INCOMPARABLE, MODIFIED
+from dear.remote_integrity.metrics import Metrics
+from dear.remote_integrity.models import session, use_database, prepare_database, Checksum, Digest, Event, ScanRun, Server
+from dear.remote_integrity.notifier import Notifier
+from dear.remote_integrity.pipeline import Pipeline
+
+from tests.helpers import write_config, write_file
+
+
+class CompareChecksumsTest(unittest.TestCase):
+    """
+    Comparisons of checksums of different hash modes
+    """
+
+    def test_modes_without_full_checksum_are_incomparable(self):
+        self.assertEqual(compare_checksums("a" * 64, "partial:" + "b" * 64), INCOMPARABLE)
+
+    def test_modes_are_compared_by_full_checksum(self):
+        self.assertEqual(compare_checksums("a" * 64, "partial:{}:{}".format("b" * 64, "a" * 64)), INCOMPARABLE)
+        self.assertEqual(compare_checksums("a" * 64, "partial:{}:{}".format("b" * 64, "c" * 64)), MODIFIED)
+        self.assertEqual(compare_checksums("partial:{}:{}".format("b" * 64, "c" * 64), "a" * 64), MODIFIED)
+
+
+class PartialHashThresholdTest(unittest.TestCase):
+    """
+    Files that cross the partial hash threshold of a local server
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scanned = os.path.join(self.directory.name, "www")
+        self.pipeline = Pipeline(1)
+        write_file(os.path.join(self.scanned, "index.php"), b"<?php echo 'hello';\n")
+        write_file(os.path.join(self.scanned, "large.bin"), b"\0" * 300000)
+
+    def tearDown(self):
+        self.pipeline.close()
+        session.close()
+        models.engine.dispose()
+        self.directory.cleanup()
+
+    def scan(self, **options):
+        config = write_config(self.directory.name, self.scanned, **options)
+        use_database(config.database_path)
+        prepare_database()
+        main.run_remote_integrity_checker(main.schedule_roots([config])[0], Metrics(), self.pipeline, Notifier())
+        return [(event.event, event.path) for event in session.query(Event).order_by(Event.id)]
+
+    def test_file_growing_past_threshold_is_modified(self):
+        self.scan(partial_hash_threshold=100000)
+
+        with open(os.path.join(self.scanned, "index.php"), "ab") as file:
+            file.write(b"\0" * 200000)
+
+        self.assertEqual(self.scan(partial_hash_threshold=100000), [(Event.FILE_MODIFIED, os.path.join(self.scanned, "index.php"))])
+
+    def test_changing_threshold_rehashes_silently(self):
+        self.scan()
+        self.assertEqual(self.scan(partial_hash_threshold=100000), [])
+        self.assertEqual(self.scan(partial_hash_threshold=100000), [])
+        self.assertEqual(self.scan(), [])
+
+
+class RetentionTest(unittest.TestCase):
+    """
+    Retention that runs after a successful scan
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scanned = os.path.join(self.directory.name, "www")
+        self.pipeline = Pipeline(1)
+        write_file(os.path.join(self.scanned, "index.php"), b"<?php echo 'hello';\n")
+        # The archive directory is a file, so archiving the pruned events fails
+        write_file(os.path.join(self.directory.name, "archive"), b"")
+
+    def tearDown(self):
+        self.pipeline.close()
+        session.close()
+        models.engine.dispose()
+        self.directory.cleanup()
+
+    def scan(self):
+        config = write_config(self.directory.name, self.scanned, retention_max_events=1,
+                              retention_archive_directory=os.path.join(self.directory.name, "archive"))
+        use_database(config.database_path)
+        prepare_database()
+        main.run_remote_integrity_checker(main.schedule_roots([config])[0], Metrics(), self.pipeline, Notifier())
+
+    def test_failing_retention_keeps_successful_run(self):
+        self.scan()
+        write_file(os.path.join(self.scanned, "a.php"), b"<?php\n")
+        write_file(os.path.join(self.scanned, "b.php"), b"<?php\n")
+        self.scan()
+
+        self.assertEqual([run.status for run in session.query(ScanRun).order_by(ScanRun.id)], [ScanRun.SUCCESS] * 2)
+        self.assertEqual(session.query(Event).count(), 2)
+
+
+class ScanRunTest(unittest.TestCase):
+    """
+    Summaries of every scan run
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scanned = os.path.join(self.directory.name, "www")
+        self.pipeline = Pipeline(1)
+        self.config = write_config(self.directory.name, self.scanned)
+        write_file(os.path.join(self.scanned, "index.php"), b"<?php echo 'hello';\n")
+        write_file(os.path.join(self.scanned, "db.php"), b"<?php\n")
+        use_database(self.config.database_path)
+        prepare_database()
+
+    def tearDown(self):
+        self.pipeline.close()
+        session.close()
+        models.engine.dispose()
+        self.directory.cleanup()
+
+    def scan(self):
+        main.run_remote_integrity_checker(main.schedule_roots([self.config])[0], Metrics(), self.pipeline, Notifier())
+
+    def test_summary_of_changes(self):
+        self.scan()
+        write_file(os.path.join(self.scanned, "index.php"), b"<?php echo 'modified';\n")
+        write_file(os.path.join(self.scanned, "new.php"), b"<?php\n")
+        os.remove(os.path.join(self.scanned, "db.php"))
+        self.scan()
+
+        run, first = ScanRun.latest("test")
+        summary = (run.status, run.mode, run.files_seen, run.files_hashed, run.files_added, run.files_removed, run.files_modified)
+
+        self.assertEqual(summary, (ScanRun.SUCCESS, ScanRun.FULL, 2, 2, 1, 1, 1))
+        self.assertEqual((first.files_seen, first.files_added, first.files_removed, first.files_modified), (2, 0, 0, 0))
+        self.assertEqual(run.bytes_transferred, 0)  # Nothing is transferred when scanning the local host
+        self.assertGreaterEqual(run.duration, 0)
+        self.assertEqual([event.scan_run for event in session.query(Event)], [run] * 3)
+        self.assertEqual(ScanRun.latest("test", limit=1), [run])
+        self.assertEqual(ScanRun.latest("other"), [])
+
+    def test_failed_run_is_recorded(self):
+        self.scan()
+
+        with mock.patch.object(main, "identify", side_effect=KeyError("unexpected")):
+            with self.assertRaises(KeyError):
+                self.scan()
+
+        run = ScanRun.latest("test", limit=1)[0]
+        self.assertEqual((run.status, run.error, run.files_seen), (ScanRun.FAILED, "'unexpected'", 0))
+
+    def test_failed_first_run_is_not_recorded(self):
+        with mock.patch.object(main, "identify", side_effect=KeyError("unexpected")):
+            with self.assertRaises(KeyError):
+                self.scan()
+
+        self.assertEqual(ScanRun.latest(), [])
+        self.assertIsNone(Server.get("test"))
+
+
+class GoldenBaselineTest(unittest.TestCase):
+    """
+    Servers compared to a reference snapshot instead of their own previous state
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scanned = os.path.join(self.directory.name, "www")
+        self.index = os.path.join(self.scanned, "index.php")
+        self.pipeline = Pipeline(1)
+        write_file(self.index, b"<?php echo 'hello';\n")
+        write_file(os.path.join(self.scanned, "db.php"), b"<?php\n")
+
+        config = write_config(self.directory.name, self.scanned, server_name="reference")
+        use_database(config.database_path)
+        main.register_baseline(config, "golden")
+
+    def tearDown(self):
+        GoldenBaseline.loaded.clear()
+        self.pipeline.close()
+        session.close()
+        models.engine.dispose()
+        self.directory.cleanup()
+
+    def scan(self):
+        config = write_config(self.directory.name, self.scanned, server_name="web-01", server_baseline="golden")
+        main.run_remote_integrity_checker(main.schedule_roots([config])[0], Metrics(), self.pipeline, Notifier())
+        run = ScanRun.latest("web-01", limit=1)[0]
+        return run.files_added, run.files_removed, run.files_modified
+
+    def test_deviations_are_reported_every_run(self):
+        self.assertEqual(self.scan(), (0, 0, 0))
+
+        write_file(self.index, b"<?php echo 'modified';\n")
+        write_file(os.path.join(self.scanned, "new.php"), b"<?php\n")
+        os.remove(os.path.join(self.scanned, "db.php"))
+
+        self.assertEqual(self.scan(), (1, 1, 1))
+        self.assertEqual(self.scan(), (1, 1, 1))
+        self.assertEqual(session.query(Event).count(), 0)
+
+    def test_baseline_is_loaded_from_database(self):
+        GoldenBaseline.loaded.clear()
+        deviations = GoldenBaseline.load("golden").compare("web-01", [(self.index, "a" * 64)])
+
+        self.assertEqual(sorted((deviation.event, deviation.path) for deviation in deviations),
+                         [(Event.FILE_REMOVED, os.path.join(self.scanned, "db.php")), (Event.FILE_MODIFIED, self.index)])
+        self.assertIn("compared to baseline 'golden'", deviations[0].description)
+
+        with self.assertRaises(IntegrityException):
+            GoldenBaseline.load("missing")
+
+    def test_partial_checksums(self):
+        baseline = GoldenBaseline("golden", {"/a": "partial:" + "a" * 64, "/b": "partial:" + "b" * 64})
+        output = [("/a", "partial:{}:{}".format("a" * 64, "c" * 64)), ("/b", "partial:{}:{}".format("c" * 64, "d" * 64))]
+
+        self.assertEqual([(deviation.event, deviation.path) for deviation in baseline.compare("web-01", output)], [(Event.FILE_MODIFIED, "/b")])
+
+
+class PipelineTest(unittest.TestCase):
+    """
+    Parsing and diffing on worker processes, compared to doing it in the current process
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scanned = os.path.join(self.directory.name, "www")
+        self.config = write_config(self.directory.name, self.scanned, ignore_directories=os.path.join(self.scanned, "cache"))
+        self.pipelines = [Pipeline(1), Pipeline(3)]
+
+        paths = [os.path.join(self.scanned, "dir{}".format(i % 7), "file {}.php".format(i)) for i in range(500)]
+        paths += [os.path.join(self.scanned, "cache", "{}.html".format(i)) for i in range(20)]
+        self.output = {"default": "".join("{:064x}  {}\n".format(i, path) for i, path in enumerate(paths)).encode("utf-8")}
+
+        self.index = [(i + 1, path, "{:064x}".format(i)) for i, path in enumerate(paths[:500]) if i % 50]
+        self.index[10] = (11, self.index[10][1], "f" * 64)
+        self.index[20] = (21, self.index[20][1], "partial:" + "0" * 64)
+        self.index.append((1000, self.index[30][1], self.index[30][2]))
+        self.index.append((1001, os.path.join(self.scanned, "removed.php"), "e" * 64))
+
+    def tearDown(self):
+        for pipeline in self.pipelines:
+            pipeline.close()
+
+        self.directory.cleanup()
+
+    def diff(self, pipeline, policy_changed=False):
+        pipeline.CHUNK_SIZE = 1000
+        listing = pipeline.parse(self.output, self.config)
+        changes = pipeline.diff(listing, "default", self.index, policy_changed)
+        return sorted(listing), changes._replace(rehashed=sorted(changes.rehashed), duplicates=sorted(changes.duplicates))
+
+    def test_workers_match_serial_result(self):
+        serial, parallel = [self.diff(pipeline) for pipeline in self.pipelines]
+
+        self.assertEqual(parallel, serial)
+        self.assertEqual(len(serial[0]), 500)
+        self.assertEqual([len(changes) for changes in serial[1][:5]], [10, 2, 0, 1, 1])
+        self.assertEqual(serial[1].files_seen, 500)
+
+        serial, parallel = [self.diff(pipeline, policy_changed=True) for pipeline in self.pipelines]
+
+        self.assertEqual(parallel, serial)
+        self.assertEqual([len(changes) for changes in serial[1][:5]], [10, 1, 1, 1, 1])
+
+    def test_listing_of_other_shard_count(self):
+        listing = self.pipelines[1].parse(self.output, self.config)
+
+        self.assertEqual(self.pipelines[0].diff(listing, "default", self.index), self.pipelines[0].diff(list(listing), "default", self.index))
+
+
+class NormalizedStorageTest(unittest.TestCase):
+    """
+    Checksums stored as references to digest records
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scanned = os.path.join(self.directory.name, "www")
+        self.index = os.path.join(self.scanned, "index.php")
+        self.pipeline = Pipeline(1)
+        write_file(self.index, b"<?php echo 'hello';\n")
+        write_file(os.path.join(self.scanned, "copy.php"), b"<?php echo 'hello';\n")
+        write_file(os.path.join(self.scanned, "db.php"), b"<?php\n")
+
+    def tearDown(self):
+        self.pipeline.close()
+        session.close()
+        models.engine.dispose()
+        self.directory.cleanup()
+
+    def scan(self, **options):
+        config = write_config(self.directory.name, self.scanned, **options)
+        use_database(config.database_path)
+        prepare_database()
+        main.run_remote_integrity_checker(main.schedule_roots([config])[0], Metrics(), self.pipeline, Notifier())
+        return [(event.event, event.path) for event in session.query(Event).order_by(Event.id)]
+
+    def get_index(self, server_name="test"):
+        return sorted((path, checksum) for checksum_id, path, checksum in Checksum.get_index(Server.get(server_name), "default"))
+
+    def test_switching_storage_converts_checksums(self):
+        self.scan()
+        index = self.get_index()
+
+        self.assertEqual(self.scan(database_storage="normalized"), [])
+        self.assertEqual(self.get_index(), index)
+        self.assertEqual(session.query(Checksum).filter(Checksum.digest_id.is_(None)).count(), 0)
+        self.assertEqual(session.query(Checksum).filter(Checksum._checksum != "").count(), 0)
+        self.assertEqual(session.query(Digest).count(), 2)
+
+    def test_unreferenced_digests_are_deleted(self):
+        self.scan(database_storage="normalized")
+        write_file(self.index, b"<?php echo 'modified';\n")
+        os.remove(os.path.join(self.scanned, "db.php"))
+
+        self.assertEqual(sorted(self.scan(database_storage="normalized")), [(Event.FILE_REMOVED, os.path.join(self.scanned, "db.php")), (Event.FILE_MODIFIED, self.index)])
+        self.assertEqual(session.query(Digest).count(), 2)
+
+        write_file(self.index, b"<?php\n")
+        self.scan(database_storage="normalized")
+        models.vacuum_database()
+
+        self.assertEqual(session.query(Digest).count(), 2)
+        self.assertEqual(session.query(Checksum).filter(~Checksum.digest_id.in_(session.query(Digest.id))).count(), 0)
+
+    def test_drift_between_servers(self):
+        self.scan(database_storage="normalized")
+        write_file(self.index, b"<?php echo 'modified';\n")
+        self.scan(server_name="other")
+
+        self.assertEqual([(path, servers) for path, checksum, count, servers in Checksum.drift(self.index)], [(self.index, "other"), (self.index, "test")])
+        self.assertEqual([path for path, checksum, count, servers in Checksum.drift()], [self.index, self.index])
+        self.assertEqual([count for path, checksum, count, servers in Checksum.drift(os.path.join(self.scanned, "db.php"))], [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from dear.remote_integrity.commands import PARTIAL_HASH_CHUNK_SIZE
+from dear.remote_integrity.local_scanner import LocalScanner, partial_checksum
+from dear.remote_integrity.server import Server
+
+from tests.helpers import write_config, write_file
+
+
+class LocalScannerTest(unittest.TestCase):
+    """
+    Walking and hashing the file system of the host the tool runs on
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scanned = os.path.join(self.directory.name, "www")
+        write_file(os.path.join(self.scanned, "index.php"), b"<?php echo 'hello';\n")
+        write_file(os.path.join(self.scanned, "lib", "db.php"), b"<?php\n")
+        write_file(os.path.join(self.scanned, "cache", "page.html"), b"<html>\n")
+        write_file(os.path.join(self.directory.name, "outside.php"), b"<?php\n")
+        os.symlink(self.directory.name, os.path.join(self.scanned, "link"))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def scan(self, **options):
+        config = write_config(self.directory.name, self.scanned, **options)
+        return dict((path, checksum) for path, checksum in LocalScanner(config, workers=2).acquire_checksum_list())
+
+    def test_walk_skips_ignored_directories_and_links(self):
+        checksums = self.scan(extra_directories=os.path.join(self.scanned, "lib"), ignore_directories=os.path.join(self.scanned, "cache"))
+
+        self.assertEqual(sorted(checksums), [os.path.join(self.scanned, "index.php"), os.path.join(self.scanned, "lib", "db.php")])
+        self.assertEqual(checksums[os.path.join(self.scanned, "lib", "db.php")],
+                         subprocess.check_output(["sha256sum", os.path.join(self.scanned, "lib", "db.php")]).decode("utf-8").split()[0])
+
+    def test_partial_checksum_matches_remote_script(self):
+        for size in (0, 1, PARTIAL_HASH_CHUNK_SIZE, PARTIAL_HASH_CHUNK_SIZE * 20 + 7):
+            path = os.path.join(self.scanned, "large.bin")
+            write_file(path, bytes(i % 251 for i in range(size)))
+            root = write_config(self.directory.name, self.scanned, partial_hash_threshold=1, partial_hash_chunks=3).get_scan_roots()[0]
+
+            expected = subprocess.check_output(["sh", "-c", Server.PARTIAL_HASH_SCRIPT, "sh", str(PARTIAL_HASH_CHUNK_SIZE),
+                                                str(root.partial_hash_chunks), root.hash_command, "1", path])
+
+            self.assertEqual("{}  {}\n".format(partial_checksum(path, root, True), path).encode("utf-8"), expected)
+
+    def test_odd_file_names(self):
+        write_file(os.path.join(self.scanned, "café menu.php"), b"<?php\n")
+        write_file(os.fsdecode(os.path.join(self.scanned.encode("utf-8"), b"invalid-\xff.php")), b"<?php\n")
+
+        with mock.patch("builtins.print") as print_mock:
+            checksums = self.scan()
+
+        self.assertIn(os.path.join(self.scanned, "café menu.php"), checksums)
+        self.assertEqual(len(checksums), 4)
+        self.assertIn("isn't valid UTF-8", print_mock.call_args[0][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import os
+import tempfile
+import unittest
+from argparse import Namespace
+from http.client import HTTPConnection
+from unittest import mock
+
+from dear.remote_integrity import __main__ as main
+from dear.remote_integrity import models
+from dear.remote_integrity.exceptions import MetricsException
+from dear.remote_integrity.metrics import Metrics
+from dear.remote_integrity.models import session, use_database, prepare_database, ScanRun
+from dear.remote_integrity.notifier import Notifier
+from dear.remote_integrity.pipeline import Pipeline
+
+from tests.helpers import write_config, write_file
+
+
+class MetricsTextfileTest(unittest.TestCase):
+    """
+    Metrics written to a node_exporter textfile
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "remote_integrity.prom")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_counters_stay_monotonic_across_runs(self):
+        for run in range(2):
+            metrics = Metrics()
+            metrics.load_textfile(self.path)
+            metrics.increment("runs_total", server='web "01"', status="success")
+            metrics.observe("phase_duration_seconds", 2.0, server='web "01"', phase="acquire")
+            metrics.write_textfile(self.path)
+
+        with open(self.path) as file:
+            text = file.read()
+
+        self.assertIn('remote_integrity_runs_total{server="web \\"01\\"",status="success"} 2', text)
+        self.assertIn('remote_integrity_phase_duration_seconds_bucket{phase="acquire",server="web \\"01\\"",le="5.0"} 2', text)
+        self.assertIn('remote_integrity_phase_duration_seconds_bucket{phase="acquire",server="web \\"01\\"",le="1.0"} 0', text)
+        self.assertIn('remote_integrity_phase_duration_seconds_sum{phase="acquire",server="web \\"01\\""} 4.0', text)
+
+    def test_unwritable_textfile(self):
+        with self.assertRaises(MetricsException):
+            Metrics().write_textfile(os.path.join(self.directory.name, "missing", "remote_integrity.prom"))
+
+
+class ScanServersTest(unittest.TestCase):
+    """
+    Passes over multiple servers, as run by the daemon
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scanned = os.path.join(self.directory.name, "www")
+        self.pipeline = Pipeline(1)
+        write_file(os.path.join(self.scanned, "index.php"), b"<?php echo 'hello';\n")
+        self.configs = [write_config(self.directory.name, self.scanned, server_name=name) for name in ("broken", "web-01")]
+        use_database(self.configs[0].database_path)
+        prepare_database()
+
+    def tearDown(self):
+        self.pipeline.close()
+        session.close()
+        models.engine.dispose()
+        self.directory.cleanup()
+
+    def test_unexpected_error_only_fails_its_server(self):
+        metrics = Metrics()
+        args = Namespace(quick=False, transport="auto", concurrency=2)
+        identify = main.identify
+
+        def fail_broken_server(config, *arguments):
+            if config.server_name == "broken":
+                raise KeyError("unexpected")
+
+            return identify(config, *arguments)
+
+        with mock.patch.object(main, "identify", side_effect=fail_broken_server):
+            main.scan_servers(self.configs, metrics, self.pipeline, Notifier(), args)
+            main.scan_servers(self.configs, metrics, self.pipeline, Notifier(), args)
+
+        self.assertEqual(metrics.counters[("runs_total", (("server", "broken"), ("status", "failed")))], 2)
+        self.assertEqual(metrics.counters[("runs_total", (("server", "web-01"), ("status", "success")))], 2)
+        self.assertEqual([run.status for run in session.query(ScanRun).order_by(ScanRun.id)], [ScanRun.SUCCESS] * 2)
+
+
+class MetricsEndpointTest(unittest.TestCase):
+    """
+    Metrics served over HTTP
+    """
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.server = self.metrics.serve("127.0.0.1", 0)
+        self.connection = HTTPConnection("127.0.0.1", self.server.server_address[1], timeout=10)
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self, path):
+        self.connection.request("GET", path)
+        response = self.connection.getresponse()
+        return response.status, response.getheader("Content-Type"), response.read().decode("utf-8")
+
+    def test_metrics_are_served(self):
+        self.metrics.increment("runs_total", server="web-01", status="success")
+        self.metrics.observe("phase_duration_seconds", 0.25, server="web-01", phase="acquire")
+        status, content_type, body = self.get("/metrics")
+
+        self.assertEqual(status, 200)
+        self.assertTrue(content_type.startswith("text/plain; version=0.0.4"))
+        self.assertIn('remote_integrity_runs_total{server="web-01",status="success"} 1', body)
+        self.assertIn('remote_integrity_phase_duration_seconds_count{phase="acquire",server="web-01"} 1', body)
+
+    def test_metrics_are_current(self):
+        self.metrics.increment("files_hashed_total", 10, server="web-01")
+        self.get("/metrics")
+        self.metrics.increment("files_hashed_total", 5, server="web-01")
+
+        self.assertIn('remote_integrity_files_hashed_total{server="web-01"} 15', self.get("/metrics")[2])
+
+    def test_other_paths_are_not_found(self):
+        self.assertEqual(self.get("/")[0], 404)
+
+    def test_port_in_use(self):
+        with self.assertRaises(MetricsException):
+            self.metrics.serve("127.0.0.1", self.server.server_address[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy import Boolean, Column, Integer, MetaData, String, Table
+
+from dear.remote_integrity import models
+from dear.remote_integrity.models import session, use_database, prepare_database, Checksum, Directory, Event, Server
+
+from tests.helpers import write_baseline_database
+
+BASELINE_ROWS = """
+INSERT INTO servers (id, name) VALUES (1, 'web-01');
+INSERT INTO checksums (id, path, checksum, server_id) VALUES (1, '/var/www/index.php', '{a}', 1);
+INSERT INTO checksums (id, path, checksum, server_id) VALUES (2, '/var/www/lib/db.php', '{b}', 1);
+INSERT INTO events (id, event, description, timestamp, checksum_id)
+    VALUES (1, 3, 'A file modification was detected at ''/var/www/index.php''', '2017-05-01 12:00:00.000000', 1);
+""".format(a="a" * 128, b="b" * 128)
+
+
+class UpgradeDatabaseTest(unittest.TestCase):
+    """
+    Upgrades of databases that were created with the baseline schema
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "integrity.db")
+
+        write_baseline_database(self.path, BASELINE_ROWS)
+
+        use_database(self.path)
+
+    def tearDown(self):
+        session.close()
+        models.engine.dispose()
+        self.directory.cleanup()
+
+    def test_upgrade_keeps_checksums_and_events(self):
+        prepare_database()
+        server = Server.get("web-01")
+
+        self.assertEqual(sorted(Checksum.get_index(server, "default")), [
+            (1, "/var/www/index.php", "a" * 128),
+            (2, "/var/www/lib/db.php", "b" * 128),
+        ])
+        self.assertEqual([(checksum.root, checksum.hash_mode) for checksum in session.query(Checksum)], [("default", "full")] * 2)
+        self.assertEqual(session.query(Event).one().checksum_id, 1)
+        self.assertNotIn("checksums_old", models.inspect(models.engine).get_table_names())
+
+    def test_upgrade_backfills_events_and_never_reuses_their_ids(self):
+        prepare_database()
+        event = session.query(Event).one()
+
+        self.assertEqual((event.id, event.server.name, event.path), (1, "web-01", "/var/www/index.php"))
+
+        session.delete(event)
+        session.commit()
+        event = Event.create(Event.FILE_ADDED, "/var/www/new.php", Server.get("web-01"), 1)
+        session.commit()
+        self.assertEqual(event.id, 2)
+
+    def test_upgrade_is_repeatable(self):
+        prepare_database()
+        session.close()
+        prepare_database()
+
+        self.assertEqual(session.query(Checksum).count(), 2)
+
+    def test_failed_upgrade_keeps_old_table(self):
+        with mock.patch.object(Directory, "get_ids", side_effect=RuntimeError("interrupted")):
+            with self.assertRaises(RuntimeError):
+                prepare_database()
+
+        columns = set(column["name"] for column in models.inspect(models.engine).get_columns("checksums"))
+        self.assertIn("path", columns)
+        self.assertNotIn("checksums_old", models.inspect(models.engine).get_table_names())
+        self.assertEqual(session.execute("SELECT COUNT(*) FROM checksums").scalar(), 2)
+
+        prepare_database()
+        self.assertEqual(len(list(Checksum.get_index(Server.get("web-01"), "default"))), 2)
+
+    def test_added_columns_have_sql_defaults(self):
+        table = Table("servers", MetaData(), Column("id", Integer, primary_key=True), Column("enabled", Boolean, default=True, nullable=False),
+                      Column("note", String, default="it's"))
+
+        for column in list(table.columns)[1:]:
+            models._add_column(table, column)
+
+        session.execute("INSERT INTO servers (id, name) VALUES (2, 'web-02')")
+        self.assertEqual(list(session.execute("SELECT enabled, note FROM servers WHERE id = 2")), [(1, "it's")])
+        self.assertEqual([(row[1], row[3], row[4]) for row in session.execute("PRAGMA table_info(servers)")][2:],
+                         [("enabled", 1, "1"), ("note", 0, "'it''s'")])
+
+
+class ModelKeysTest(unittest.TestCase):
+    """
+    Keys of the records of the models
+    """
+
+    def test_keys_follow_column_order(self):
+        self.assertEqual(Event.keys()[:4], ["id", "event", "path", "description"])
+        self.assertEqual(Checksum.keys()[:4], ["id", "path", "root", "checksum"])
+        self.assertNotIn("directory_id", Checksum.keys())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import email
+import json
+import socketserver
+import threading
+import unittest
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from dear.remote_integrity.notifier import Notifier, TelegramClient
+
+ServerConfig = namedtuple("ServerConfig", [
+    "server_name", "server_address", "server_port", "email_smtp_host", "email_smtp_user", "email_smtp_pass",
+    "email_noreply_address", "email_recipients", "telegram_api_url", "telegram_api_token", "telegram_api_chat_id",
+])
+
+Description = namedtuple("Description", ["description"])
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    """
+    Minimal SMTP dialogue, every connection and every delivered message is recorded on the server
+    """
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 localhost stand-in")
+        recipients = []
+
+        for line in iter(self.rfile.readline, b""):
+            command = line.decode("utf-8").strip().upper()
+
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250 localhost")
+            elif command.startswith("RCPT TO:"):
+                recipients.append(line.decode("utf-8").strip()[8:].strip("<>"))
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = b"".join(iter(lambda: self.rfile.readline(), b".\r\n"))
+                self.server.messages.append((recipients, email.message_from_bytes(data)))
+                recipients = []
+                self.reply("250 OK")
+
+                if self.server.close_after_message:
+                    return
+            elif command == "QUIT":
+                return self.reply("221 Bye")
+            else:
+                self.reply("250 OK")
+
+    def reply(self, text):
+        self.wfile.write(text.encode("utf-8") + b"\r\n")
+
+
+class SmtpStub(socketserver.ThreadingTCPServer):
+    """
+    SMTP server on the loopback interface
+    """
+
+    daemon_threads = True
+
+    def __init__(self, close_after_message=False):
+        super().__init__(("127.0.0.1", 0), SmtpHandler)
+        self.connections = 0
+        self.messages = []
+        self.close_after_message = close_after_message
+        threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+
+    @property
+    def host(self):
+        return "127.0.0.1:{}".format(self.server_address[1])
+
+
+class TelegramHandler(BaseHTTPRequestHandler):
+    """
+    Bot API stand-in that accepts every message over keep-alive connections
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8"))
+        self.server.requests.append((self.path, request))
+        ok = request["chat_id"] != self.server.failing_chat_id
+        body = json.dumps({"ok": ok, "description": None if ok else "Bad Request: chat not found"}).encode("utf-8")
+
+        self.send_response(200 if ok else 400)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TelegramStub(HTTPServer):
+    """
+    HTTP server on the loopback interface
+    """
+
+    def __init__(self, failing_chat_id=None):
+        super().__init__(("127.0.0.1", 0), TelegramHandler)
+        self.connections = 0
+        self.requests = []
+        self.failing_chat_id = failing_chat_id
+        threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server_address[1])
+
+
+class NotifierTest(unittest.TestCase):
+    """
+    Digests sent over stand-in SMTP and Telegram servers
+    """
+
+    def setUp(self):
+        self.smtp = SmtpStub()
+        self.telegram = TelegramStub(failing_chat_id=13)
+        self.notifier = Notifier()
+
+    def tearDown(self):
+        self.notifier.close()
+
+        for server in (self.smtp, self.telegram):
+            server.shutdown()
+            server.server_close()
+
+    def get_config(self, name, recipients=("admin@example.com",), chat_id=42):
+        return ServerConfig(name, "10.0.0.1", 22, self.smtp.host, None, None, "noreply@example.com", list(recipients),
+                            self.telegram.url, "TOKEN", chat_id)
+
+    def test_mail_digest_per_recipient(self):
+        self.notifier.queue_mail(self.get_config("web-01"), [Description("A new file was detected at '/a'")])
+        self.notifier.queue_mail(self.get_config("web-02", ["admin@example.com", "ops@example.com"]),
+                                 [Description("A file removal was detected at '/b'"), Description("A file removal was detected at '/c'")])
+        self.notifier.flush()
+
+        messages = {recipients[0]: message for recipients, message in self.smtp.messages}
+        self.assertEqual(sorted(messages), ["admin@example.com", "ops@example.com"])
+        self.assertEqual(messages["admin@example.com"]["Subject"], "Suspicious activity detected (3 incidents)")
+        self.assertIn("web-01", messages["admin@example.com"].get_payload())
+        self.assertIn("web-02", messages["admin@example.com"].get_payload())
+        self.assertNotIn("web-01", messages["ops@example.com"].get_payload())
+
+    def test_smtp_connection_is_reused(self):
+        for name in ("web-01", "web-02", "web-03"):
+            self.notifier.queue_mail(self.get_config(name), [Description("A new file was detected at '/a'")])
+            self.notifier.flush()
+
+        self.assertEqual(len(self.smtp.messages), 3)
+        self.assertEqual(self.smtp.connections, 1)
+
+    def test_smtp_reconnects_after_server_closed_connection(self):
+        self.smtp.close_after_message = True
+
+        for name in ("web-01", "web-02"):
+            self.notifier.queue_mail(self.get_config(name), [Description("A new file was detected at '/a'")])
+            self.notifier.flush()
+
+        self.assertEqual(len(self.smtp.messages), 2)
+        self.assertEqual(self.smtp.connections, 2)
+
+    def test_telegram_digest_per_chat(self):
+        self.notifier.queue_telegram(self.get_config("web-01"), [Description("A new file was detected at '/a'")])
+        self.notifier.queue_telegram(self.get_config("web-02"), [Description("A new file was detected at '/b'")])
+        self.notifier.queue_telegram(self.get_config("web-03", chat_id=7), [Description("A new file was detected at '/c'")])
+        self.notifier.flush()
+
+        messages = {request["chat_id"]: request["text"] for path, request in self.telegram.requests}
+        self.assertEqual(set(path for path, request in self.telegram.requests), {"/botTOKEN/sendMessage"})
+        self.assertEqual(sorted(messages), [7, 42])
+        self.assertIn("web-01", messages[42])
+        self.assertIn("web-02", messages[42])
+        self.assertNotIn("web-03", messages[42])
+
+    def test_telegram_connection_is_reused(self):
+        for name in ("web-01", "web-02", "web-03"):
+            self.notifier.queue_telegram(self.get_config(name), [Description("A new file was detected at '/a'")])
+            self.notifier.flush()
+
+        self.assertEqual(len(self.telegram.requests), 3)
+        self.assertEqual(self.telegram.connections, 1)
+
+    def test_failing_chat_doesnt_stop_others(self):
+        self.notifier.queue_telegram(self.get_config("web-01", chat_id=13), [Description("A new file was detected at '/a'")])
+        self.notifier.queue_telegram(self.get_config("web-02"), [Description("A new file was detected at '/b'")])
+        self.notifier.flush()
+
+        self.assertEqual([request["chat_id"] for path, request in self.telegram.requests], [13, 42])
+
+    def test_long_messages_are_split(self):
+        TelegramClient("TOKEN", self.telegram.url).send_message(42, "\n".join("line {}".format(i) for i in range(1000)))
+
+        parts = [request["text"] for path, request in self.telegram.requests]
+        self.assertGreater(len(parts), 1)
+        self.assertTrue(all(len(part) <= TelegramClient.MAX_MESSAGE_LENGTH for part in parts))
+        self.assertEqual("".join(parts).splitlines(), ["line {}".format(i) for i in range(1000)])
+
+
+if __name__ == "__main__":
+    unittest.main()
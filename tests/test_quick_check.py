@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from dear.remote_integrity import __main__ as main
+from dear.remote_integrity import models
+from dear.remote_integrity.metrics import Metrics
+from dear.remote_integrity.models import session, use_database, prepare_database, Checksum, Event, Root, Server
+from dear.remote_integrity.notifier import Notifier
+from dear.remote_integrity.pipeline import Pipeline
+from dear.remote_integrity.quick_check import QuickCheck
+from dear.remote_integrity.schedule import AdaptiveSchedule, count_changes
+
+from tests.helpers import write_config, write_file
+
+
+class QuickCheckTest(unittest.TestCase):
+    """
+    Rotation of the sampled files of quick checks
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scanned = os.path.join(self.directory.name, "www")
+        self.slow = os.path.join(self.directory.name, "slow")
+        self.pipeline = Pipeline(1)
+
+        for i in range(40):
+            write_file(os.path.join(self.scanned, "{}.txt".format(i)), b"www")
+            write_file(os.path.join(self.slow, "{}.txt".format(i)), b"slow")
+
+        self.config = write_config(self.directory.name, self.scanned, "\n[root:slow]\ndirectories={}\nscan_interval=3600\n".format(self.slow),
+                                   roots="slow", quick_check_runs=4)
+        use_database(self.config.database_path)
+        prepare_database()
+
+        # Files that changed recently are high-risk and hashed more often, which would hide gaps in the rotation
+        self.recent_change = mock.patch.object(QuickCheck, "RECENT_CHANGE", 0)
+        self.recent_change.start()
+
+    def tearDown(self):
+        self.recent_change.stop()
+        self.pipeline.close()
+        session.close()
+        models.engine.dispose()
+        self.directory.cleanup()
+
+    def scan(self, quick=True):
+        configs = main.schedule_roots([self.config])
+        main.run_remote_integrity_checker(configs[0], Metrics(), self.pipeline, Notifier(), quick=quick)
+        return self.config.due_roots
+
+    def test_root_skipped_by_interval_misses_no_buckets(self):
+        # The first quick check hashes every file, since a full scan doesn't store the metadata of the files
+        self.scan(quick=False)
+        server = Server.get(self.config.server_name)
+        Root.get(server, "slow").scanned_at -= timedelta(hours=1)
+        session.commit()
+        self.scan()
+        scanned_at = Root.get(server, "slow").scanned_at
+
+        for run in range(8):
+            if run % 2 == 0:
+                Root.get(server, "slow").scanned_at -= timedelta(hours=1)
+                session.commit()
+
+            self.assertEqual(self.scan(), ["default", "slow"] if run % 2 == 0 else ["default"])
+
+        self.assertEqual(Root.get(server, "slow").quick_checks, 5)
+        self.assertTrue(all(verified_at > scanned_at for checksum, stat, verified_at in Checksum.get_stat_index(server, "slow").values()))
+        self.assertTrue(all(verified_at > scanned_at for checksum, stat, verified_at in Checksum.get_stat_index(server, "default").values()))
+
+
+class AdaptiveScheduleTest(unittest.TestCase):
+    """
+    Verification intervals learned from the change history of every directory
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.now = datetime(2017, 6, 1)
+        use_database(os.path.join(self.directory.name, "integrity.db"))
+        prepare_database()
+        self.server = Server.create("test")
+
+        for i in range(30):
+            self.add_event("/var/www/uploads/{}.jpg".format(i))
+
+        self.add_event("/var/www/lib/db.php")
+        self.add_event("/var/www/lib/old.php", timedelta(seconds=AdaptiveSchedule.HISTORY + 1))
+        session.commit()
+
+    def tearDown(self):
+        session.close()
+        models.engine.dispose()
+        self.directory.cleanup()
+
+    def add_event(self, path, age=timedelta(hours=1)):
+        Event.create(Event.FILE_MODIFIED, path, self.server, 1).timestamp = self.now - age
+
+    def test_count_changes(self):
+        self.assertEqual(count_changes(["/var/www/a.php", "/var/www/lib/b.php", "/var/www/lib/b.php"]),
+                         {"/var/www/lib": 2, "/var/www": 3, "/var": 3, "": 3})
+
+    def test_intervals_follow_change_history(self):
+        schedule = AdaptiveSchedule(self.server, 7 * 24 * 3600, self.now)
+
+        self.assertEqual(schedule.get_interval("/var/www/uploads"), 24 * 3600)
+        self.assertEqual(schedule.get_interval("/var/www/lib"), 7 * 24 * 3600)
+        self.assertEqual(schedule.get_interval("/srv/unchanged"), 7 * 24 * 3600)
+        self.assertEqual(schedule.get_volatile_directories(), [
+            ("/var/www", AdaptiveSchedule.HISTORY / 31), ("/var", AdaptiveSchedule.HISTORY / 31), ("", AdaptiveSchedule.HISTORY / 31),
+            ("/var/www/uploads", 24 * 3600),
+        ])
+
+    def test_files_are_due_once_their_interval_passed(self):
+        schedule = AdaptiveSchedule(self.server, 7 * 24 * 3600, self.now)
+        recently, days_ago = self.now - timedelta(hours=1), self.now - timedelta(days=2)
+
+        self.assertTrue(schedule.is_due("/var/www/lib/new.php", None))
+        self.assertFalse(schedule.is_due("/var/www/uploads/0.jpg", recently))
+        self.assertTrue(schedule.is_due("/var/www/uploads/0.jpg", days_ago))
+        self.assertFalse(schedule.is_due("/var/www/lib/db.php", days_ago))
+        self.assertTrue(schedule.is_due("/var/www/lib/db.php", days_ago, weight=4))
+        self.assertTrue(schedule.is_due("/var/www/lib/db.php", self.now - timedelta(days=7)))
+
+
+if __name__ == "__main__":
+    unittest.main()
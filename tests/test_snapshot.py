@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 DearBytes B.V. - All Rights Reserved
+import os
+import tempfile
+import unittest
+
+from dear.remote_integrity import __main__ as main
+from dear.remote_integrity import models
+from dear.remote_integrity.metrics import Metrics
+from dear.remote_integrity.models import session, use_database, prepare_database, Event
+from dear.remote_integrity.notifier import Notifier
+from dear.remote_integrity.pipeline import Pipeline
+from dear.remote_integrity.snapshot import Snapshot, diff_snapshots, diff_database
+
+from tests.helpers import write_config, write_file
+
+
+class SnapshotTest(unittest.TestCase):
+    """
+    Exporting, importing and comparing snapshots of a local server
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scanned = os.path.join(self.directory.name, "www")
+        self.odd = os.path.join(self.scanned, "uploads", "line break  and\rreturn.php")
+        self.pipeline = Pipeline(1)
+        write_file(os.path.join(self.scanned, "index.php"), b"<?php echo 'hello';\n")
+        write_file(os.path.join(self.scanned, "large.bin"), b"\0" * 300000)
+        write_file(self.odd, b"<?php\n")
+
+    def tearDown(self):
+        self.pipeline.close()
+        session.close()
+        models.engine.dispose()
+        self.directory.cleanup()
+
+    def export(self, name, **options):
+        path = os.path.join(self.directory.name, name)
+        main.export_snapshot(write_config(self.directory.name, self.scanned, **options), path)
+        return Snapshot(path)
+
+    def test_round_trip(self):
+        config = write_config(self.directory.name, self.scanned)
+        use_database(config.database_path)
+        prepare_database()
+
+        with self.export("old.snap") as old:
+            self.assertEqual(old.get("default", self.odd)[0], self.odd)
+            self.assertEqual(len(list(old.iterate_root("default"))), 3)
+            main.import_snapshot(config, old.path, Metrics(), self.pipeline, Notifier())
+
+        write_file(self.odd, b"<?php // modified\n")
+        os.remove(os.path.join(self.scanned, "index.php"))
+
+        with self.export("new.snap") as new:
+            with Snapshot(os.path.join(self.directory.name, "old.snap")) as old:
+                changes = diff_snapshots(old, new, "default")
+
+            self.assertEqual(changes.removed, [(None, os.path.join(self.scanned, "index.php"))])
+            self.assertEqual([path for checksum_id, path, checksum in changes.modified], [self.odd])
+            self.assertEqual(diff_database(new, "default", self.pipeline)._replace(removed=[], modified=[]), changes._replace(removed=[], modified=[]))
+            self.assertEqual([path for checksum_id, path, checksum in diff_database(new, "default", self.pipeline).modified], [self.odd])
+
+            main.import_snapshot(config, new.path, Metrics(), self.pipeline, Notifier())
+
+        self.assertEqual(sorted((event.event, event.path) for event in session.query(Event)),
+                         [(Event.FILE_REMOVED, os.path.join(self.scanned, "index.php")), (Event.FILE_MODIFIED, self.odd)])
+
+    def test_changed_hash_mode_is_modified(self):
+        with self.export("full.snap") as old, self.export("partial.snap", partial_hash_threshold=100000) as new:
+            changes = diff_snapshots(old, new, "default")
+
+        self.assertEqual([path for checksum_id, path, checksum in changes.modified], [os.path.join(self.scanned, "large.bin")])
+        self.assertEqual(changes.rehashed, [])
+
+
+if __name__ == "__main__":
+    unittest.main()